@@ -95,6 +95,42 @@ class Resource(object):
         wrapper.exposed = True
         return wrapper
 
+    def generate_async_action_handler(self, action_name, action_args=None):
+        """
+        Same as generate_action_handler() for actions run as a task: the
+        model function returns the task, which is rendered with status 202.
+        The request is validated against the action schema, and arguments
+        missing from it are passed as None.
+        """
+        def wrapper(*args, **kwargs):
+            validate_method(('POST'))
+            try:
+                model_args = list(self.model_args)
+                if action_args is not None:
+                    request = parse_request()
+                    validate_params(request, self, action_name)
+                    model_args.extend(request.get(key) for key in action_args)
+                fn = getattr(self.model, model_fn(self, action_name))
+                task = fn(*model_args)
+                cherrypy.response.status = 202
+                return kimchi.template.render('Task', task)
+            except MissingParameter, e:
+                raise cherrypy.HTTPError(400, e.message)
+            except InvalidParameter, e:
+                raise cherrypy.HTTPError(400, e.message)
+            except InvalidOperation, e:
+                raise cherrypy.HTTPError(400, e.message)
+            except OperationFailed, e:
+                raise cherrypy.HTTPError(500, e.message)
+            except NotFoundError, e:
+                raise cherrypy.HTTPError(404, e.message)
+            except KimchiException, e:
+                raise cherrypy.HTTPError(500, e.message)
+
+        wrapper.__name__ = action_name
+        wrapper.exposed = True
+        return wrapper
+
     def lookup(self):
         try:
             lookup = getattr(self.model, model_fn(self, 'lookup'))
@@ -18,14 +18,44 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
 import cherrypy
+import multiprocessing
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 
 
 from kimchi.control.base import Collection, Resource
 from kimchi.control.storagevolumes import IsoVolumes, StorageVolumes
 from kimchi.control.utils import get_class_name, model_fn
 from kimchi.control.utils import validate_params
+from kimchi.exception import NotFoundError
 from kimchi.model.storagepools import ISO_POOL_NAME
 from kimchi.control.utils import UrlSubNode
+from kimchi.utils import kimchi_log
+
+
+# Maximum number of pools looked up at the same time
+POOL_LOOKUP_WORKERS = 8
+# Time (in seconds) the listing waits for all pools before reporting the
+# ones still pending as stale
+POOL_LOOKUP_DEADLINE = 5
+
+_lookup_workers = None
+_lookup_workers_lock = threading.Lock()
+
+
+def _get_lookup_workers():
+    """
+    Return the thread pool shared by all storage pool listings. It is
+    never closed, so a lookup hung on a dead NFS server keeps one of its
+    POOL_LOOKUP_WORKERS threads busy instead of leaking a new thread on
+    every listing.
+    """
+    global _lookup_workers
+    with _lookup_workers_lock:
+        if _lookup_workers is None:
+            _lookup_workers = ThreadPool(POOL_LOOKUP_WORKERS)
+        return _lookup_workers
 
 
 @UrlSubNode("storagepools", True, ['POST', 'DELETE'])
@@ -35,6 +65,12 @@ class StoragePools(Collection):
         self.resource = StoragePool
         isos = IsoPool(model)
         setattr(self, ISO_POOL_NAME, isos)
+        # Last known description of each pool
+        self.last_info = {}
+        # Lookups still running in the shared workers, by pool name. Shared
+        # by the listings served at the same time.
+        self.running_lookups = {}
+        self.running_lookups_lock = threading.Lock()
 
     def create(self, params, *args):
         try:
@@ -57,16 +93,95 @@ class StoragePools(Collection):
 
         return resp
 
-    def _get_resources(self, filter_params):
+    def _lookup_pool(self, res):
+        start = time.time()
+        res.lookup()
+        return time.time() - start
+
+    def _stale_pool(self, res):
+        info = dict(self.last_info.get(res.ident, {}))
+        for key in ('capacity', 'allocated', 'available', 'nr_volumes'):
+            info.setdefault(key, 0)
+        info.setdefault('path', '')
+        info.setdefault('source', {})
+        info.setdefault('type', 'unknown')
+        info.setdefault('autostart', False)
+        info.setdefault('persistent', True)
+        info.update({'state': 'unknown', 'stale': True})
+        res.info = info
+        return res
+
+    def _get_pool_resources(self, get_list, flag_filter):
+        """
+        Look up all pools in a bounded thread pool, so a single hung pool
+        (e.g. a NFS pool whose server went away) does not block the whole
+        listing. Pools not answering within POOL_LOOKUP_DEADLINE seconds
+        are reported with state 'unknown' and marked as stale. The other
+        ones report the time their lookup took as 'lookup_latency'.
+        """
+        idents = get_list(*self.model_args, **flag_filter)
+        if not idents:
+            return []
+
+        workers = _get_lookup_workers()
+        pending = []
+        with self.running_lookups_lock:
+            for ident in idents:
+                args = self.resource_args + [ident]
+                res = self.resource(self.model, *args)
+                result = self.running_lookups.get(ident)
+                if result is not None and not result.ready():
+                    # Still hung since an earlier listing: do not queue
+                    # another lookup of the same pool behind it
+                    pending.append((res, None))
+                    continue
+                result = workers.apply_async(self._lookup_pool, (res,))
+                self.running_lookups[ident] = result
+                pending.append((res, result))
+
+        deadline = time.time() + POOL_LOOKUP_DEADLINE
+        res_list = []
+        for res, result in pending:
+            try:
+                if result is None:
+                    raise multiprocessing.TimeoutError()
+                latency = result.get(max(0, deadline - time.time()))
+            except multiprocessing.TimeoutError:
+                kimchi_log.warning("Storage pool %s lookup did not finish "
+                                   "in %s seconds", res.ident,
+                                   POOL_LOOKUP_DEADLINE)
+                res_list.append(self._stale_pool(res))
+                continue
+            except NotFoundError:
+                # Pool removed between listing and lookup
+                self._lookup_done(res.ident, result)
+                continue
+
+            self._lookup_done(res.ident, result)
+            self.last_info[res.ident] = res.info
+            res.info = dict(res.info, lookup_latency=latency)
+            kimchi_log.debug("Storage pool %s looked up in %.3f seconds",
+                             res.ident, latency)
+            res_list.append(res)
+        return res_list
+
+    def _lookup_done(self, ident, result):
+        with self.running_lookups_lock:
+            # Unless a later listing already started a new lookup
+            if self.running_lookups.get(ident) is result:
+                del self.running_lookups[ident]
+
+    def _get_resources(self, flag_filter):
         try:
-            res_list = super(StoragePools, self)._get_resources(filter_params)
-            # Append reserved pools
-            isos = getattr(self, ISO_POOL_NAME)
-            isos.lookup()
-            res_list.append(isos)
+            get_list = getattr(self.model, model_fn(self, 'get_list'))
         except AttributeError:
-            pass
+            return []
 
+        res_list = self._get_pool_resources(get_list, flag_filter)
+        # Append reserved pools
+        isos = getattr(self, ISO_POOL_NAME)
+        isos.lookup()
+        res_list.append(isos)
         return res_list
 
 
@@ -93,9 +208,13 @@ class StoragePool(Resource):
                'autostart': self.info['autostart'],
                'persistent': self.info['persistent']}
 
-        val = self.info.get('task_id')
-        if val:
-            res['task_id'] = val
+        for key in ('task_id', 'stale', 'server_state', 'server_timestamp'):
+            val = self.info.get(key)
+            if val:
+                res[key] = val
+
+        if 'lookup_latency' in self.info:
+            res['lookup_latency'] = self.info['lookup_latency']
 
         return res
 
@@ -17,9 +17,20 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
+import re
+
+import cherrypy
+from cherrypy.lib import httputil
+
 import kimchi.template
 from kimchi.control.base import Collection, Resource
-from kimchi.control.utils import get_class_name, model_fn
+from kimchi.control.utils import get_class_name, model_fn, validate_method
+from kimchi.exception import InvalidOperation, InvalidParameter
+from kimchi.exception import KimchiException, NotFoundError, OperationFailed
+
+
+# Content-Range of an upload resuming at a given offset
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
 
 
 class StorageVolumes(Collection):
@@ -30,6 +41,21 @@ class StorageVolumes(Collection):
         self.resource_args = [self.pool, ]
         self.model_args = [self.pool, ]
 
+    def _get_resources(self, flag_filter):
+        # Volumes info is retrieved in bulk instead of one lookup() per volume
+        try:
+            get_list_info = getattr(self.model,
+                                    model_fn(self, 'get_list_info'))
+            res_list = []
+            for ident, info in get_list_info(*self.model_args, **flag_filter):
+                args = self.resource_args + [ident]
+                res = self.resource(self.model, *args)
+                res.info = info
+                res_list.append(res)
+            return res_list
+        except AttributeError:
+            return []
+
 
 class StorageVolume(Resource):
     def __init__(self, model, pool, ident):
@@ -39,8 +65,13 @@ class StorageVolume(Resource):
         self.info = {}
         self.model_args = [self.pool, self.ident]
         self.uri_fmt = '/storagepools/%s/storagevolumes/%s'
-        self.resize = self.generate_action_handler('resize', ['size'])
-        self.wipe = self.generate_action_handler('wipe')
+        self.resize = self.generate_async_action_handler('resize', ['size'])
+        self.wipe = self.generate_async_action_handler('wipe', ['rate'])
+        self.flatten = self.generate_async_action_handler('flatten')
+        self.clone = self.generate_async_action_handler('clone',
+                                                        ['name', 'pool',
+                                                         'rate'])
+        self.content = StorageVolumeContent(model, pool, ident)
 
     @property
     def data(self):
@@ -60,6 +91,115 @@ class StorageVolume(Resource):
         return res
 
 
+class StorageVolumeContent(object):
+    """
+    Data of a storage volume: GET downloads it (Range is supported) and PUT
+    uploads it (Content-Range is supported, to resume an upload, and so is
+    chunked Transfer-Encoding). Bodies are streamed between the client and
+    libvirt, never stored in memory or on disk as a whole.
+    """
+    _cp_config = {'request.process_request_body': False,
+                  'response.stream': True}
+
+    def __init__(self, model, pool, ident):
+        self.model = model
+        self.pool = pool
+        self.ident = ident
+
+    def _download(self):
+        size = self.model.storagevolume_content_size(self.pool, self.ident)
+        offset = length = 0
+        headers = cherrypy.response.headers
+        if size is not None:
+            headers['Accept-Ranges'] = 'bytes'
+            headers['Content-Length'] = str(size)
+            ranges = httputil.get_ranges(cherrypy.request.headers.get('Range'),
+                                         size)
+            if ranges == []:
+                headers['Content-Range'] = 'bytes */%d' % size
+                raise cherrypy.HTTPError(416)
+            if ranges and len(ranges) == 1:
+                start, stop = ranges[0]
+                offset, length = start, stop - start
+                cherrypy.response.status = 206
+                headers['Content-Range'] = 'bytes %d-%d/%d' % (start, stop - 1,
+                                                               size)
+                headers['Content-Length'] = str(length)
+
+        headers['Content-Type'] = 'application/octet-stream'
+        return self.model.storagevolume_download(self.pool, self.ident,
+                                                 offset, length)
+
+    def _upload(self):
+        headers = cherrypy.request.headers
+        length = headers.get('Content-Length')
+        chunked = 'chunked' in headers.get('Transfer-Encoding', '').lower()
+        if length is not None:
+            length = int(length)
+        elif not chunked:
+            raise InvalidParameter("KCHVOL0026E", {'name': self.ident})
+
+        offset = 0
+        content_range = headers.get('Content-Range')
+        if content_range:
+            match = CONTENT_RANGE_RE.match(content_range)
+            if match is None:
+                raise InvalidParameter("KCHVOL0025E", {'name': self.ident})
+            offset = int(match.group(1))
+            range_length = int(match.group(2)) - offset + 1
+            if length is not None and range_length != length:
+                raise InvalidParameter("KCHVOL0025E", {'name': self.ident})
+            length = range_length
+
+        # The request body is not processed by CherryPy, it is read from
+        # rfile. The task is listed in /tasks as soon as the transfer is set
+        # up.
+        transfer = self.model.storagevolume_upload(self.pool, self.ident,
+                                                   cherrypy.request.rfile,
+                                                   offset, length)
+        task = next(transfer)
+        if chunked:
+            # Sent right away, so the progress can be followed while the
+            # body is being sent
+            cherrypy.response.status = 202
+            return self._upload_response(kimchi.template.render('Task', task),
+                                         transfer)
+
+        # The HTTP server discards the rest of a body with a Content-Length
+        # as soon as the response headers are sent, so the body is read
+        # first and the response is the final state of the task
+        for task in transfer:
+            pass
+        return kimchi.template.render('Task', task)
+
+    def _upload_response(self, task, transfer):
+        yield task
+        try:
+            for i in transfer:
+                pass
+        except KimchiException:
+            # Reported by the task
+            pass
+
+    @cherrypy.expose
+    def index(self, *args, **kwargs):
+        method = validate_method(('GET', 'PUT'))
+        try:
+            if method == 'GET':
+                return self._download()
+            return self._upload()
+        except InvalidOperation, e:
+            raise cherrypy.HTTPError(400, e.message)
+        except InvalidParameter, e:
+            raise cherrypy.HTTPError(400, e.message)
+        except NotFoundError, e:
+            raise cherrypy.HTTPError(404, e.message)
+        except OperationFailed, e:
+            raise cherrypy.HTTPError(500, e.message)
+        except KimchiException, e:
+            raise cherrypy.HTTPError(500, e.message)
+
+
 class IsoVolumes(Collection):
     def __init__(self, model, pool):
         super(IsoVolumes, self).__init__(model)
@@ -35,5 +35,6 @@ class Task(Resource):
     @property
     def data(self):
         return {'id': self.ident,
+                'target_uri': self.info['target_uri'],
                 'status': self.info['status'],
                 'message': self.info['message']}
@@ -34,7 +34,7 @@ class Template(Resource):
         self.update_params = ["name", "folder", "icon", "os_distro",
                               "storagepool", "os_version", "cpus",
                               "memory", "cdrom", "disks", "networks",
-                              "graphics"]
+                              "graphics", "warm_pool"]
         self.uri_fmt = "/templates/%s"
         self.clone = self.generate_action_handler('clone')
 
@@ -52,4 +52,5 @@ class Template(Resource):
                 'storagepool': self.info['storagepool'],
                 'networks': self.info['networks'],
                 'folder': self.info.get('folder', []),
+                'warm_pool': self.info.get('warm_pool', 0),
                 'graphics': self.info['graphics']}
@@ -17,8 +17,12 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
+import cherrypy
+
+import kimchi.template
 from kimchi.control.base import Collection, Resource
 from kimchi.control.utils import internal_redirect, UrlSubNode
+from kimchi.control.utils import validate_params
 from kimchi.control.vm import sub_nodes
 
 
@@ -28,6 +32,16 @@ class VMs(Collection):
         super(VMs, self).__init__(model)
         self.resource = VM
 
+    def create(self, params, *args):
+        if 'count' not in params:
+            return super(VMs, self).create(params, *args)
+
+        # Several VMs are created by a task
+        validate_params(params, self, 'create')
+        task = self.model.vms_create_batch(params)
+        cherrypy.response.status = 202
+        return kimchi.template.render('Task', task)
+
 
 class VM(Resource):
     def __init__(self, model, ident):
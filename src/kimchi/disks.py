@@ -17,25 +17,27 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
+import os
 import re
 import subprocess
+import threading
+import time
 
 from parted import Device as PDevice
 from parted import Disk as PDisk
 
 from kimchi.exception import OperationFailed
-from kimchi.utils import kimchi_log
 
 
-def _get_dev_node_path(maj_min):
-    """ Returns device node path given the device number 'major:min' """
-    uevent = "/sys/dev/block/%s/uevent" % maj_min
-    with open(uevent) as ueventf:
-        content = ueventf.read()
+# The inventory is reused while no block device appears or disappears and
+# nothing gets mounted or unmounted, but at most INVENTORY_TTL seconds, as
+# changes of file systems and volume groups are not visible in sysfs
+INVENTORY_TTL = 30
+INVENTORY_KEYS = ["NAME", "KNAME", "PKNAME", "TYPE", "FSTYPE", "SIZE",
+                  "MOUNTPOINT"]
 
-    data = dict(re.findall(r'(\S+)=(".*?"|\S+)', content.replace("\n", " ")))
-
-    return "/dev/%s" % data["DEVNAME"]
+_inventory = {'signature': None, 'timestamp': 0, 'devices': {}}
+_inventory_lock = threading.Lock()
 
 
 def _get_lsblk_devs(keys, devs=[]):
@@ -49,124 +51,116 @@ def _get_lsblk_devs(keys, devs=[]):
     return _parse_lsblk_output(out, keys)
 
 
-def _get_dev_major_min(name):
-    maj_min = None
-
-    keys = ["NAME", "MAJ:MIN"]
-    dev_list = _get_lsblk_devs(keys)
-
-    for dev in dev_list:
-        if dev['name'] == name:
-            maj_min = dev['maj:min']
-            break
-    else:
-        raise OperationFailed("KCHDISKS0002E", {'device': name})
-
-    return maj_min
-
-
-def _is_dev_leaf(devNodePath):
-    try:
-        # By default, lsblk prints a device information followed by children
-        # device information
-        childrenCount = len(
-            _get_lsblk_devs(["NAME"], [devNodePath])) - 1
-    except OperationFailed as e:
-        # lsblk is known to fail on multipath devices
-        # Assume these devices contain children
-        kimchi_log.error(
-            "Error getting device info for %s: %s", devNodePath, e)
-        return False
-
-    return childrenCount == 0
-
-
-def _is_dev_extended_partition(devType, devNodePath):
-    if devType != 'part':
-        return False
-    diskPath = devNodePath.rstrip('0123456789')
-    device = PDevice(diskPath)
-    disk = PDisk(device)
-    if disk.getExtendedPartition().path == devNodePath:
-        return True
-    return False
-
-
 def _parse_lsblk_output(output, keys):
     # output is on format key="value",
     # where key can be NAME, TYPE, FSTYPE, SIZE, MOUNTPOINT, etc
     lines = output.rstrip("\n").split("\n")
     r = []
     for line in lines:
-        d = {}
-        for key in keys:
-            expression = r"%s=\".*?\"" % key
-            match = re.search(expression, line)
-            field = match.group()
-            k, v = field.split('=', 1)
-            d[k.lower()] = v[1:-1]
-        r.append(d)
+        fields = dict(re.findall(r'(\S+?)="(.*?)"', line))
+        r.append(dict((key.lower(), fields[key]) for key in keys))
     return r
 
 
-def _get_vgname(devNodePath):
-    """ Return volume group name of a physical volume. If the device node path
-    is not a physical volume, return empty string. """
+def _get_pvs_vgs():
+    """ Return the volume group name of every physical volume, indexed by
+    the real path of its device node. """
     pvs = subprocess.Popen(
         ["pvs", "--unbuffered", "--nameprefixes", "--noheadings",
-         "-o", "vg_name", devNodePath],
+         "-o", "pv_name,vg_name"],
         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     out, err = pvs.communicate()
     if pvs.returncode != 0:
-        return ""
+        return {}
 
-    return re.findall(r"LVM2_VG_NAME='([^\']*)'", out)[0]
+    pv_list = re.findall(r"LVM2_PV_NAME='([^\']*)'\s+LVM2_VG_NAME='([^\']*)'",
+                         out)
+    return dict((os.path.realpath(pv), vg) for pv, vg in pv_list)
 
 
-def get_partitions_names():
-    names = set()
-    keys = ["NAME", "TYPE", "FSTYPE", "MOUNTPOINT", "MAJ:MIN"]
-    # output is on format key="value",
-    # where key can be NAME, TYPE, FSTYPE, MOUNTPOINT
-    for dev in _get_lsblk_devs(keys):
+def _get_extended_partition(diskPath):
+    disk = PDisk(PDevice(diskPath))
+    extended = disk.getExtendedPartition()
+    return extended.path if extended else None
+
+
+def _build_inventory(devs, vgs, get_extended_partition):
+    """
+    Compute the partitions information from the output of a single
+    'lsblk' run ('devs', with INVENTORY_KEYS) and 'pvs' run ('vgs'). The
+    extended partition of each disk is only looked up, once, when one of its
+    partitions would otherwise be listed.
+    """
+    parents = set(dev['pkname'] for dev in devs if dev['pkname'])
+    extended = {}
+    inventory = {}
+    for dev in devs:
         # split()[0] to avoid the second part of the name, after the
         # whiteline
         name = dev['name'].split()[0]
-        devNodePath = _get_dev_node_path(dev['maj:min'])
+        # A device held by several others (multipath) is listed several times
+        if name in inventory:
+            continue
+
+        devNodePath = "/dev/%s" % dev['kname']
+        mountpoint = dev['mountpoint']
+        # Sometimes the mountpoint comes with [SWAP] or other
+        # info which is not an actual mount point. Filtering it
+        if re.search(r"\[.*\]", mountpoint) is not None:
+            mountpoint = ''
+
         # Only list unmounted and unformated and leaf and (partition or disk)
         # leaf means a partition, a disk has no partition, or a disk not held
         # by any multipath device. Physical volume belongs to no volume group
         # is also listed. Extended partitions should not be listed.
-        if not (dev['type'] in ['part', 'disk'] and
-                dev['fstype'] in ['', 'LVM2_member'] and
-                dev['mountpoint'] == "" and
-                _get_vgname(devNodePath) == "" and
-                _is_dev_leaf(devNodePath) and
-                not _is_dev_extended_partition(dev['type'], devNodePath)):
-            continue
+        available = (dev['type'] in ['part', 'disk'] and
+                     dev['fstype'] in ['', 'LVM2_member'] and
+                     dev['mountpoint'] == "" and
+                     vgs.get(devNodePath, "") == "" and
+                     dev['kname'] not in parents)
+        if available and dev['type'] == 'part':
+            diskPath = "/dev/%s" % dev['pkname']
+            if diskPath not in extended:
+                extended[diskPath] = get_extended_partition(diskPath)
+            available = extended[diskPath] != devNodePath
+
+        inventory[name] = {'name': name, 'path': devNodePath,
+                           'type': dev['type'], 'fstype': dev['fstype'],
+                           'size': dev['size'], 'mountpoint': mountpoint,
+                           'available': available}
+    return inventory
+
+
+def _get_signature():
+    with open('/proc/self/mounts') as mounts:
+        return (tuple(sorted(os.listdir('/sys/class/block'))),
+                hash(mounts.read()))
+
+
+def _get_inventory():
+    signature = _get_signature()
+    with _inventory_lock:
+        if signature == _inventory['signature'] and \
+                time.time() - _inventory['timestamp'] < INVENTORY_TTL:
+            return _inventory['devices']
+
+        devices = _build_inventory(_get_lsblk_devs(INVENTORY_KEYS),
+                                   _get_pvs_vgs(), _get_extended_partition)
+        _inventory.update({'signature': signature, 'timestamp': time.time(),
+                           'devices': devices})
+        return devices
 
-        names.add(name)
 
-    return list(names)
+def get_partitions_names():
+    return [name for name, dev in _get_inventory().iteritems()
+            if dev['available']]
 
 
 def get_partition_details(name):
-    dev_path = _get_dev_node_path(_get_dev_major_min(name))
-
-    keys = ["TYPE", "FSTYPE", "SIZE", "MOUNTPOINT"]
     try:
-        dev = _get_lsblk_devs(keys, [dev_path])[0]
-    except OperationFailed as e:
-        kimchi_log.error(
-            "Error getting partition info for %s: %s", name, e)
-        return {}
+        dev = _get_inventory()[name]
+    except KeyError:
+        raise OperationFailed("KCHDISKS0002E", {'device': name})
 
-    if dev['mountpoint']:
-        # Sometimes the mountpoint comes with [SWAP] or other
-        # info which is not an actual mount point. Filtering it
-        regexp = re.compile(r"\[.*\]")
-        if regexp.search(dev['mountpoint']) is not None:
-            dev['mountpoint'] = ''
-    dev['path'] = dev_path
-    dev['name'] = name
-    return dev
+    keys = ('name', 'path', 'type', 'fstype', 'size', 'mountpoint')
+    return dict((key, dev[key]) for key in keys)
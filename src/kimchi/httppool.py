@@ -0,0 +1,259 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import httplib
+import socket
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+
+from kimchi.basemodel import Singleton
+
+
+HTTP_TIMEOUT = 10
+MAX_IDLE_CONNECTIONS = 4
+MAX_REDIRECTS = 5
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+# URLChecker settings: seconds to wait for a server and seconds a reachable
+# (or unreachable) URL is reported as such without checking it again
+URL_CHECK_TIMEOUT = 5
+URL_CHECK_TTL = 300
+URL_CHECK_NEGATIVE_TTL = 30
+
+# Errors raised by HTTPPool.request(), for callers to catch
+HTTP_ERRORS = (httplib.HTTPException, socket.error, ValueError)
+
+
+class PooledResponse(object):
+    """
+    Response of HTTPPool.request(). Its connection goes back to the pool on
+    close() when the body was entirely read and the server keeps it alive;
+    otherwise the connection is closed.
+    """
+    def __init__(self, pool, key, conn, response, url):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.url = url
+        self.status = response.status
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, amt=None):
+        return self._response.read(amt)
+
+    def close(self):
+        if self._conn is None:
+            return
+        if self._response.isclosed() and not self._response.will_close:
+            self._pool._release(self._key, self._conn)
+        else:
+            self._conn.close()
+        self._conn = None
+
+
+class HTTPPool(object):
+    """
+    HTTP/HTTPS client keeping up to MAX_IDLE_CONNECTIONS keep-alive
+    connections per server, so the several small requests made to probe a
+    remote ISO share a single TCP (and TLS) handshake.
+    """
+    __metaclass__ = Singleton
+
+    def __init__(self, timeout=HTTP_TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def _new_connection(self, scheme, host, port, proxy):
+        conn_class = httplib.HTTPSConnection if scheme == 'https' else \
+            httplib.HTTPConnection
+        if proxy is None:
+            return conn_class(host, port, timeout=self.timeout)
+
+        proxy = urlparse.urlsplit(proxy)
+        if scheme == 'https':
+            conn = conn_class(proxy.hostname, proxy.port,
+                              timeout=self.timeout)
+            conn.set_tunnel(host, port)
+            return conn
+        return httplib.HTTPConnection(proxy.hostname, proxy.port,
+                                      timeout=self.timeout)
+
+    def _acquire(self, key, timeout):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                conn = idle.pop()
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+        conn = self._new_connection(*key)
+        conn.timeout = timeout
+        return conn, False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < MAX_IDLE_CONNECTIONS:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _request(self, method, url, headers, timeout):
+        parts = urlparse.urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError("Unsupported URL: %s" % url)
+
+        proxy = urllib.getproxies().get(parts.scheme)
+        if proxy and urllib.proxy_bypass(parts.hostname):
+            proxy = None
+        key = (parts.scheme, parts.hostname, parts.port, proxy)
+        target = urlparse.urlunsplit(('', '', parts.path or '/',
+                                      parts.query, ''))
+        if proxy and parts.scheme == 'http':
+            target = url
+
+        while True:
+            conn, reused = self._acquire(key, timeout)
+            try:
+                conn.request(method, target, headers=headers)
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if reused:
+                    # The server closed the idle connection, retry on a new
+                    # one
+                    continue
+                raise
+            if method == 'HEAD':
+                response.read()
+            return PooledResponse(self, key, conn, response, url)
+
+    def request(self, method, url, headers=None, timeout=None):
+        """
+        Send a request, following redirections, and return a
+        PooledResponse which must be closed by the caller. Raise one of
+        HTTP_ERRORS on failure. 'timeout' overrides the timeout of the pool
+        for this request.
+        """
+        headers = headers or {}
+        timeout = timeout or self.timeout
+        for i in xrange(MAX_REDIRECTS + 1):
+            response = self._request(method, url, headers, timeout)
+            location = response.getheader('location')
+            if response.status not in REDIRECT_CODES or not location:
+                return response
+            if method != 'HEAD':
+                response.read()
+            response.close()
+            url = urlparse.urljoin(url, location)
+
+        raise httplib.HTTPException("Too many redirections for %s" % url)
+
+
+class URLChecker(object):
+    """
+    Reachability test of URLs, shared by everything checking whether a
+    remote ISO or distro image is there.
+
+    HTTP(S) URLs are checked with a HEAD request on the keep-alive
+    connections of HTTPPool, with a short timeout. Results, positive or
+    negative, are kept for a while, and concurrent checks of the same URL
+    wait for the request already running instead of sending another one,
+    so a slow server costs one timeout for all of them.
+    """
+    __metaclass__ = Singleton
+
+    def __init__(self, timeout=URL_CHECK_TIMEOUT, ttl=URL_CHECK_TTL,
+                 negative_ttl=URL_CHECK_NEGATIVE_TTL):
+        self.timeout = timeout
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._http = HTTPPool()
+        self._lock = threading.Lock()
+        self._results = {}
+        self._checking = {}
+
+    def _check_http(self, url):
+        response = self._http.request('HEAD', url, timeout=self.timeout)
+        response.close()
+        if response.status not in (405, 501):
+            return response.status == 200
+
+        # HEAD not implemented by the server, get as little as possible
+        response = self._http.request('GET', url, {'Range': 'bytes=0-0'},
+                                      timeout=self.timeout)
+        try:
+            response.read()
+        finally:
+            response.close()
+        return response.status in (200, 206)
+
+    def _check(self, url):
+        try:
+            if urlparse.urlsplit(url).scheme in ('http', 'https'):
+                return self._check_http(url)
+            # Other protocols (e.g. FTP) are not pooled
+            response = urllib2.urlopen(url, timeout=self.timeout)
+            response.close()
+            return response.getcode() == 200
+        except HTTP_ERRORS + (urllib2.URLError,):
+            return False
+
+    def _expire(self, now):
+        for url, (reachable, timestamp) in self._results.items():
+            ttl = self.ttl if reachable else self.negative_ttl
+            if now - timestamp >= ttl:
+                del self._results[url]
+
+    def check(self, url):
+        """
+        Return whether 'url' can be retrieved.
+        """
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            if url in self._results:
+                return self._results[url][0]
+
+            flight = self._checking.get(url)
+            owner = flight is None
+            if owner:
+                flight = {'event': threading.Event(), 'reachable': False}
+                self._checking[url] = flight
+
+        if not owner:
+            flight['event'].wait()
+            return flight['reachable']
+
+        try:
+            flight['reachable'] = self._check(url)
+        finally:
+            with self._lock:
+                self._results[url] = (flight['reachable'], time.time())
+                del self._checking[url]
+            flight['event'].set()
+        return flight['reachable']
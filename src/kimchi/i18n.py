@@ -81,6 +81,9 @@ messages = {
     "KCHVM0019E": _("Unable to start virtual machine %(name)s. Details: %(err)s"),
     "KCHVM0020E": _("Unable to stop virtual machine %(name)s. Details: %(err)s"),
     "KCHVM0021E": _("Unable to delete virtual machine %(name)s. Details: %(err)s"),
+    "KCHVM0022E": _("Virtual machine name pattern %(pattern)s must contain %%d to create several virtual machines"),
+    "KCHVM0023E": _("SCSI volumes can not be assigned when creating several virtual machines"),
+    "KCHVM0024E": _("Number of virtual machines to create must be an integer greater than 0"),
 
     "KCHVMIF0001E": _("Interface %(iface)s does not exist in virtual machine %(name)s"),
     "KCHVMIF0002E": _("Network %(network)s specified for virtual machine %(name)s does not exist"),
@@ -107,6 +110,9 @@ messages = {
     "KCHTMPL0015E": _("Invalid storage pool URI %(value)s specified for template"),
     "KCHTMPL0016E": _("Specify an ISO image as CDROM to create a template"),
     "KCHTMPL0017E": _("All networks for the template must be specified in a list."),
+    "KCHTMPL0018E": _("Base volume %(volume)s of template %(template)s does not exist in its storage pool"),
+    "KCHTMPL0019E": _("Template %(template)s can only use base volumes in storage pools supporting qcow2 volumes"),
+    "KCHTMPL0020E": _("Template warm pool size must be a non-negative integer"),
 
     "KCHPOOL0001E": _("Storage pool %(name)s already exists"),
     "KCHPOOL0002E": _("Storage pool %(name)s does not exist"),
@@ -161,6 +167,18 @@ messages = {
     "KCHVOL0014E": _("Storage volume allocation must be an integer number"),
     "KCHVOL0015E": _("Storage volume format not supported"),
     "KCHVOL0016E": _("Storage volume requires a volume name"),
+    "KCHVOL0017E": _("Storage volumes can only be sorted by name, capacity or allocation"),
+    "KCHVOL0018E": _("Storage volume list offset and limit must be non-negative integers"),
+    "KCHVOL0019E": _("Storage volume %(name)s is the backing store of volumes %(volumes)s and can not be deleted"),
+    "KCHVOL0020E": _("Storage volume %(name)s has no backing store to flatten"),
+    "KCHVOL0021E": _("Unable to flatten storage volume %(name)s. Details: %(err)s"),
+    "KCHVOL0022E": _("Unable to upload storage volume %(name)s. Details: %(err)s"),
+    "KCHVOL0023E": _("Unable to download storage volume %(name)s. Details: %(err)s"),
+    "KCHVOL0024E": _("Upload of storage volume %(name)s ended before Content-Length bytes were received"),
+    "KCHVOL0025E": _("Invalid range requested for storage volume %(name)s"),
+    "KCHVOL0026E": _("Content-Length or chunked Transfer-Encoding is required to upload storage volume %(name)s"),
+    "KCHVOL0027E": _("Unable to clone storage volume %(name)s to %(new_name)s. Details: %(err)s"),
+    "KCHVOL0028E": _("Storage volume copy rate must be a non-negative integer (MB/s)"),
 
     "KCHIFACE0001E": _("Interface %(name)s does not exist"),
 
@@ -17,18 +17,36 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
-import glob
+import hashlib
 import os
+import Queue
 import re
+import sre_constants
+import sre_parse
 import struct
 import sys
-import urllib2
+import threading
+import time
+from itertools import imap
 
 
-from kimchi.exception import IsoFormatError
+from kimchi.exception import IsoFormatError, NotFoundError
+from kimchi.httppool import HTTP_ERRORS, HTTPPool
 from kimchi.utils import check_url_path, kimchi_log
 
 
+# Threads probing images during a directory scan, and seconds after which
+# the probe of an image is given up
+SCAN_WORKERS = 8
+SCAN_PROBE_TIMEOUT = 30
+
+# Probe results not used for ISO_INFO_EXPIRY seconds are dropped from the
+# object store. The last use of an entry is recorded at most once per
+# ISO_INFO_TOUCH_INTERVAL seconds, which is also the interval between two
+# expirations.
+ISO_INFO_EXPIRY = 30 * 24 * 3600
+ISO_INFO_TOUCH_INTERVAL = 24 * 3600
+
 iso_dir = [
     ##
     # Portions of this data from libosinfo: http://libosinfo.org/
@@ -131,37 +149,60 @@ class IsoImage(object):
     EL_TORITO_BOOT_RECORD = struct.Struct("=B5sB32s32sI")
     EL_TORITO_VALIDATION_ENTRY = struct.Struct("=BBH24sHBB")
     EL_TORITO_BOOT_ENTRY = struct.Struct("=BBHBBHL20x")
+    # Sectors read ahead of the volume descriptors from remote images, so
+    # the boot catalog usually comes with them in the same request
+    REMOTE_READ_AHEAD = 64
 
     def __init__(self, path):
         self.path = path
+        self._http = HTTPPool()
+        self._read_ahead = (0, '')
+        self._digest = hashlib.sha1()
+        self.size = None
         self.remote = self._is_iso_remote()
         self.volume_id = None
         self.bootable = False
         self._scan()
 
+    @property
+    def fingerprint(self):
+        """
+        Cheap identifier of the image content: its size plus a hash of the
+        volume descriptors and boot catalog, computed from the data read by
+        the scan. None when the size of a remote image is unknown, as the
+        descriptors alone do not tell two images apart.
+        """
+        if self.size is None:
+            return None
+        return "%d:%s" % (self.size, self._digest.hexdigest())
+
     def _is_iso_remote(self):
         if os.path.isfile(self.path):
+            self.size = os.path.getsize(self.path)
             return False
 
+        # The size of a remote image comes with its first data read
         if check_url_path(self.path):
             return True
 
         raise IsoFormatError("KCHISO0001E", {'filename': self.path})
 
+    def _set_remote_size(self, response):
+        if response.status == 200:
+            size = response.getheader('Content-Length')
+        else:
+            # bytes <first>-<last>/<size>, the size can be '*' (unknown)
+            size = response.getheader('Content-Range', '').split('/')[-1]
+        if size and size.isdigit():
+            self.size = int(size)
+
     def probe(self):
         if not self.bootable:
             raise IsoFormatError("KCHISO0002E", {'filename': self.path})
 
-        matcher = Matcher(self.volume_id)
-
-        for d, v, regex in iso_dir:
-            if matcher.search(regex):
-                distro = d
-                if hasattr(v, '__call__'):
-                    version = v(matcher)
-                else:
-                    version = v
-                return (distro, version)
+        distro = distro_matcher.match(self.volume_id)
+        if distro is not None:
+            return distro
 
         msg = "probe_iso: Unable to identify ISO %s with Volume ID: %s"
         kimchi_log.debug(msg, self.path, self.volume_id)
@@ -201,6 +242,7 @@ class IsoImage(object):
         size = IsoImage.EL_TORITO_VALIDATION_ENTRY.size + \
             IsoImage.EL_TORITO_BOOT_ENTRY.size
         data = self._get_iso_data(offset, size)
+        self._digest.update(data)
 
         fmt = IsoImage.EL_TORITO_VALIDATION_ENTRY
         tmp_data = data[0:fmt.size]
@@ -246,24 +288,50 @@ class IsoImage(object):
         # The index is picked from ISO-9660 specification.
         return data[190: 318]
 
-    def _get_iso_data(self, offset, size):
-        if self.remote:
-            request = urllib2.Request(self.path)
-            range_header = "bytes=%d-%d" % (offset, offset + size - 1)
-            request.add_header("range", range_header)
-            response = urllib2.urlopen(request)
-            data = response.read()
-        else:
+    def _get_iso_data(self, offset, size, read_ahead=0):
+        if not self.remote:
             with open(self.path) as fd:
                 fd.seek(offset)
-                data = fd.read(size)
-
-        return data
+                return fd.read(size)
+
+        start, data = self._read_ahead
+        if start <= offset and offset + size <= start + len(data):
+            return data[offset - start:offset - start + size]
+
+        data = self._get_remote_data(offset, size + read_ahead)
+        self._read_ahead = (offset, data)
+        return data[:size]
+
+    def _get_remote_data(self, offset, size):
+        headers = {'Range': "bytes=%d-%d" % (offset, offset + size - 1)}
+        try:
+            response = self._http.request('GET', self.path, headers)
+            try:
+                if response.status in (200, 206) and self.size is None:
+                    self._set_remote_size(response)
+                if response.status == 200:
+                    # Ranges not supported, skip the beginning of the image
+                    skip = offset
+                    while skip > 0:
+                        chunk = response.read(min(skip, 1024 * 1024))
+                        if not chunk:
+                            break
+                        skip -= len(chunk)
+                elif response.status != 206:
+                    raise IsoFormatError("KCHISO0001E",
+                                         {'filename': self.path})
+                return response.read(size)
+            finally:
+                response.close()
+        except HTTP_ERRORS:
+            raise IsoFormatError("KCHISO0001E", {'filename': self.path})
 
     def _scan(self):
         offset = 16 * IsoImage.SECTOR_SIZE
         size = 4 * IsoImage.SECTOR_SIZE
-        data = self._get_iso_data(offset, size)
+        read_ahead = IsoImage.REMOTE_READ_AHEAD * IsoImage.SECTOR_SIZE
+        data = self._get_iso_data(offset, size, read_ahead)
+        self._digest.update(data)
         if len(data) < 2 * IsoImage.SECTOR_SIZE:
             return
 
@@ -271,55 +339,363 @@ class IsoImage(object):
         self._scan_el_torito(data)
 
 
-class Matcher(object):
+def _expand_literals(pattern):
     """
-    Simple utility class to assist with matching a given string against a
-    series of regular expressions.
+    Return all the strings matched by a parsed expression made only of
+    literals and alternatives of literals, or None for any other expression.
     """
-    def __init__(self, matchstring):
-        self.matchstring = matchstring
+    strings = ['']
+    for op, av in pattern:
+        if op == sre_constants.LITERAL:
+            alternatives = [chr(av)]
+        elif op == sre_constants.IN and \
+                all(item_op == sre_constants.LITERAL for item_op, c in av):
+            alternatives = [chr(c) for item_op, c in av]
+        elif op == sre_constants.BRANCH:
+            alternatives = []
+            for branch in av[1]:
+                expanded = _expand_literals(branch)
+                if expanded is None:
+                    return None
+                alternatives.extend(expanded)
+        else:
+            return None
+        strings = [s + a for s in strings for a in alternatives]
+    return strings
 
-    def search(self, regex):
-        self.lastmatch = re.search(regex, self.matchstring)
-        return bool(self.lastmatch)
 
-    def group(self, num):
-        return self.lastmatch.group(num)
+def _required_literals(pattern):
+    """
+    Return strings one of which is part of anything the parsed expression
+    'pattern' matches, or None if there are no such strings.
+    """
+    strings = _expand_literals(pattern)
+    if strings is not None:
+        return strings
+
+    # Keep the most selective of the literal runs and alternatives
+    candidates = []
+    run = ''
+    for op, av in list(pattern) + [(None, None)]:
+        if op == sre_constants.LITERAL:
+            run += chr(av)
+            continue
+        if run:
+            candidates.append([run])
+            run = ''
+        if op == sre_constants.BRANCH:
+            alternatives = [_required_literals(branch) for branch in av[1]]
+            if None not in alternatives:
+                candidates.append(sum(alternatives, []))
+    if not candidates:
+        return None
+    return max(candidates, key=lambda strings: min(map(len, strings)))
+
+
+class DistroMatcher(object):
+    """
+    Find the first entry of a table like iso_dir whose regular expression
+    matches a Volume ID.
+
+    The expressions are compiled once, along with literal strings one of
+    which must be found in the Volume ID for the expression to match. Those
+    substring checks are much cheaper than a regular expression search,
+    mainly for the long alternations of Windows IDs, and rule out almost all
+    the entries before any expression is run.
+    """
+    def __init__(self, table):
+        self._entries = [(distro, version, re.compile(regex),
+                          _required_literals(sre_parse.parse(regex)))
+                         for distro, version, regex in table]
+
+    def match(self, volume_id):
+        """
+        Return (distro, version) for 'volume_id', or None if it is unknown.
+        """
+        for distro, version, regex, literals in self._entries:
+            if literals is not None and \
+                    not any(imap(volume_id.__contains__, literals)):
+                continue
+            match = regex.search(volume_id)
+            if match is None:
+                continue
+            if hasattr(version, '__call__'):
+                version = version(match)
+            return (distro, version)
+        return None
+
+
+distro_matcher = DistroMatcher(iso_dir)
+
+
+def get_iso_identity(path):
+    """
+    Return a string which changes whenever the ISO content may have changed:
+    device, inode, size and mtime for local files, ETag or Last-Modified
+    (plus size) for remote ones. Return None when the identity can not be
+    established, so the image is always probed.
+    """
+    if os.path.isfile(path):
+        st = os.stat(path)
+        return "file:%d:%d:%d:%d" % (st.st_dev, st.st_ino, st.st_size,
+                                     int(st.st_mtime))
+
+    try:
+        response = HTTPPool().request('HEAD', path)
+        response.close()
+    except HTTP_ERRORS:
+        return None
+    if response.status != 200:
+        return None
+    tag = response.getheader('ETag') or response.getheader('Last-Modified')
+    if tag is None:
+        return None
+    return "url:%s:%s:%s" % (path, tag,
+                             response.getheader('Content-Length', ''))
+
+
+class IsoInfoCache(object):
+    """
+    Cache of ISO probe results kept in the object store, so it survives
+    restarts. Entries are keyed by the ISO identity (see get_iso_identity),
+    which means an unchanged image is never read again, no matter through
+    how many paths or symlinks it is reached.
+
+    Entries unused for ISO_INFO_EXPIRY seconds are removed, as the images
+    they describe are most likely gone.
+    """
+    def __init__(self, objstore):
+        self.objstore = objstore
+        self._last_expiry = 0
+
+    def _expire(self, session, now):
+        if now - self._last_expiry < ISO_INFO_TOUCH_INTERVAL:
+            return
+        self._last_expiry = now
+        for identity in session.get_list('isoinfo'):
+            entry = session.get('isoinfo', identity)
+            if now - entry.get('last_used', 0) >= ISO_INFO_EXPIRY:
+                session.delete('isoinfo', identity, ignore_missing=True)
+
+    def probe(self, path):
+        """
+        Return a dict with the 'os_distro', 'os_version' and 'bootable'
+        information of an ISO.
+        """
+        now = time.time()
+        identity = get_iso_identity(path)
+        if identity is not None:
+            with self.objstore as session:
+                try:
+                    entry = session.get('isoinfo', identity)
+                except NotFoundError:
+                    pass
+                else:
+                    last_used = entry.pop('last_used', 0)
+                    if now - last_used >= ISO_INFO_TOUCH_INTERVAL:
+                        session.store('isoinfo', identity,
+                                      dict(entry, last_used=now))
+                    return entry
+
+        os_distro = os_version = 'unknown'
+        try:
+            iso_img = IsoImage(path)
+            os_distro, os_version = iso_img.probe()
+            bootable = True
+        except IsoFormatError:
+            bootable = False
+        info = {'os_distro': os_distro, 'os_version': os_version,
+                'bootable': bootable}
+
+        if identity is not None:
+            with self.objstore as session:
+                self._expire(session, now)
+                session.store('isoinfo', identity, dict(info, last_used=now))
+        return info
+
+    def forget(self, path):
+        """
+        Drop the probe result of the local file 'path', before it is
+        deleted.
+        """
+        if not os.path.isfile(path) or os.path.islink(path):
+            return
+        with self.objstore as session:
+            session.delete('isoinfo', get_iso_identity(path),
+                           ignore_missing=True)
+
+
+def compile_ignore_list(patterns):
+    """
+    Compile glob patterns of directories into a single regular expression
+    matching those directories, or return None for an empty list.
+    """
+    regexes = []
+    for pattern in patterns:
+        pattern = pattern.rstrip('/') or '/'
+        regex = ''
+        i = 0
+        while i < len(pattern):
+            c = pattern[i]
+            i += 1
+            if c == '*':
+                regex += '[^/]*'
+            elif c == '?':
+                regex += '[^/]'
+            elif c == '[' and pattern.find(']', i + 1) != -1:
+                # A ']' right after '[' is part of the set
+                j = pattern.find(']', i + 1)
+                chars = pattern[i:j].replace('\\', '\\\\')
+                if chars.startswith('!'):
+                    chars = '^' + chars[1:]
+                regex += '[%s]' % chars
+                i = j + 1
+            else:
+                regex += re.escape(c)
+        regexes.append(regex)
+
+    if not regexes:
+        return None
+    return re.compile('(?:%s)\\Z' % '|'.join(regexes))
+
+
+def walk_isos(top, ignore=None):
+    """
+    Yield the path of every .iso file under 'top', skipping the directories
+    (and their subdirectories) matched by the 'ignore' regular expression.
+    """
+    for root, dirs, files in os.walk(top):
+        if ignore is not None and ignore.match(root):
+            dirs[:] = []
+            continue
+        for name in files:
+            if name.lower().endswith('.iso'):
+                yield os.path.join(root, name)
+
+
+class IsoProbePool(object):
+    """
+    Run 'probe(path)' for the submitted paths in 'workers' threads and pass
+    each result which is not None to 'sink(result)' as soon as it is ready.
+    Calls to 'sink' are serialized.
+
+    A probe still running after 'timeout' seconds (e.g. stuck on a dead NFS
+    server) is given up: its worker is replaced and its result dropped.
+    """
+    def __init__(self, probe, sink, workers=SCAN_WORKERS,
+                 timeout=SCAN_PROBE_TIMEOUT):
+        self.probe = probe
+        self.sink = sink
+        self.timeout = timeout
+        self._queue = Queue.Queue(workers * 4)
+        self._cond = threading.Condition()
+        self._sink_lock = threading.Lock()
+        self._pending = 0
+        self._busy = {}
+        self._workers = workers
+        for i in xrange(workers):
+            self._start_worker()
+
+    def _start_worker(self):
+        worker = threading.Thread(target=self._work)
+        worker.setDaemon(True)
+        worker.start()
+
+    def _work(self):
+        while True:
+            path = self._queue.get()
+            if path is None:
+                return
+
+            token = object()
+            with self._cond:
+                self._busy[token] = (path, time.time())
+            try:
+                result = self.probe(path)
+            except Exception, e:
+                kimchi_log.debug("Unable to probe %s: %s", path, e)
+                result = None
+
+            with self._cond:
+                if self._busy.pop(token, None) is None:
+                    # Timed out, a new worker took over
+                    return
+            if result is not None:
+                with self._sink_lock:
+                    self.sink(result)
+            with self._cond:
+                self._pending -= 1
+                self._cond.notify_all()
+
+    def _expire(self):
+        now = time.time()
+        with self._cond:
+            expired = [token for token, (path, start) in self._busy.items()
+                       if now - start > self.timeout]
+            for token in expired:
+                path = self._busy.pop(token)[0]
+                kimchi_log.warning("Probe of %s timed out", path)
+                self._pending -= 1
+                self._start_worker()
+            if expired:
+                self._cond.notify_all()
+
+    def submit(self, path):
+        with self._cond:
+            self._pending += 1
+        while True:
+            try:
+                self._queue.put(path, True, 1)
+                return
+            except Queue.Full:
+                self._expire()
+
+    def wait(self):
+        """
+        Wait for the submitted probes to finish (or time out) and stop the
+        workers.
+        """
+        while True:
+            with self._cond:
+                if self._pending <= 0:
+                    break
+                self._cond.wait(1)
+            self._expire()
+
+        for i in xrange(self._workers):
+            self._queue.put(None)
 
 
 def probe_iso(status_helper, params):
+    """
+    Probe the ISO 'path' or, for a directory, all the ISOs under it except
+    those under 'ignore_list' directories (glob patterns). 'updater' is
+    called with the path, distro, version and fingerprint (see
+    IsoImage.fingerprint) of every ISO found, as soon as it is found; for a
+    directory, from the threads probing the images.
+    """
     loc = params['path'].encode("utf-8")
     updater = params['updater']
-    ignore = False
-    ignore_list = params.get('ignore_list', [])
 
-    def update_result(iso, ret):
+    def update_result(iso, ret, fingerprint):
         path = os.path.abspath(iso) if os.path.isfile(iso) else iso
-        updater({'path': path, 'distro': ret[0], 'version': ret[1]})
+        updater({'path': path, 'distro': ret[0], 'version': ret[1],
+                 'fingerprint': fingerprint})
 
     if os.path.isdir(loc):
-        for root, dirs, files in os.walk(loc):
-            for dir_name in ignore_list:
-                if root in glob.glob(dir_name):
-                    ignore = True
-                    break
-            if ignore:
-                ignore = False
-                continue
-            for name in files:
-                if not name.lower().endswith('.iso'):
-                    continue
-                iso = os.path.join(root, name)
-                try:
-                    iso_img = IsoImage(iso)
-                    ret = iso_img.probe()
-                    update_result(iso, ret)
-                except:
-                    continue
+        def probe(iso):
+            iso_img = IsoImage(iso)
+            return iso, iso_img.probe(), iso_img.fingerprint
+
+        probes = IsoProbePool(probe, lambda result: update_result(*result))
+        ignore = compile_ignore_list(params.get('ignore_list', []))
+        for iso in walk_isos(loc, ignore):
+            probes.submit(iso)
+        probes.wait()
     else:
         iso_img = IsoImage(loc)
         ret = iso_img.probe()
-        update_result(loc, ret)
+        update_result(loc, ret, iso_img.fingerprint)
 
     if status_helper is not None:
         status_helper('', True)
@@ -0,0 +1,516 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import BaseHTTPServer
+import glob
+import hashlib
+import json
+import os
+import re
+import SocketServer
+import threading
+import urllib
+import urlparse
+
+from kimchi.basemodel import Singleton
+from kimchi.config import config, get_iso_cache_path
+from kimchi.httppool import HTTP_ERRORS, HTTPPool
+from kimchi.utils import kimchi_log
+
+
+# Images are downloaded and cached by blocks of ISO_CACHE_BLOCK_SIZE bytes,
+# at most ISO_CACHE_MAX_FETCH blocks per request to the origin server
+ISO_CACHE_BLOCK_SIZE = 1024 * 1024
+ISO_CACHE_MAX_FETCH = 16
+
+
+def get_iso_proxy():
+    """
+    Return the IsoProxy, or None when it is disabled in the configuration.
+    """
+    if not config.getboolean('storage', 'iso_proxy'):
+        return None
+    cache_size = config.getint('storage', 'iso_proxy_cache_size')
+    return IsoProxy(get_iso_cache_path(),
+                    config.getint('storage', 'iso_proxy_port'),
+                    cache_size * 1024 * 1024)
+
+
+def start_iso_proxy():
+    """
+    Start the ISO proxy and return it, or None if it is not needed. When it
+    is disabled in the configuration but images were proxied before, it is
+    still started so the guests created in the meantime can read their
+    CDROM, but it only redirects them to the origin servers.
+    """
+    proxy = get_iso_proxy()
+    if proxy is None:
+        cache_dir = get_iso_cache_path()
+        if not glob.glob(os.path.join(cache_dir, '*.json')):
+            return None
+        proxy = IsoProxy(cache_dir, config.getint('storage', 'iso_proxy_port'),
+                         redirect=True)
+    proxy.start()
+    return proxy
+
+
+class IsoChangedError(IOError):
+    """
+    The remote image no longer matches the one being cached.
+    """
+    pass
+
+
+class CachedIso(object):
+    """
+    Remote ISO image cached in a sparse file of the same size.
+
+    Blocks are downloaded on first read and kept in '<ident>.iso', their
+    state being recorded in '<ident>.blocks' (one byte per block), so the
+    cache survives restarts. A block being downloaded for a reader is not
+    requested again for the others, which wait for it.
+
+    The ETag or Last-Modified date recorded at registration is sent in an
+    If-Range header with every range request, so the blocks of an image
+    replaced on its origin server are never mixed with the cached ones.
+    """
+    def __init__(self, cache_dir, ident):
+        base = os.path.join(cache_dir, ident)
+        with open(base + '.json') as fd:
+            info = json.load(fd)
+        self.url = info['url'].encode('utf-8')
+        self.size = info['size']
+        self.validator = info.get('etag') or info.get('last_modified')
+        self.data_path = base + '.iso'
+        self.blocks_path = base + '.blocks'
+        nblocks = (self.size + ISO_CACHE_BLOCK_SIZE - 1) / ISO_CACHE_BLOCK_SIZE
+
+        for path, size in ((self.data_path, self.size),
+                           (self.blocks_path, nblocks)):
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0600)
+            try:
+                if os.fstat(fd).st_size != size:
+                    os.ftruncate(fd, size)
+            finally:
+                os.close(fd)
+        with open(self.blocks_path) as fd:
+            self._blocks = bytearray(fd.read())
+
+        self._cond = threading.Condition()
+        self._fetching = set()
+
+    def _write(self, path, offset, data, sync=False):
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            os.lseek(fd, offset, os.SEEK_SET)
+            while data:
+                written = os.write(fd, data)
+                data = data[written:]
+            if sync:
+                os.fdatasync(fd)
+        finally:
+            os.close(fd)
+
+    def _fetch(self, first, last):
+        start = first * ISO_CACHE_BLOCK_SIZE
+        end = min((last + 1) * ISO_CACHE_BLOCK_SIZE, self.size) - 1
+        headers = {'Range': "bytes=%d-%d" % (start, end)}
+        if self.validator is not None:
+            headers['If-Range'] = self.validator
+        response = HTTPPool().request('GET', self.url, headers)
+        try:
+            content_range = response.getheader('Content-Range', '')
+            if (response.status == 200 and self.validator is not None) or \
+                    (response.status == 206 and content_range and
+                     not content_range.endswith('/%d' % self.size)):
+                # The origin server sends the whole image when If-Range
+                # does not match
+                raise IsoChangedError("%s changed on its server" % self.url)
+            if response.status != 206:
+                raise IOError("Unexpected HTTP status %d for a range of %s" %
+                              (response.status, self.url))
+            data = response.read(end - start + 1)
+        finally:
+            response.close()
+        if len(data) != end - start + 1:
+            raise IOError("Short read of %s" % self.url)
+
+        # The data must be there before the blocks are marked as cached
+        self._write(self.data_path, start, data, sync=True)
+        self._write(self.blocks_path, first, '\1' * (last - first + 1))
+        with self._cond:
+            for block in xrange(first, last + 1):
+                self._blocks[block] = 1
+
+    def _fill(self, first, last):
+        while True:
+            with self._cond:
+                missing = [block for block in xrange(first, last + 1)
+                           if not self._blocks[block] and
+                           block not in self._fetching]
+                if not missing:
+                    if all(self._blocks[first:last + 1]):
+                        return
+                    # Downloaded for other readers
+                    self._cond.wait()
+                    continue
+
+                run = missing[:1]
+                for block in missing[1:ISO_CACHE_MAX_FETCH]:
+                    if block != run[-1] + 1:
+                        break
+                    run.append(block)
+                self._fetching.update(run)
+
+            try:
+                self._fetch(run[0], run[-1])
+            finally:
+                with self._cond:
+                    self._fetching.difference_update(run)
+                    self._cond.notify_all()
+
+    def read(self, offset, length, read_ahead=0):
+        """
+        Return 'length' bytes of the image from 'offset', downloading the
+        blocks which are not cached yet along with those of the next
+        'read_ahead' bytes.
+        """
+        length = max(0, min(length, self.size - offset))
+        if length == 0:
+            return ''
+        last = min(offset + length + read_ahead, self.size) - 1
+        self._fill(offset / ISO_CACHE_BLOCK_SIZE,
+                   last / ISO_CACHE_BLOCK_SIZE)
+        with open(self.data_path) as fd:
+            fd.seek(offset)
+            return fd.read(length)
+
+
+class IsoProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        kimchi_log.debug("ISO proxy: " + format, *args)
+
+    def _get_range(self, size):
+        value = self.headers.get('Range')
+        if value is None:
+            return None
+        match = re.match(r'bytes=(\d*)-(\d*)$', value.strip())
+        if match is None or match.groups() == ('', ''):
+            return None
+        start, end = match.groups()
+        if start == '':
+            # Last bytes of the image
+            start, end = max(0, size - int(end)), size - 1
+        else:
+            start = int(start)
+            end = min(int(end), size - 1) if end else size - 1
+        return start, end
+
+    def _send(self, body):
+        ident = self.path.lstrip('/').split('/', 1)[0]
+        proxy = self.server.proxy
+        iso = proxy.open(ident)
+        if iso is None:
+            url = proxy.get_url(ident)
+            if url is None:
+                self.send_error(404)
+                return
+            # Not proxied anymore, the guest reads from the origin server
+            self.send_response(302)
+            self.send_header('Location', url)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        try:
+            self._send_iso(ident, iso, body)
+        finally:
+            proxy.close(ident)
+
+    def _send_iso(self, ident, iso, body):
+        byte_range = self._get_range(iso.size)
+        if byte_range is None:
+            start, end = 0, iso.size - 1
+            self.send_response(200)
+        elif byte_range[0] > byte_range[1]:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%d' % iso.size)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        else:
+            start, end = byte_range
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             'bytes %d-%d/%d' % (start, end, iso.size))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if not body:
+            return
+
+        offset = start
+        while offset <= end:
+            length = min(ISO_CACHE_BLOCK_SIZE, end - offset + 1)
+            # Download the rest of the range in as few requests as possible
+            read_ahead = min(end - offset + 1 - length,
+                             (ISO_CACHE_MAX_FETCH - 1) * ISO_CACHE_BLOCK_SIZE)
+            try:
+                data = iso.read(offset, length, read_ahead)
+            except IsoChangedError, e:
+                kimchi_log.warning("ISO proxy: %s, dropping its cache", e)
+                self.server.proxy.drop(ident)
+                self.close_connection = 1
+                return
+            except HTTP_ERRORS + (IOError, OSError), e:
+                # Too late for an error status, drop the connection
+                kimchi_log.error("ISO proxy: unable to read %s: %s",
+                                 iso.url, e)
+                self.close_connection = 1
+                return
+            self.wfile.write(data)
+            offset += length
+
+    def do_HEAD(self):
+        self._send(False)
+
+    def do_GET(self):
+        self._send(True)
+
+
+class IsoProxyServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class IsoProxy(object):
+    """
+    Local HTTP server giving access to remote ISO images through CachedIso
+    caches, so the guests installing from the same image share a single
+    download of it.
+
+    When 'cache_size' (in bytes) is not 0, the least recently registered
+    images are removed from the cache to make room for a new one, unless
+    they are being read. The origin URL of a removed image is kept, so it
+    is registered again on its next read. With 'redirect', nothing is
+    cached and the readers are redirected to the origin servers.
+    """
+    __metaclass__ = Singleton
+
+    def __init__(self, cache_dir, port, cache_size=0, redirect=False):
+        self.cache_dir = cache_dir
+        self.port = port
+        self.cache_size = cache_size
+        self.redirect = redirect
+        self._lock = threading.Lock()
+        self._isos = {}
+        self._readers = {}
+        self._server = None
+
+    def start(self):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, 0700)
+        self._server = IsoProxyServer(('127.0.0.1', self.port),
+                                      IsoProxyHandler)
+        self._server.proxy = self
+        self.port = self._server.server_port
+        server = threading.Thread(target=self._server.serve_forever)
+        server.setDaemon(True)
+        server.start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _info_path(self, ident):
+        return os.path.join(self.cache_dir, ident + '.json')
+
+    def _load_info(self, ident):
+        if not re.match('[0-9a-f]{40}$', ident):
+            return None
+        try:
+            with open(self._info_path(ident)) as fd:
+                return json.load(fd)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _save_info(self, ident, info):
+        info_path = self._info_path(ident)
+        with open(info_path + '.tmp', 'w') as fd:
+            json.dump(info, fd)
+        os.rename(info_path + '.tmp', info_path)
+
+    def get_url(self, ident):
+        """
+        Return the origin URL of the image 'ident', or None if no such
+        image was registered.
+        """
+        info = self._load_info(ident)
+        return info['url'].encode('utf-8') if info else None
+
+    def get(self, ident):
+        """
+        Return the CachedIso 'ident', or None if no such image was
+        registered or it can not be proxied anymore. An image removed from
+        the cache is registered again.
+        """
+        with self._lock:
+            iso = self._isos.get(ident)
+        if iso is not None or self.redirect:
+            return iso
+
+        info = self._load_info(ident)
+        if info is None:
+            return None
+        if 'size' not in info and not self._register(ident, info['url']):
+            return None
+        try:
+            iso = CachedIso(self.cache_dir, ident)
+        except (IOError, OSError, ValueError):
+            return None
+        with self._lock:
+            return self._isos.setdefault(ident, iso)
+
+    def open(self, ident):
+        """
+        Return get(ident), making sure the image is not evicted from the
+        cache until close(ident) is called.
+        """
+        iso = self.get(ident)
+        if iso is not None:
+            with self._lock:
+                self._readers[ident] = self._readers.get(ident, 0) + 1
+        return iso
+
+    def close(self, ident):
+        with self._lock:
+            self._readers[ident] -= 1
+            if not self._readers[ident]:
+                del self._readers[ident]
+
+    def _drop(self, ident):
+        # Called with self._lock held
+        self._isos.pop(ident, None)
+        base = os.path.join(self.cache_dir, ident)
+        for path in (base + '.iso', base + '.blocks'):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        info = self._load_info(ident)
+        if info is not None:
+            # Only the origin URL is kept, for the domains still using the
+            # image
+            self._save_info(ident, {'url': info['url']})
+
+    def drop(self, ident):
+        """
+        Remove the image 'ident' from the cache. It is registered again on
+        its next read.
+        """
+        with self._lock:
+            self._drop(ident)
+
+    def _evict(self, keep, size):
+        """
+        Drop the least recently registered images, but 'keep' and those
+        being read, until 'size' more bytes fit in the cache.
+        """
+        images = []
+        used = 0
+        for name in os.listdir(self.cache_dir):
+            ident, ext = os.path.splitext(name)
+            if ext != '.json' or ident == keep:
+                continue
+            base = os.path.join(self.cache_dir, ident)
+            try:
+                last_used = os.stat(base + '.json').st_mtime
+                st = os.stat(base + '.iso')
+            except OSError:
+                continue
+            # Images are sparse files, only count the downloaded blocks
+            usage = st.st_blocks * 512
+            images.append((last_used, ident, usage))
+            used += usage
+
+        for last_used, ident, usage in sorted(images):
+            if used + size <= self.cache_size:
+                break
+            with self._lock:
+                if ident in self._readers:
+                    continue
+                kimchi_log.info("ISO proxy: evicting %s from the cache",
+                                ident)
+                self._drop(ident)
+            used -= usage
+
+    def _register(self, ident, url):
+        """
+        Record the size and validators of the remote image 'url' as the
+        image 'ident'. Return False if it does not support byte ranges or
+        can not be reached.
+        """
+        try:
+            response = HTTPPool().request('HEAD', url.encode('utf-8'))
+            response.close()
+        except HTTP_ERRORS, e:
+            kimchi_log.warning("Unable to proxy %s: %s", url, e)
+            return False
+        size = response.getheader('Content-Length')
+        if response.status != 200 or size is None or \
+                response.getheader('Accept-Ranges') != 'bytes':
+            kimchi_log.warning("Unable to proxy %s: no byte ranges", url)
+            return False
+        info = {'url': url, 'size': int(size),
+                'etag': response.getheader('ETag'),
+                'last_modified': response.getheader('Last-Modified')}
+        # Weak ETags are not allowed in If-Range
+        if info['etag'] and info['etag'].startswith('W/'):
+            info['etag'] = None
+        if self.cache_size:
+            self._evict(ident, info['size'])
+        self._save_info(ident, info)
+        return True
+
+    def register(self, url):
+        """
+        Return the URL of the proxy for the remote image 'url', or 'url'
+        itself when the image can not be proxied (the proxy is not running,
+        its origin server is not HTTP or does not support ranges).
+        """
+        if self._server is None or self.redirect or \
+                urlparse.urlsplit(url).scheme not in ('http', 'https'):
+            return url
+
+        ident = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        info = self._load_info(ident)
+        if info is None or 'size' not in info:
+            if not self._register(ident, url):
+                return url
+        else:
+            # Most recently used images are the last to be evicted
+            os.utime(self._info_path(ident), None)
+
+        name = urllib.quote(os.path.basename(urlparse.urlsplit(url).path))
+        return 'http://127.0.0.1:%d/%s/%s' % (self.port, ident, name)
@@ -47,7 +47,7 @@ from kimchi.distroloader import DistroLoader
 from kimchi.exception import InvalidOperation, InvalidParameter
 from kimchi.exception import MissingParameter, NotFoundError, OperationFailed
 from kimchi.model.storagepools import ISO_POOL_NAME, STORAGE_SOURCES
-from kimchi.model.utils import get_vm_name
+from kimchi.model.utils import get_vm_name, get_vm_names
 from kimchi.model.vms import VM_STATIC_UPDATE_PARAMS
 from kimchi.objectstore import ObjectStore
 from kimchi.screenshot import VMScreenshot
@@ -188,6 +188,23 @@ class MockModel(object):
         self._mock_vms[name] = vm
         return name
 
+    def vms_create_batch(self, params):
+        t_name = template_name_from_uri(params['template'])
+        if params.get('volumes'):
+            raise InvalidParameter("KCHVM0023E")
+        names = get_vm_names(params.get('name'), t_name, params['count'],
+                             self.vms_get_list())
+
+        def _create_batch(cb, params):
+            for name in names:
+                vm_params = dict(params, name=name)
+                del vm_params['count']
+                self.vms_create(vm_params)
+            cb('OK', True)
+
+        taskid = self.add_task('/vms', _create_batch, params)
+        return self.task_lookup(taskid)
+
     def vms_get_list(self):
         names = self._mock_vms.keys()
         return sorted(names, key=unicode.lower)
@@ -450,24 +467,128 @@ class MockModel(object):
         storagevolume = self._get_storagevolume(pool, name)
         return storagevolume.info
 
-    def storagevolume_wipe(self, pool, name):
+    def storagevolume_wipe(self, pool, name, rate=None):
         volume = self._get_storagevolume(pool, name)
-        volume.info['allocation'] = 0
+
+        def _wipe(cb, params):
+            volume.info['allocation'] = 0
+            cb('OK', True)
+
+        target_uri = '/storagepools/%s/storagevolumes/%s' % (pool, name)
+        taskid = self.add_task(target_uri, _wipe)
+        return self.task_lookup(taskid)
 
     def storagevolume_delete(self, pool, name):
         # firstly, we should check the pool actually exists
         volume = self._get_storagevolume(pool, name)
+        overlays = [vol.name for vol in
+                    self._get_storagepool(pool)._volumes.values()
+                    if vol.base and vol.base == volume.info['path']]
+        if overlays:
+            raise InvalidOperation("KCHVOL0019E",
+                                   {'name': name,
+                                    'volumes': ', '.join(sorted(overlays))})
         del self._get_storagepool(pool)._volumes[volume.name]
 
+    def storagevolume_flatten(self, pool, name):
+        volume = self._get_storagevolume(pool, name)
+        if not volume.base:
+            raise InvalidOperation("KCHVOL0020E", {'name': name})
+
+        def _flatten(cb, params):
+            volume.base = None
+            cb('OK', True)
+
+        target_uri = '/storagepools/%s/storagevolumes/%s' % (pool, name)
+        taskid = self.add_task(target_uri, _flatten)
+        return self.task_lookup(taskid)
+
+    def storagevolume_clone(self, pool, name, new_name, new_pool=None,
+                            rate=None):
+        new_pool = new_pool or pool
+        volume = self._get_storagevolume(pool, name)
+        target = self._get_storagepool(new_pool)
+        if new_name in target._volumes:
+            raise InvalidOperation("KCHVOL0001E", {'name': new_name})
+
+        new_volume = MockStorageVolume(target, new_name)
+        new_volume.info = copy.deepcopy(volume.info)
+        new_volume.content = volume.content
+        new_volume.base = volume.base
+        new_volume.info['path'] = os.path.join(target.info['path'], new_name)
+        new_volume.info['ref_cnt'] = 0
+        target._volumes[new_name] = new_volume
+
+        target_uri = '/storagepools/%s/storagevolumes/%s' % (new_pool,
+                                                             new_name)
+        taskid = self.add_task(target_uri, lambda cb, opaque: cb('OK', True))
+        return self.task_lookup(taskid)
+
+    def storagevolume_content_size(self, pool, name):
+        return len(self._get_storagevolume(pool, name).content)
+
+    def storagevolume_download(self, pool, name, offset=0, length=0):
+        content = self._get_storagevolume(pool, name).content
+        end = offset + length if length else len(content)
+        return iter([content[offset:end]])
+
+    def storagevolume_upload(self, pool, name, body, offset, length=None):
+        volume = self._get_storagevolume(pool, name)
+        if length is None:
+            data = body.read()
+        else:
+            data = body.read(length)
+            if len(data) < length:
+                raise InvalidParameter("KCHVOL0024E", {'name': name})
+        volume.content = (volume.content[:offset].ljust(offset, '\0') + data +
+                          volume.content[offset + len(data):])
+
+        target_uri = '/storagepools/%s/storagevolumes/%s' % (pool, name)
+        taskid = self.add_task(target_uri, lambda cb, opaque: cb('OK', True))
+        return self._storagevolume_upload_tasks(taskid)
+
+    def _storagevolume_upload_tasks(self, taskid):
+        # The task as the transfer starts, then in its final state
+        yield self.task_lookup(taskid)
+        while self.task_lookup(taskid)['status'] == 'running':
+            time.sleep(0.1)
+        yield self.task_lookup(taskid)
+
     def storagevolume_resize(self, pool, name, size):
         volume = self._get_storagevolume(pool, name)
-        volume.info['capacity'] = size
 
-    def storagevolumes_get_list(self, pool):
+        def _resize(cb, params):
+            volume.info['capacity'] = size
+            cb('OK', True)
+
+        target_uri = '/storagepools/%s/storagevolumes/%s' % (pool, name)
+        taskid = self.add_task(target_uri, _resize)
+        return self.task_lookup(taskid)
+
+    def storagevolumes_get_list(self, pool, _sort=None, _offset=None,
+                                _limit=None):
         res = self._get_storagepool(pool)
         if res.info['state'] == 'inactive':
             raise InvalidOperation("KCHVOL0006E", {'pool': pool})
-        return res._volumes.keys()
+
+        sort = _sort or 'name'
+        if sort.lstrip('-') == 'name':
+            volumes = sorted(res._volumes.keys(),
+                             reverse=sort.startswith('-'))
+        else:
+            volumes = sorted(res._volumes.keys(),
+                             key=lambda v: res._volumes[v].info[
+                                 sort.lstrip('-')],
+                             reverse=sort.startswith('-'))
+
+        start = int(_offset or 0)
+        if _limit is not None:
+            return volumes[start:start + int(_limit)]
+        return volumes[start:]
+
+    def storagevolumes_get_list_info(self, pool, **kargs):
+        return [(name, self.storagevolume_lookup(pool, name))
+                for name in self.storagevolumes_get_list(pool, **kargs)]
 
     def devices_get_list(self, _cap=None):
         return ['scsi_host3', 'scsi_host4', 'scsi_host5']
@@ -748,9 +869,13 @@ class MockModel(object):
 
     def distro_lookup(self, name):
         try:
-            return self.distros[name]
+            info = dict(self.distros[name])
         except KeyError:
             raise NotFoundError("KCHDISTRO0001E", {'name': name})
+        # Images are never checked by the mock model
+        info['available'] = None
+        info['last_check'] = None
+        return info
 
     def _gen_debugreport_file(self, ident):
         return self.add_task('', self._create_log, ident)
@@ -911,6 +1036,16 @@ class MockVMTemplate(VMTemplate):
         pool = self._storage_validate()
         return pool.info['path']
 
+    def _get_volume_info(self, name):
+        pool = self._storage_validate()
+        try:
+            info = self.model._get_storagevolume(pool.name, name).info
+        except NotFoundError:
+            raise InvalidParameter("KCHTMPL0018E", {'volume': name,
+                                                    'template': self.name})
+        return {'path': info['path'], 'capacity': info['capacity'],
+                'format': info['format']}
+
     def fork_vm_storage(self, vm_name):
         pool = self._storage_validate()
         volumes = self.to_volume_list(vm_name)
@@ -1040,6 +1175,8 @@ class MockStorageVolume(object):
                      'path': params.get('path'),
                      'ref_cnt': params.get('ref_cnt'),
                      'format': fmt}
+        self.base = params.get('base')
+        self.content = ''
         if fmt == 'iso':
             self.info['allocation'] = self.info['capacity']
             self.info['os_version'] = '17'
@@ -17,20 +17,17 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
-from multiprocessing.pool import ThreadPool
-
 import cherrypy
 
 from kimchi.basemodel import Singleton
 from kimchi.config import config as kconfig
-from kimchi.distroloader import DistroLoader
-from kimchi.exception import NotFoundError
 from kimchi.featuretests import FeatureTests
 from kimchi.model.debugreports import DebugReportsModel
+from kimchi.model.distrocatalog import DistroCatalog
 from kimchi.repositories import Repositories
 from kimchi.screenshot import VMScreenshot
 from kimchi.swupdate import SoftwareUpdate
-from kimchi.utils import check_url_path, kimchi_log
+from kimchi.utils import kimchi_log
 
 
 class ConfigModel(object):
@@ -98,29 +95,15 @@ class CapabilitiesModel(object):
 
 class DistrosModel(object):
     def __init__(self, **kargs):
-        distroloader = DistroLoader()
-        self.distros = distroloader.get()
+        self.catalog = DistroCatalog()
 
     def get_list(self):
-        def validate_distro(distro):
-            if check_url_path(distro['path']):
-                return distro['name']
-
-        n_processes = len(self.distros.keys())
-        pool = ThreadPool(processes=n_processes)
-        map_res = pool.map_async(validate_distro, self.distros.values())
-        pool.close()
-        pool.join()
-        res = list(set(map_res.get()) - set([None]))
-        return sorted(res)
+        return self.catalog.get_list()
 
 
 class DistroModel(object):
     def __init__(self, **kargs):
-        self._distros = DistrosModel()
+        self.catalog = DistroCatalog()
 
     def lookup(self, name):
-        try:
-            return self._distros.distros[name]
-        except KeyError:
-            raise NotFoundError("KCHDISTRO0001E", {'name': name})
+        return self.catalog.lookup(name)
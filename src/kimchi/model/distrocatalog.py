@@ -0,0 +1,191 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import glob
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from cherrypy.process.plugins import BackgroundTask
+
+from kimchi.basemodel import Singleton
+from kimchi.distroloader import DistroLoader
+from kimchi.exception import KimchiException, NotFoundError
+from kimchi.utils import check_url_path, kimchi_log
+
+
+DISTROS_CHECK_INTERVAL = 60
+DISTROS_CHECK_WORKERS = 8
+# Seconds before checking a reachable image again
+DISTRO_RECHECK_INTERVAL = 600
+# Seconds before checking an unreachable image again, doubled on each
+# failure up to DISTRO_MAX_RETRY_DELAY
+DISTRO_RETRY_DELAY = 60
+DISTRO_MAX_RETRY_DELAY = 3600
+
+
+class DistroCatalog(object):
+    """
+    Remote distro images of the distros store (see DistroLoader) and
+    whether they can be downloaded.
+
+    The store is read once, then again only when its files change. The
+    image URLs are checked by a background job every DISTROS_CHECK_INTERVAL
+    seconds, each one on its own schedule: reachable images every
+    DISTRO_RECHECK_INTERVAL seconds, unreachable ones with an exponential
+    backoff. Queries only report the result of the last check, so they
+    never wait for a remote server.
+    """
+    __metaclass__ = Singleton
+
+    def __init__(self, location=None):
+        self.loader = DistroLoader(location)
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._signature = None
+        self._distros = {}
+        self._status = {}
+        self._reload()
+        self._checker = BackgroundTask(DISTROS_CHECK_INTERVAL,
+                                       self.revalidate)
+        self._checker.start()
+        self._revalidate_async()
+
+    def _store_signature(self):
+        pattern = os.path.join(self.loader.location, '*.json')
+        signature = []
+        for fname in sorted(glob.glob(pattern)):
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            signature.append((fname, st.st_size, st.st_mtime))
+        return signature
+
+    def _reload(self):
+        """
+        Read the distros store if its files changed since the last time.
+        Return whether they did.
+        """
+        signature = self._store_signature()
+        if signature == self._signature:
+            return False
+
+        distros = self.loader.get()
+        with self._lock:
+            for name, distro in distros.iteritems():
+                old = self._distros.get(name)
+                if old is None or old['path'] != distro['path']:
+                    self._status[name] = {'available': None,
+                                          'last_check': None,
+                                          'failures': 0,
+                                          'next_check': 0}
+            for name in set(self._status) - set(distros):
+                del self._status[name]
+            self._distros = distros
+            self._signature = signature
+        return True
+
+    def _refresh(self):
+        try:
+            if self._reload():
+                self._revalidate_async()
+        except KimchiException, e:
+            # Keep the last valid catalog
+            kimchi_log.error("Unable to reload the distros store: %s", e)
+
+    def _revalidate_async(self):
+        checker = threading.Thread(target=self.revalidate)
+        checker.setDaemon(True)
+        checker.start()
+
+    def _set_status(self, name, path, available):
+        now = time.time()
+        with self._lock:
+            distro = self._distros.get(name)
+            if distro is None or distro['path'] != path:
+                # Changed while being checked
+                return
+            status = self._status[name]
+            status['available'] = available
+            status['last_check'] = now
+            if available:
+                status['failures'] = 0
+                status['next_check'] = now + DISTRO_RECHECK_INTERVAL
+            else:
+                status['failures'] += 1
+                delay = DISTRO_RETRY_DELAY * 2 ** (status['failures'] - 1)
+                status['next_check'] = now + min(delay,
+                                                 DISTRO_MAX_RETRY_DELAY)
+
+    def revalidate(self):
+        # A revalidation already running will take care of everything
+        if not self._check_lock.acquire(False):
+            return
+        try:
+            self._refresh()
+            now = time.time()
+            with self._lock:
+                due = [(name, distro['path'])
+                       for name, distro in self._distros.iteritems()
+                       if self._status[name]['next_check'] <= now]
+            if not due:
+                return
+
+            pool = ThreadPool(processes=min(len(due), DISTROS_CHECK_WORKERS))
+            try:
+                results = pool.map(lambda (name, path):
+                                   (name, path, check_url_path(path)), due)
+            finally:
+                pool.close()
+                pool.join()
+            for name, path, available in results:
+                self._set_status(name, path, available)
+        except Exception, e:
+            # Keep the background job alive
+            kimchi_log.error("Unable to check the distro images: %s", e)
+        finally:
+            self._check_lock.release()
+
+    def get_list(self):
+        """
+        Return the names of the distros whose image was reachable when last
+        checked, or not checked yet.
+        """
+        self._refresh()
+        with self._lock:
+            return sorted(name for name, status in self._status.iteritems()
+                          if status['available'] is not False)
+
+    def lookup(self, name):
+        """
+        Return the information of the distro 'name' plus whether its image
+        was 'available' when last checked (None if not checked yet) and the
+        time of that check, 'last_check'.
+        """
+        self._refresh()
+        with self._lock:
+            try:
+                info = dict(self._distros[name])
+            except KeyError:
+                raise NotFoundError("KCHDISTRO0001E", {'name': name})
+            info['available'] = self._status[name]['available']
+            info['last_check'] = self._status[name]['last_check']
+        return info
@@ -40,6 +40,11 @@ from kimchi.utils import add_task, kimchi_log
 
 HOST_STATS_INTERVAL = 1
 
+DEVICE_XPATHS = xmlutils.xpath_compile({
+    'type': '/device/capability/capability/@type',
+    'wwnn': '/device/capability/capability/wwnn',
+    'wwpn': '/device/capability/capability/wwpn'})
+
 
 class HostModel(object):
     def __init__(self, **kargs):
@@ -266,12 +271,8 @@ class DeviceModel(object):
             dev_xml = conn.nodeDeviceLookupByName(nodedev_name).XMLDesc(0)
         except:
             raise NotFoundError('KCHHOST0003E', {'name': nodedev_name})
-        cap_type = xmlutils.xpath_get_text(
-            dev_xml, '/device/capability/capability/@type')
-        wwnn = xmlutils.xpath_get_text(
-            dev_xml, '/device/capability/capability/wwnn')
-        wwpn = xmlutils.xpath_get_text(
-            dev_xml, '/device/capability/capability/wwpn')
+        res = xmlutils.xpath_get_texts(dev_xml, DEVICE_XPATHS)
+        cap_type, wwnn, wwpn = res['type'], res['wwnn'], res['wwpn']
         return {
             'name': nodedev_name,
             'adapter_type': cap_type[0] if len(cap_type) >= 1 else '',
@@ -26,8 +26,32 @@ import libvirt
 from kimchi.utils import kimchi_log
 
 
+_event_loop = None
+
+
+def start_event_loop():
+    """
+    Run the libvirt default event loop in a daemon thread, so connections
+    opened afterwards can deliver events. It must be started before opening
+    the connections.
+    """
+    global _event_loop
+
+    def run_loop():
+        while True:
+            libvirt.virEventRunDefaultImpl()
+
+    if _event_loop is not None:
+        return
+    libvirt.virEventRegisterDefaultImpl()
+    _event_loop = threading.Thread(target=run_loop)
+    _event_loop.setDaemon(True)
+    _event_loop.start()
+
+
 class LibvirtConnection(object):
     def __init__(self, uri):
+        start_event_loop()
         self.uri = uri
         self._connections = {}
         self._connectionLock = threading.Lock()
@@ -28,10 +28,23 @@ from kimchi import networkxml
 from kimchi import xmlutils
 from kimchi.exception import InvalidOperation, InvalidParameter
 from kimchi.exception import MissingParameter, NotFoundError, OperationFailed
+from kimchi.model.resourceindex import get_resource_index
+from kimchi.model.templates import get_integrity_context
 from kimchi.rollbackcontext import RollbackContext
 from kimchi.utils import kimchi_log
 
 
+NETWORK_XPATHS = xmlutils.xpath_compile({
+    'address': '/network/ip/@address',
+    'netmask': '/network/ip/@netmask',
+    'dhcp_start': '/network/ip/dhcp/range/@start',
+    'dhcp_end': '/network/ip/dhcp/range/@end',
+    'forward_mode': '/network/forward/@mode',
+    'forward_if': '/network/forward/interface/@dev',
+    'forward_pf': '/network/forward/pf/@dev',
+    'bridge': '/network/bridge/@name'})
+
+
 class NetworksModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
@@ -101,6 +114,8 @@ class NetworksModel(object):
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHNET0008E",
                                   {'name': name, 'err': e.get_error_message()})
+        finally:
+            get_integrity_context(self.conn).invalidate()
 
         return name
 
@@ -199,6 +214,7 @@ class NetworkModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
         self.objstore = kargs['objstore']
+        self.index = get_resource_index(self.conn, self.objstore)
 
     def lookup(self, name):
         network = self.get_network(self.conn.get(), name)
@@ -244,32 +260,28 @@ class NetworkModel(object):
         return bool(vms) or self._is_network_used_by_template(name)
 
     def _is_network_used_by_template(self, network):
-        with self.objstore as session:
-            templates = session.get_list('template')
-            for tmpl in templates:
-                tmpl_net = session.get('template', tmpl)['networks']
-                if network in tmpl_net:
-                    return True
-            return False
+        return bool(self.index.templates_using_network(network))
 
     def _get_vms_attach_to_a_network(self, network, filter="all"):
         DOM_STATE_MAP = {'nostate': 0, 'running': 1, 'blocked': 2,
                          'paused': 3, 'shutdown': 4, 'shutoff': 5,
                          'crashed': 6}
         state = DOM_STATE_MAP.get(filter)
-        vms = []
+        vms = self.index.vms_attached_to_network(network)
+        if state is None:
+            return vms
+
         conn = self.conn.get()
-        for dom in conn.listAllDomains(0):
-            networks = self._vm_get_networks(dom)
-            if network in networks and (state is None or
-                                        state == dom.state(0)[0]):
-                vms.append(dom.name())
-        return vms
-
-    def _vm_get_networks(self, dom):
-        xml = dom.XMLDesc(0)
-        xpath = "/domain/devices/interface[@type='network']/source/@network"
-        return xmlutils.xpath_get_text(xml, xpath)
+        res = []
+        for vm in vms:
+            try:
+                dom = conn.lookupByName(vm.encode('utf-8'))
+                if dom.state(0)[0] == state:
+                    res.append(vm)
+            except libvirt.libvirtError:
+                # Undefined since the index was last updated
+                continue
+        return res
 
     def activate(self, name):
         network = self.get_network(self.conn.get(), name)
@@ -292,6 +304,7 @@ class NetworkModel(object):
 
         self._remove_vlan_tagged_bridge(network)
         network.undefine()
+        get_integrity_context(self.conn).invalidate()
 
     @staticmethod
     def get_network(conn, name):
@@ -302,30 +315,18 @@ class NetworkModel(object):
 
     @staticmethod
     def get_network_from_xml(xml):
-        address = xmlutils.xpath_get_text(xml, "/network/ip/@address")
-        address = address and address[0] or ''
-        netmask = xmlutils.xpath_get_text(xml, "/network/ip/@netmask")
-        netmask = netmask and netmask[0] or ''
-        net = address and netmask and "/".join([address, netmask]) or ''
+        res = xmlutils.xpath_get_texts(xml, NETWORK_XPATHS)
+        first = dict((name, values and values[0] or '')
+                     for name, values in res.iteritems())
 
-        dhcp_start = xmlutils.xpath_get_text(xml,
-                                             "/network/ip/dhcp/range/@start")
-        dhcp_start = dhcp_start and dhcp_start[0] or ''
-        dhcp_end = xmlutils.xpath_get_text(xml, "/network/ip/dhcp/range/@end")
-        dhcp_end = dhcp_end and dhcp_end[0] or ''
-        dhcp = {'start': dhcp_start, 'end': dhcp_end}
-
-        forward_mode = xmlutils.xpath_get_text(xml, "/network/forward/@mode")
-        forward_mode = forward_mode and forward_mode[0] or ''
-        forward_if = xmlutils.xpath_get_text(xml,
-                                             "/network/forward/interface/@dev")
-        forward_pf = xmlutils.xpath_get_text(xml, "/network/forward/pf/@dev")
-        bridge = xmlutils.xpath_get_text(xml, "/network/bridge/@name")
-        bridge = bridge and bridge[0] or ''
-        return {'subnet': net, 'dhcp': dhcp, 'bridge': bridge,
-                'forward': {'mode': forward_mode,
-                            'interface': forward_if,
-                            'pf': forward_pf}}
+        address = first['address']
+        netmask = first['netmask']
+        net = address and netmask and "/".join([address, netmask]) or ''
+        dhcp = {'start': first['dhcp_start'], 'end': first['dhcp_end']}
+        return {'subnet': net, 'dhcp': dhcp, 'bridge': first['bridge'],
+                'forward': {'mode': first['forward_mode'],
+                            'interface': res['forward_if'],
+                            'pf': res['forward_pf']}}
 
     def _remove_vlan_tagged_bridge(self, network):
         try:
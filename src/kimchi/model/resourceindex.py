@@ -0,0 +1,223 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import threading
+from collections import defaultdict
+
+import libvirt
+import lxml.etree as ET
+
+from kimchi.exception import InvalidParameter
+from kimchi.utils import kimchi_log, pool_name_from_uri
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_resource_index(conn, objstore):
+    """
+    Return the ResourceIndex shared by all models using the libvirt
+    connection 'conn'.
+    """
+    with _indexes_lock:
+        try:
+            return _indexes[conn]
+        except KeyError:
+            _indexes[conn] = ResourceIndex(conn, objstore)
+            return _indexes[conn]
+
+
+def _get_domain_resources(xml):
+    root = ET.fromstring(xml)
+    disks = set(root.xpath("/domain/devices/disk/source/@file |"
+                           "/domain/devices/disk/source/@dev"))
+    networks = set(root.xpath("/domain/devices/interface[@type='network']"
+                              "/source/@network"))
+    return disks, networks
+
+
+class ResourceIndex(object):
+    """
+    Relationship index between VMs, storage volumes, networks and templates.
+
+    The index is built once from all domains and templates and then kept up
+    to date by libvirt domain lifecycle events and the VM device models (for
+    VMs) and by the template model (for templates), so questions like
+    "which VMs use this volume" do not require parsing the XML of every
+    domain.
+
+    Events are only queued by the event loop thread and applied on the next
+    query, so no libvirt call is made from the event loop.
+    """
+    def __init__(self, conn, objstore):
+        self.conn = conn
+        self.objstore = objstore
+        self._lock = threading.RLock()
+        self._registered_conn = None
+        self._events = False
+        self._built = False
+        self._events_lock = threading.Lock()
+        self._pending_events = []
+        # Each relation is kept in both directions
+        self._vm_disks = {}
+        self._disk_vms = defaultdict(set)
+        self._vm_networks = {}
+        self._network_vms = defaultdict(set)
+        self._template_pools = {}
+        self._pool_templates = defaultdict(set)
+        self._template_networks = {}
+        self._network_templates = defaultdict(set)
+
+    @staticmethod
+    def _unlink(forward, reverse, key):
+        for value in forward.pop(key, ()):
+            reverse[value].discard(key)
+            if not reverse[value]:
+                del reverse[value]
+
+    def _link(self, forward, reverse, key, values):
+        self._unlink(forward, reverse, key)
+        forward[key] = values
+        for value in values:
+            reverse[value].add(key)
+
+    def _set_vm(self, name, xml):
+        disks, networks = _get_domain_resources(xml)
+        self._link(self._vm_disks, self._disk_vms, name, disks)
+        self._link(self._vm_networks, self._network_vms, name, networks)
+
+    def _remove_vm(self, name):
+        self._unlink(self._vm_disks, self._disk_vms, name)
+        self._unlink(self._vm_networks, self._network_vms, name)
+
+    def _set_template(self, name, info):
+        try:
+            pools = set([pool_name_from_uri(info.get('storagepool', ''))])
+        except InvalidParameter:
+            pools = set()
+        self._link(self._template_pools, self._pool_templates, name, pools)
+        self._link(self._template_networks, self._network_templates, name,
+                   set(info.get('networks', [])))
+
+    def _remove_template(self, name):
+        self._unlink(self._template_pools, self._pool_templates, name)
+        self._unlink(self._template_networks, self._network_templates,
+                     name)
+
+    def _domain_event_cb(self, conn, dom, event, detail, opaque):
+        if event in (libvirt.VIR_DOMAIN_EVENT_DEFINED,
+                     libvirt.VIR_DOMAIN_EVENT_UNDEFINED):
+            self.invalidate_vm(dom.name().decode('utf-8'))
+
+    def _register_events(self, conn):
+        try:
+            conn.domainEventRegisterAny(None,
+                                        libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                                        self._domain_event_cb, None)
+            self._events = True
+        except (libvirt.libvirtError, AttributeError), e:
+            kimchi_log.warning("Unable to register domain events, the "
+                               "resource index will be rebuilt on each "
+                               "query: %s", e)
+            self._events = False
+
+    def _index_vm(self, conn, name):
+        try:
+            dom = conn.lookupByName(name.encode('utf-8'))
+            self._set_vm(name, dom.XMLDesc(0))
+        except libvirt.libvirtError:
+            # Domain undefined
+            self._remove_vm(name)
+
+    def _pop_events(self):
+        with self._events_lock:
+            names = set(self._pending_events)
+            self._pending_events = []
+        return names
+
+    def _build_vms(self, conn):
+        for name in self._vm_disks.keys():
+            self._remove_vm(name)
+        for dom in conn.listAllDomains(0):
+            self._set_vm(dom.name().decode('utf-8'), dom.XMLDesc(0))
+
+    def _build_templates(self):
+        for name in self._template_pools.keys():
+            self._remove_template(name)
+        with self.objstore as session:
+            for name in session.get_list('template'):
+                self._set_template(name, session.get('template', name))
+
+    def _refresh(self):
+        conn = self.conn.get()
+        if conn is not self._registered_conn:
+            # New (or recycled) libvirt connection, events registered on the
+            # previous one are gone
+            self._register_events(conn)
+            self._registered_conn = conn
+            self._built = False
+
+        if not self._built or not self._events:
+            self._pop_events()
+            self._build_vms(conn)
+            if not self._built:
+                self._build_templates()
+            self._built = True
+            return
+
+        for name in self._pop_events():
+            self._index_vm(conn, name)
+
+    def invalidate_vm(self, name):
+        """
+        Index the VM 'name' again on the next query. Device attach, detach
+        and update do not raise lifecycle events, their models call this.
+        """
+        with self._events_lock:
+            self._pending_events.append(name)
+
+    def update_template(self, name, info):
+        with self._lock:
+            if self._built:
+                self._set_template(name, info)
+
+    def remove_template(self, name):
+        with self._lock:
+            self._remove_template(name)
+
+    def vms_using_volume(self, path):
+        with self._lock:
+            self._refresh()
+            return sorted(self._disk_vms.get(path, ()))
+
+    def vms_attached_to_network(self, network):
+        with self._lock:
+            self._refresh()
+            return sorted(self._network_vms.get(network, ()))
+
+    def templates_using_pool(self, pool):
+        with self._lock:
+            self._refresh()
+            return sorted(self._pool_templates.get(pool, ()))
+
+    def templates_using_network(self, network):
+        with self._lock:
+            self._refresh()
+            return sorted(self._network_templates.get(network, ()))
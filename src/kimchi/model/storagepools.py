@@ -20,13 +20,18 @@
 import libvirt
 
 from kimchi import xmlutils
+from kimchi.config import config
 from kimchi.scan import Scanner
 from kimchi.exception import InvalidOperation, MissingParameter
 from kimchi.exception import NotFoundError, OperationFailed
 from kimchi.model.config import CapabilitiesModel
 from kimchi.model.host import DeviceModel
 from kimchi.model.libvirtstoragepool import StoragePoolDef
-from kimchi.utils import add_task, kimchi_log, pool_name_from_uri, run_command
+from kimchi.model.resourceindex import get_resource_index
+from kimchi.model.storageserverindex import get_storage_server_index
+from kimchi.model.templates import get_integrity_context
+from kimchi.nfsmonitor import NFSMonitor
+from kimchi.utils import add_task, kimchi_log, run_command
 
 
 ISO_POOL_NAME = u'kimchi_isos'
@@ -36,6 +41,11 @@ POOL_STATE_MAP = {0: 'inactive',
                   3: 'degraded',
                   4: 'inaccessible'}
 
+# State of the NFS server of a netfs pool, as known by NFSMonitor
+NFS_SERVER_STATES = {True: 'online',
+                     False: 'offline',
+                     None: 'unknown'}
+
 STORAGE_SOURCES = {'netfs': {'addr': '/pool/source/host/@name',
                              'path': '/pool/source/dir/@path'},
                    'scsi': {'adapter_type': '/pool/source/adapter/@type',
@@ -43,15 +53,26 @@ STORAGE_SOURCES = {'netfs': {'addr': '/pool/source/host/@name',
                             'wwnn': '/pool/source/adapter/@wwnn',
                             'wwpn': '/pool/source/adapter/@wwpn'}}
 
+# Everything read from a pool XML, extracted in a single parse. The source
+# expressions are named (pool type, source key).
+POOL_XPATHS = xmlutils.xpath_compile(dict(
+    [('path', '/pool/target/path'), ('type', '/pool/@type')] +
+    [((pool_type, key), expr)
+     for pool_type, exprs in STORAGE_SOURCES.iteritems()
+     for key, expr in exprs.iteritems()]))
+
 
 class StoragePoolsModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
         self.objstore = kargs['objstore']
-        self.scanner = Scanner(self._clean_scan)
+        self.scanner = Scanner(self._clean_scan, self.objstore,
+                               config.getboolean('storage',
+                                                 'iso_library_watch'))
         self.scanner.delete()
         self.caps = CapabilitiesModel()
         self.device = DeviceModel(**kargs)
+        self.servers = get_storage_server_index(self.conn)
 
     def get_list(self):
         try:
@@ -126,6 +147,9 @@ class StoragePoolsModel(object):
             kimchi_log.error("Problem creating Storage Pool: %s", e)
             raise OperationFailed("KCHPOOL0007E",
                                   {'name': name, 'err': e.get_error_message()})
+        finally:
+            self.servers.invalidate()
+            get_integrity_context(self.conn).invalidate()
         return name
 
     def _clean_scan(self, pool_name):
@@ -167,6 +191,9 @@ class StoragePoolModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
         self.objstore = kargs['objstore']
+        self.nfs_monitor = NFSMonitor()
+        self.index = get_resource_index(self.conn, self.objstore)
+        self.servers = get_storage_server_index(self.conn)
 
     @staticmethod
     def get_storagepool(name, conn):
@@ -191,52 +218,44 @@ class StoragePoolModel(object):
                                   {'name': pool.name(),
                                    'err': e.get_error_message()})
 
-    def _get_storage_source(self, pool_type, pool_xml):
+    def _get_pool_info(self, pool_xml):
+        """
+        Return the target path, type and source of the pool 'pool_xml'.
+        """
+        res = xmlutils.xpath_get_texts(pool_xml, POOL_XPATHS)
+        pool_type = res['type'][0]
         source = {}
-        if pool_type not in STORAGE_SOURCES:
-            return source
-
-        for key, val in STORAGE_SOURCES[pool_type].items():
-            res = xmlutils.xpath_get_text(pool_xml, val)
-            if len(res) == 1:
-                source[key] = res[0]
-            elif len(res) == 0:
+        for key in STORAGE_SOURCES.get(pool_type, {}):
+            values = res[(pool_type, key)]
+            if len(values) == 1:
+                source[key] = values[0]
+            elif len(values) == 0:
                 source[key] = ""
             else:
-                source[key] = res
+                source[key] = values
 
-        return source
+        path = res['path'][0] if res['path'] else None
+        return path, pool_type, source
 
-    def _nfs_status_online(self, pool, poolArgs=None):
-        if not poolArgs:
-            xml = pool.XMLDesc(0)
-            pool_type = xmlutils.xpath_get_text(xml, "/pool/@type")[0]
-            source = self._get_storage_source(pool_type, xml)
-            poolArgs = {}
-            poolArgs['name'] = pool.name()
-            poolArgs['type'] = pool_type
-            poolArgs['source'] = {'path': source['path'],
-                                  'host': source['addr']}
-        conn = self.conn.get()
-        poolDef = StoragePoolDef.create(poolArgs)
-        try:
-            poolDef.prepare(conn)
-            return True
-        except Exception as e:
-            return False
+    def _nfs_status_online(self, source):
+        # The reachability state is kept up to date by NFSMonitor in
+        # background, so reading it never blocks on a dead server. None
+        # means the server was not probed yet.
+        return self.nfs_monitor.is_online(source['addr'])
 
     def lookup(self, name):
         pool = self.get_storagepool(name, self.conn)
         info = pool.info()
         autostart = True if pool.autostart() else False
         persistent = True if pool.isPersistent() else False
-        xml = pool.XMLDesc(0)
-        path = xmlutils.xpath_get_text(xml, "/pool/target/path")[0]
-        pool_type = xmlutils.xpath_get_text(xml, "/pool/@type")[0]
-        source = self._get_storage_source(pool_type, xml)
+        path, pool_type, source = self._get_pool_info(pool.XMLDesc(0))
         #FIXME: nfs workaround - prevent any libvirt operation
         # for a nfs if the corresponding NFS server is down.
-        if pool_type == 'netfs' and not self._nfs_status_online(pool):
+        online = None
+        if pool_type == 'netfs':
+            server = self.nfs_monitor.status(source['addr'])
+            online = server['online']
+        if online is False:
             kimchi_log.debug("NFS pool %s is offline, reason: NFS "
                              "server %s is unreachable.", name,
                              source['addr'])
@@ -244,6 +263,10 @@ class StoragePoolModel(object):
             info[0] = 4
             # skip calculating volumes
             nr_volumes = 0
+        elif pool_type == 'netfs' and online is None:
+            # Server state unknown yet: do not risk a refresh on a dead
+            # server, the next lookup will have the probe result.
+            nr_volumes = 0
         else:
             nr_volumes = self._get_storagepool_vols_num(pool)
 
@@ -258,6 +281,10 @@ class StoragePoolModel(object):
                'nr_volumes': nr_volumes,
                'persistent': persistent}
 
+        if pool_type == 'netfs':
+            res['server_state'] = NFS_SERVER_STATES[online]
+            res['server_timestamp'] = server['timestamp']
+
         if not pool.isPersistent():
             # Deal with deep scan generated pool
             try:
@@ -316,11 +343,10 @@ class StoragePoolModel(object):
         pool = self.get_storagepool(name, self.conn)
         #FIXME: nfs workaround - do not activate a NFS pool
         # if the NFS server is not reachable.
-        xml = pool.XMLDesc(0)
-        pool_type = xmlutils.xpath_get_text(xml, "/pool/@type")[0]
-        if pool_type == 'netfs' and not self._nfs_status_online(pool):
+        path, pool_type, source = self._get_pool_info(pool.XMLDesc(0))
+        if pool_type == 'netfs' and \
+                self._nfs_status_online(source) is False:
             # block the user from activating the pool.
-            source = self._get_storage_source(pool_type, xml)
             raise OperationFailed("KCHPOOL0032E",
                                   {'name': name, 'server': source['addr']})
             return
@@ -331,14 +357,7 @@ class StoragePoolModel(object):
                                   {'name': name, 'err': e.get_error_message()})
 
     def _pool_used_by_template(self, pool_name):
-        with self.objstore as session:
-            templates = session.get_list('template')
-            for tmpl in templates:
-                t_info = session.get('template', tmpl)
-                t_pool = pool_name_from_uri(t_info['storagepool'])
-                if t_pool == pool_name:
-                    return True
-            return False
+        return bool(self.index.templates_using_pool(pool_name))
 
     def deactivate(self, name):
         if self._pool_used_by_template(name):
@@ -347,11 +366,10 @@ class StoragePoolModel(object):
         pool = self.get_storagepool(name, self.conn)
         #FIXME: nfs workaround - do not try to deactivate a NFS pool
         # if the NFS server is not reachable.
-        xml = pool.XMLDesc(0)
-        pool_type = xmlutils.xpath_get_text(xml, "/pool/@type")[0]
-        if pool_type == 'netfs' and not self._nfs_status_online(pool):
+        path, pool_type, source = self._get_pool_info(pool.XMLDesc(0))
+        if pool_type == 'netfs' and \
+                self._nfs_status_online(source) is False:
             # block the user from dactivating the pool.
-            source = self._get_storage_source(pool_type, xml)
             raise OperationFailed("KCHPOOL0033E",
                                   {'name': name, 'server': source['addr']})
             return
@@ -373,11 +391,18 @@ class StoragePoolModel(object):
         pool = self.get_storagepool(name, self.conn)
         if pool.isActive():
             raise InvalidOperation("KCHPOOL0005E", {'name': name})
+        path, pool_type, source = self._get_pool_info(pool.XMLDesc(0))
         try:
             pool.undefine()
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHPOOL0011E",
                                   {'name': name, 'err': e.get_error_message()})
+        self.servers.invalidate()
+        get_integrity_context(self.conn).invalidate()
+        # Stop monitoring the NFS server once no other pool uses it
+        if pool_type == 'netfs' and \
+                ('netfs', source['addr']) not in self.servers.get_servers():
+            self.nfs_monitor.unwatch(source['addr'])
 
 
 class IsoPoolModel(object):
@@ -0,0 +1,119 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import threading
+
+import libvirt
+import lxml.etree as ET
+
+from kimchi.utils import kimchi_log
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_storage_server_index(conn):
+    """
+    Return the StorageServerIndex shared by all models using the libvirt
+    connection 'conn'.
+    """
+    with _indexes_lock:
+        try:
+            return _indexes[conn]
+        except KeyError:
+            _indexes[conn] = StorageServerIndex(conn)
+            return _indexes[conn]
+
+
+def _get_pool_servers(xml):
+    root = ET.fromstring(xml)
+    pool_type = root.get('type')
+    return [(pool_type, host) for host in
+            root.xpath("/pool/source/host/@name")]
+
+
+class StorageServerIndex(object):
+    """
+    List of the (pool type, server) pairs of all storage pools.
+
+    It only depends on the pools source XML, so it is built from
+    virStoragePool.XMLDesc() alone (no refresh nor lookup of the pools) and
+    rebuilt after a pool lifecycle event. Without pool events support (libvirt
+    < 2.0) it is rebuilt on each query, which is still a single XML read per
+    pool.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self._lock = threading.Lock()
+        self._registered_conn = None
+        self._events = False
+        self._dirty = True
+        self._servers = []
+
+    def _pool_event_cb(self, conn, pool, event, detail, opaque):
+        # Defined, undefined, or started and stopped for transient pools
+        self._dirty = True
+
+    def _register_events(self, conn):
+        try:
+            conn.storagePoolEventRegisterAny(
+                None, libvirt.VIR_STORAGE_POOL_EVENT_ID_LIFECYCLE,
+                self._pool_event_cb, None)
+            self._events = True
+        except (libvirt.libvirtError, AttributeError), e:
+            kimchi_log.warning("Unable to register storage pool events, the "
+                               "storage server index will be rebuilt on each "
+                               "query: %s", e)
+            self._events = False
+
+    def _build(self, conn):
+        servers = []
+        for pool in conn.listAllStoragePools(0):
+            try:
+                xml = pool.XMLDesc(0)
+            except libvirt.libvirtError:
+                # Pool undefined in the meantime
+                continue
+            for server in _get_pool_servers(xml):
+                if server not in servers:
+                    servers.append(server)
+        return servers
+
+    def invalidate(self):
+        """
+        Rebuild the index on the next query. Used after Kimchi changes a
+        pool, as the matching event is delivered asynchronously.
+        """
+        self._dirty = True
+
+    def get_servers(self):
+        with self._lock:
+            conn = self.conn.get()
+            if conn is not self._registered_conn:
+                self._register_events(conn)
+                self._registered_conn = conn
+                self._dirty = True
+
+            if self._dirty or not self._events:
+                # Cleared first, so an event received while building makes
+                # the next query rebuild the index again
+                self._dirty = False
+                self._servers = self._build(conn)
+            return list(self._servers)
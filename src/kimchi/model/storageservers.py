@@ -18,58 +18,36 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
 from kimchi.exception import NotFoundError
-from kimchi.model.storagepools import StoragePoolModel, STORAGE_SOURCES
+from kimchi.model.storagepools import STORAGE_SOURCES
+from kimchi.model.storageserverindex import get_storage_server_index
 
 
 class StorageServersModel(object):
     def __init__(self, **kargs):
-        self.conn = kargs['conn']
-        self.pool = StoragePoolModel(**kargs)
+        self.index = get_storage_server_index(kargs['conn'])
 
     def get_list(self, _target_type=None):
         if not _target_type:
             target_type = STORAGE_SOURCES.keys()
         else:
             target_type = [_target_type]
-        pools = self.pools.get_list()
-
-        conn = self.conn.get()
-        pools = conn.listStoragePools()
-        pools += conn.listDefinedStoragePools()
 
         server_list = []
-        for pool in pools:
-            try:
-                pool_info = self.pool.lookup(pool)
-                if (pool_info['type'] in target_type and
-                        pool_info['source']['addr'] not in server_list):
-                    # Avoid to add same server for multiple times
-                    # if it hosts more than one storage type
-                    server_list.append(pool_info['source']['addr'])
-            except NotFoundError:
-                pass
+        for pool_type, server in self.index.get_servers():
+            # Avoid to add same server for multiple times
+            # if it hosts more than one storage type
+            if pool_type in target_type and server not in server_list:
+                server_list.append(server)
 
         return server_list
 
 
 class StorageServerModel(object):
     def __init__(self, **kargs):
-        self.conn = kargs['conn']
-        self.pool = StoragePoolModel(**kargs)
+        self.servers = StorageServersModel(**kargs)
 
     def lookup(self, server):
-        conn = self.conn.get()
-        pools = conn.listStoragePools()
-        pools += conn.listDefinedStoragePools()
-        for pool in pools:
-            try:
-                pool_info = self.pool.lookup(pool)
-                if (pool_info['source'] and
-                        pool_info['source']['addr'] == server):
-                    return dict(host=server)
-            except NotFoundError:
-                # Avoid inconsistent pool result because of lease between list
-                # lookup
-                pass
+        if server in self.servers.get_list():
+            return dict(host=server)
 
         raise NotFoundError("KCHSR0001E", {'server': server})
@@ -17,6 +17,10 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
 import libvirt
 import lxml.etree as ET
 from lxml import objectify
@@ -27,38 +31,112 @@ from kimchi.model.storagepools import STORAGE_SOURCES
 from kimchi.utils import kimchi_log, patch_find_nfs_target
 
 
+# Seconds a discovery result is reused before probing the server again, and
+# seconds a failed discovery is reported as such
+TARGETS_CACHE_TTL = 300
+TARGETS_CACHE_NEGATIVE_TTL = 30
+
+
+class TargetsCache(object):
+    """
+    Storage targets discovered per (server, target type), kept for 'ttl'
+    seconds. Concurrent requests for the same key wait for the probe
+    already running instead of starting another one.
+
+    A probe returns None when the server could not be queried: no targets
+    are reported, and the failure is only kept for 'negative_ttl' seconds.
+    A probe raising an exception is not cached at all.
+    """
+    def __init__(self, ttl=TARGETS_CACHE_TTL,
+                 negative_ttl=TARGETS_CACHE_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._probing = {}
+
+    def get(self, key, probe, refresh=False):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not refresh:
+                ttl = self.negative_ttl if entry['failed'] else self.ttl
+                if time.time() - entry['timestamp'] < ttl:
+                    return entry['targets']
+
+            flight = self._probing.get(key)
+            owner = flight is None
+            if owner:
+                flight = {'event': threading.Event(), 'targets': []}
+                self._probing[key] = flight
+
+        if not owner:
+            flight['event'].wait()
+            return flight['targets']
+
+        try:
+            targets = probe()
+            if targets is not None:
+                flight['targets'] = targets
+            with self._lock:
+                self._entries[key] = {'timestamp': time.time(),
+                                      'failed': targets is None,
+                                      'targets': flight['targets']}
+        finally:
+            with self._lock:
+                del self._probing[key]
+            flight['event'].set()
+        return flight['targets']
+
+
 class StorageTargetsModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
         self.caps = CapabilitiesModel()
+        self.cache = TargetsCache()
 
-    def get_list(self, storage_server, _target_type=None):
-        target_list = list()
-
+    def get_list(self, storage_server, _target_type=None, _refresh=None):
         if not _target_type:
             target_types = STORAGE_SOURCES.keys()
         else:
             target_types = [_target_type]
+        refresh = _refresh == 'true'
+
+        def discover(target_type):
+            return self.cache.get((storage_server, target_type),
+                                  lambda: self._find_targets(storage_server,
+                                                             target_type),
+                                  refresh)
 
-        for target_type in target_types:
-            if not self.caps.nfs_target_probe and target_type == 'netfs':
-                targets = patch_find_nfs_target(storage_server)
-            else:
-                xml = self._get_storage_server_spec(server=storage_server,
-                                                    target_type=target_type)
-                conn = self.conn.get()
-                try:
-                    ret = conn.findStoragePoolSources(target_type, xml, 0)
-                except libvirt.libvirtError as e:
-                    err = "Query storage pool source fails because of %s"
-                    kimchi_log.warning(err, e.get_error_message())
-                    continue
-
-                targets = self._parse_target_source_result(target_type, ret)
+        # Each target type is probed in its own thread, so a slow or dead
+        # server costs a single probe timeout
+        workers = ThreadPool(len(target_types))
+        try:
+            results = workers.map(discover, target_types)
+        finally:
+            workers.close()
+            workers.join()
 
+        target_list = list()
+        for targets in results:
             target_list.extend(targets)
         return target_list
 
+    def _find_targets(self, storage_server, target_type):
+        if not self.caps.nfs_target_probe and target_type == 'netfs':
+            return patch_find_nfs_target(storage_server)
+
+        xml = self._get_storage_server_spec(server=storage_server,
+                                            target_type=target_type)
+        conn = self.conn.get()
+        try:
+            ret = conn.findStoragePoolSources(target_type, xml, 0)
+        except libvirt.libvirtError as e:
+            err = "Query storage pool source fails because of %s"
+            kimchi_log.warning(err, e.get_error_message())
+            return None
+
+        return self._parse_target_source_result(target_type, ret)
+
     def _get_storage_server_spec(self, **kwargs):
         # Required parameters:
         # server:
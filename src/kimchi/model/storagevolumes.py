@@ -18,18 +18,24 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
 import os
+import Queue
+import threading
+import time
 
 import libvirt
 
 from kimchi import xmlutils
-from kimchi.config import READONLY_POOL_TYPE
-from kimchi.exception import InvalidOperation, InvalidParameter, IsoFormatError
+from kimchi.config import config, READONLY_POOL_TYPE
+from kimchi.exception import InvalidOperation, InvalidParameter
 from kimchi.exception import MissingParameter, NotFoundError, OperationFailed
-from kimchi.isoinfo import IsoImage
+from kimchi.isoinfo import IsoInfoCache
+from kimchi.model.resourceindex import get_resource_index
 from kimchi.model.storagepools import StoragePoolModel
-from kimchi.utils import kimchi_log
-from kimchi.model.vms import VMsModel
-from kimchi.model.vmstorages import VMStoragesModel, VMStorageModel
+from kimchi.model.tasks import TaskModel
+from kimchi.model.templates import get_integrity_context
+from kimchi.utils import add_task, kimchi_log, run_command
+from kimchi.volumeio import copy_sparse_file, maybe_qcow2, Throttle
+from kimchi.volumeio import zero_file
 
 
 VOLUME_TYPE_MAP = {0: 'file',
@@ -38,10 +44,88 @@ VOLUME_TYPE_MAP = {0: 'file',
                    3: 'network'}
 
 
+# Position of the sort fields in virStorageVol.info()
+VOLUME_SORT_FIELDS = {'capacity': 1, 'allocation': 2}
+
+# Size of the chunks moved between HTTP bodies and libvirt streams, which
+# bounds the memory used by each upload or download
+TRANSFER_CHUNK_SIZE = 256 * 1024
+TRANSFER_PROGRESS_INTERVAL = 1
+
+# Limit of the volume clone, flatten, wipe and resize tasks running at the
+# same time on the host, the other ones wait for their turn
+VOLUME_JOBS = threading.BoundedSemaphore(config.getint('storage',
+                                                       'max_volume_jobs'))
+
+
+def volume_job(fn):
+    """
+    Decorate the function of a storage volume task, so it waits for a
+    VOLUME_JOBS slot before running.
+    """
+    def job(self, cb, params):
+        if not VOLUME_JOBS.acquire(False):
+            cb('Waiting for other storage volume operations to finish')
+            VOLUME_JOBS.acquire()
+        try:
+            return fn(self, cb, params)
+        finally:
+            VOLUME_JOBS.release()
+    job.__name__ = fn.__name__
+    return job
+
+
+class TransferProgress(object):
+    """
+    Report, through a task, the progress of a volume transfer which runs in
+    the thread serving the HTTP request.
+    """
+    def __init__(self, objstore, target_uri, total=None):
+        self.total = total
+        self.done = 0
+        self._last_report = 0
+        self._queue = Queue.Queue()
+        self._finished = threading.Event()
+        self.id = add_task(target_uri, self._report, objstore)
+
+    def _report(self, cb, opaque):
+        while True:
+            message, success = self._queue.get()
+            cb(message, success)
+            if success is not None:
+                self._finished.set()
+                return
+
+    def _message(self):
+        if self.total:
+            return '%d/%d bytes' % (self.done, self.total)
+        return '%d bytes' % self.done
+
+    def update(self, nbytes):
+        self.done += nbytes
+        now = time.time()
+        if now - self._last_report >= TRANSFER_PROGRESS_INTERVAL:
+            self._last_report = now
+            self._queue.put((self._message(), None))
+
+    def finish(self, error=None):
+        if error is None:
+            self._queue.put(('OK', True))
+        else:
+            self._queue.put((error, False))
+
+    def wait(self):
+        """
+        Wait for the task to be in its final state, after finish().
+        """
+        self._finished.wait()
+
+
 class StorageVolumesModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
         self.objstore = kargs['objstore']
+        self.storagevolume = StorageVolumeModel(**kargs)
 
     def create(self, pool_name, params):
         vol_xml = """
@@ -78,29 +162,67 @@ class StorageVolumesModel(object):
             raise OperationFailed("KCHVOL0007E",
                                   {'name': name, 'pool': pool,
                                    'err': e.get_error_message()})
+        get_integrity_context(self.conn).invalidate()
 
         with self.objstore as session:
             session.store('storagevolume', vol_id, {'ref_cnt': 0})
 
         return name
 
-    def get_list(self, pool_name):
+    def _get_volumes(self, pool_name, _sort=None, _offset=None,
+                     _limit=None):
         pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
         if not pool.isActive():
             raise InvalidOperation("KCHVOL0006E", {'pool': pool_name})
         try:
             pool.refresh(0)
-            return sorted(map(lambda x: x.decode('utf-8'), pool.listVolumes()))
+            volumes = pool.listAllVolumes(0)
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHVOL0008E",
                                   {'pool': pool_name,
                                    'err': e.get_error_message()})
 
+        sort = _sort or 'name'
+        reverse = sort.startswith('-')
+        sort = sort.lstrip('-')
+        if sort == 'name':
+            volumes.sort(key=lambda v: v.name().decode('utf-8'),
+                         reverse=reverse)
+        else:
+            # Only the listed volumes need XMLDesc(), but sorting by size
+            # requires info() of all of them
+            sizes = dict((v.name(), v.info()) for v in volumes)
+            field = VOLUME_SORT_FIELDS[sort]
+            volumes.sort(key=lambda v: sizes[v.name()][field],
+                         reverse=reverse)
+
+        start = int(_offset or 0)
+        if _limit is not None:
+            return volumes[start:start + int(_limit)]
+        return volumes[start:]
+
+    def get_list(self, pool_name, _sort=None, _offset=None, _limit=None):
+        volumes = self._get_volumes(pool_name, _sort, _offset, _limit)
+        return [v.name().decode('utf-8') for v in volumes]
+
+    def get_list_info(self, pool_name, _sort=None, _offset=None,
+                      _limit=None):
+        """
+        Same as get_list(), but return (name, info) pairs, where info is what
+        StorageVolumeModel.lookup() would return for each volume. The pool
+        is looked up and the object store read only once for the whole list.
+        """
+        volumes = self._get_volumes(pool_name, _sort, _offset, _limit)
+        return self.storagevolume.get_volumes_info(pool_name, volumes)
+
 
 class StorageVolumeModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
         self.objstore = kargs['objstore']
+        self.index = get_resource_index(self.conn, self.objstore)
+        self.iso_cache = IsoInfoCache(self.objstore)
+        self.task = TaskModel(**kargs)
 
     def _get_storagevolume(self, pool, name):
         pool = StoragePoolModel.get_storagepool(pool, self.conn)
@@ -115,29 +237,37 @@ class StorageVolumeModel(object):
             else:
                 raise
 
-    def _get_ref_cnt(self, pool, name, path):
-        vol_id = '%s:%s' % (pool, name)
+    def _get_ref_cnts(self, pool, volumes):
+        """
+        Return the reference count of each (name, path) volume in 'pool'.
+        """
+        ref_cnts = {}
         with self.objstore as session:
-            try:
-                ref_cnt = session.get('storagevolume', vol_id)['ref_cnt']
-            except NotFoundError:
-                # Fix storage volume created outside kimchi scope
-                ref_cnt = 0
-                args = {'conn': self.conn, 'objstore': self.objstore}
-                # try to find this volume in exsisted vm
-                vms = VMsModel.get_vms(self.conn)
-                for vm in vms:
-                    storages = VMStoragesModel(**args).get_list(vm)
-                    for disk in storages:
-                        d_info = VMStorageModel(**args).lookup(vm, disk)
-                        if path == d_info['path']:
-                            ref_cnt = ref_cnt + 1
-                session.store('storagevolume', vol_id, {'ref_cnt': ref_cnt})
-
-        return ref_cnt
+            for name, path in volumes:
+                vol_id = '%s:%s' % (pool, name)
+                try:
+                    ref_cnts[name] = \
+                        session.get('storagevolume', vol_id)['ref_cnt']
+                except NotFoundError:
+                    pass
 
-    def lookup(self, pool, name):
-        vol = self._get_storagevolume(pool, name)
+        # Fix storage volumes created outside kimchi scope. The index may need
+        # the object store itself, so it must not be queried inside the
+        # session above.
+        missing = {}
+        for name, path in volumes:
+            if name not in ref_cnts:
+                missing[name] = len(self.index.vms_using_volume(path))
+        if missing:
+            with self.objstore as session:
+                for name, ref_cnt in missing.iteritems():
+                    session.store('storagevolume', '%s:%s' % (pool, name),
+                                  {'ref_cnt': ref_cnt})
+            ref_cnts.update(missing)
+
+        return ref_cnts
+
+    def _get_volume_info(self, vol):
         path = vol.path()
         info = vol.info()
         xml = vol.XMLDesc(0)
@@ -149,36 +279,81 @@ class StorageVolumeModel(object):
             # infomation. When there is no format information, we assume
             # it's 'raw'.
             fmt = 'raw'
-        ref_cnt = self._get_ref_cnt(pool, name, path)
         res = dict(type=VOLUME_TYPE_MAP[info[0]],
                    capacity=info[1],
                    allocation=info[2],
                    path=path,
-                   ref_cnt=ref_cnt,
                    format=fmt)
         if fmt == 'iso':
             if os.path.islink(path):
                 path = os.path.join(os.path.dirname(path), os.readlink(path))
-            os_distro = os_version = 'unknown'
-            try:
-                iso_img = IsoImage(path)
-                os_distro, os_version = iso_img.probe()
-                bootable = True
-            except IsoFormatError:
-                bootable = False
-            res.update(
-                dict(os_distro=os_distro, os_version=os_version, path=path,
-                     bootable=bootable))
+            res.update(self.iso_cache.probe(path))
+            res['path'] = path
 
         return res
 
-    def wipe(self, pool, name):
+    def get_volumes_info(self, pool, volumes):
+        names = [vol.name().decode('utf-8') for vol in volumes]
+        ref_cnts = self._get_ref_cnts(pool, [(name, vol.path()) for name, vol
+                                             in zip(names, volumes)])
+        res = []
+        for name, vol in zip(names, volumes):
+            info = self._get_volume_info(vol)
+            info['ref_cnt'] = ref_cnts[name]
+            res.append((name, info))
+        return res
+
+    def lookup(self, pool, name):
+        vol = self._get_storagevolume(pool, name)
+        return self.get_volumes_info(pool, [vol])[0][1]
+
+    def _start_job(self, pool, name, fn, params):
+        target_uri = '/storagepools/%s/storagevolumes/%s' % (pool, name)
+        taskid = add_task(target_uri, fn, self.objstore, params)
+        return self.task.lookup(taskid)
+
+    def wipe(self, pool, name, rate=None):
+        """
+        Fill the volume with zeros in a task. 'rate' limits the writes in
+        MB/s and defaults to the volume_io_rate configuration option.
+        """
         volume = self._get_storagevolume(pool, name)
+        if rate is None:
+            rate = config.getint('storage', 'volume_io_rate')
+        params = {'pool': pool, 'name': name, 'volume': volume, 'rate': rate}
+        return self._start_job(pool, name, self._wipe_task, params)
+
+    @volume_job
+    def _wipe_task(self, cb, params):
+        volume = params['volume']
+        path = volume.path()
+        vol_type = VOLUME_TYPE_MAP[volume.info()[0]]
+        fmt = xmlutils.xpath_get_text(volume.XMLDesc(0),
+                                      "/volume/target/format/@type")
+        # Volumes without format information are raw, as in lookup()
+        fmt = fmt[0] if fmt else 'raw'
+        size = self.content_size(params['pool'], params['name'])
+
+        def progress(done):
+            cb('%d/%d bytes' % (done, size))
+
         try:
-            volume.wipePattern(libvirt.VIR_STORAGE_VOL_WIPE_ALG_ZERO, 0)
-        except libvirt.libvirtError as e:
-            raise OperationFailed("KCHVOL0009E",
-                                  {'name': name, 'err': e.get_error_message()})
+            if (fmt == 'raw' and vol_type in ('file', 'block') and
+                    os.path.exists(path)):
+                zero_file(path, Throttle(params['rate'], progress))
+            else:
+                # No progress nor throttle, but libvirt knows how to wipe
+                # any kind of volume, keeping the header of formats such
+                # as qcow2 which zeroing the file would destroy
+                volume.wipePattern(libvirt.VIR_STORAGE_VOL_WIPE_ALG_ZERO, 0)
+            StoragePoolModel.get_storagepool(params['pool'],
+                                             self.conn).refresh(0)
+        except (OSError, IOError, libvirt.libvirtError) as e:
+            err = OperationFailed("KCHVOL0009E",
+                                  {'name': params['name'], 'err': e})
+            return cb(err.message, False)
+
+        cb('OK', True)
 
     def delete(self, pool, name):
         pool_info = StoragePoolModel(conn=self.conn,
@@ -187,21 +362,390 @@ class StorageVolumeModel(object):
             raise InvalidParameter("KCHVOL0012E", {'type': pool_info['type']})
 
         volume = self._get_storagevolume(pool, name)
+        overlays = self._get_overlays(pool, volume.path())
+        if overlays:
+            raise InvalidOperation("KCHVOL0019E",
+                                   {'name': name,
+                                    'volumes': ', '.join(overlays)})
+        self.iso_cache.forget(volume.path())
         try:
             volume.delete(0)
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHVOL0010E",
                                   {'name': name, 'err': e.get_error_message()})
+        get_integrity_context(self.conn).invalidate()
 
-    def resize(self, pool, name, size):
-        size = size << 20
+    def _get_overlays(self, pool, path):
+        """
+        Return the names of the volumes of 'pool' backed by the volume
+        'path', i.e. the linked clones of a template base volume.
+        """
+        pool = StoragePoolModel.get_storagepool(pool, self.conn)
+        overlays = []
+        for vol in pool.listAllVolumes(0):
+            # Only qcow2 volumes have a backing file: do not have libvirt
+            # describe every raw image of the pool
+            if not maybe_qcow2(vol.path()):
+                continue
+            backing = xmlutils.xpath_get_text(vol.XMLDesc(0),
+                                              "/volume/backingStore/path")
+            if path in backing:
+                overlays.append(vol.name().decode('utf-8'))
+        return sorted(overlays)
+
+    def flatten(self, pool, name):
+        volume = self._get_storagevolume(pool, name)
+        backing = xmlutils.xpath_get_text(volume.XMLDesc(0),
+                                          "/volume/backingStore/path")
+        if not backing:
+            raise InvalidOperation("KCHVOL0020E", {'name': name})
+
+        params = {'pool': pool, 'name': name, 'path': volume.path()}
+        return self._start_job(pool, name, self._flatten_task, params)
+
+    @volume_job
+    def _flatten_task(self, cb, params):
+        path = params['path']
+        conn = self.conn.get()
+        running = []
+        for vm in self.index.vms_using_volume(path):
+            try:
+                dom = conn.lookupByName(vm.encode('utf-8'))
+            except libvirt.libvirtError:
+                continue
+            if dom.isActive():
+                running.append(dom)
+
+        try:
+            if running:
+                # The image is in use: let qemu pull the backing data into
+                # it while the guest keeps running
+                dom = running[0]
+                dom.blockRebase(path, None, 0, 0)
+                while True:
+                    job = dom.blockJobInfo(path, 0)
+                    if not job:
+                        break
+                    if job['end']:
+                        cb('%d%%' % (job['cur'] * 100 / job['end']))
+                    time.sleep(1)
+            else:
+                out, err, rc = run_command(['qemu-img', 'rebase', '-b', '',
+                                            path])
+                if rc != 0:
+                    raise OperationFailed("KCHVOL0021E",
+                                          {'name': params['name'],
+                                           'err': err})
+            pool = StoragePoolModel.get_storagepool(params['pool'],
+                                                    self.conn)
+            pool.refresh(0)
+        except libvirt.libvirtError as e:
+            return cb(e.get_error_message(), False)
+        except OperationFailed as e:
+            return cb(e.message, False)
+
+        cb('OK', True)
+
+    def content_size(self, pool, name):
+        """
+        Return the size in bytes of the data of the volume, as returned by
+        download(), or None if it is unknown.
+        """
+        volume = self._get_storagevolume(pool, name)
+        vol_type = VOLUME_TYPE_MAP[volume.info()[0]]
+        if vol_type == 'block':
+            return volume.info()[1]
+        if vol_type == 'file' and os.path.isfile(volume.path()):
+            return os.path.getsize(volume.path())
+        return None
+
+    def download(self, pool, name, offset=0, length=0):
+        """
+        Return a generator of the volume data from 'offset', 'length' bytes
+        long (0 for up to the end), read in TRANSFER_CHUNK_SIZE chunks.
+        """
+        volume = self._get_storagevolume(pool, name)
+        total = length
+        if not total:
+            size = self.content_size(pool, name)
+            total = size - offset if size is not None else None
+
+        target_uri = '/storagepools/%s/storagevolumes/%s' % (pool, name)
+        transfer = self._download_stream(volume, name, offset, length, total,
+                                         target_uri)
+        # Set the transfer up here, so its errors are raised before the
+        # response is sent. Once started, closing the generator (as done
+        # when it is garbage collected, if it is never read up to the end)
+        # aborts the stream and ends the task.
+        next(transfer)
+        return transfer
+
+    def _download_stream(self, volume, name, offset, length, total,
+                         target_uri):
+        stream = self.conn.get().newStream(0)
+        try:
+            volume.download(stream, offset, length, 0)
+        except libvirt.libvirtError as e:
+            raise OperationFailed("KCHVOL0023E",
+                                  {'name': name, 'err': e.get_error_message()})
+
+        progress = TransferProgress(self.objstore, target_uri, total)
+        completed = False
+        try:
+            yield ''
+            while True:
+                data = stream.recv(TRANSFER_CHUNK_SIZE)
+                if not data:
+                    break
+                progress.update(len(data))
+                yield data
+            stream.finish()
+            completed = True
+        except libvirt.libvirtError as e:
+            kimchi_log.error("Unable to download storage volume %s: %s",
+                             name, e.get_error_message())
+        finally:
+            # Also reached when the client goes away
+            if completed:
+                progress.finish()
+            else:
+                try:
+                    stream.abort()
+                except libvirt.libvirtError:
+                    pass
+                progress.finish('Download of %s interrupted' % name)
+
+    def upload(self, pool, name, body, offset, length=None):
+        """
+        Set up the upload of the data read from the file-like 'body' to the
+        volume, from 'offset': 'length' bytes or, if None, up to the end of
+        'body' (chunked request). Return a generator which first yields the
+        task reporting the progress and result of the upload, then moves
+        the data in TRANSFER_CHUNK_SIZE chunks, without spooling it
+        anywhere. Once the body is read, it yields the task in its final
+        state or raises the error which made the upload fail.
+        """
         volume = self._get_storagevolume(pool, name)
+        stream = self.conn.get().newStream(0)
         try:
-            volume.resize(size, 0)
+            volume.upload(stream, offset, length or 0, 0)
         except libvirt.libvirtError as e:
-            raise OperationFailed("KCHVOL0011E",
+            raise OperationFailed("KCHVOL0022E",
                                   {'name': name, 'err': e.get_error_message()})
 
+        target_uri = '/storagepools/%s/storagevolumes/%s' % (pool, name)
+        progress = TransferProgress(self.objstore, target_uri, length)
+        return self._upload_stream(name, body, stream, length, progress)
+
+    def _upload_stream(self, name, body, stream, length, progress):
+        error = None
+        completed = False
+        try:
+            yield self.task.lookup(progress.id)
+            remaining = length
+            while remaining is None or remaining > 0:
+                size = TRANSFER_CHUNK_SIZE
+                if remaining is not None:
+                    size = min(size, remaining)
+                data = body.read(size)
+                if not data:
+                    break
+                stream.send(data)
+                progress.update(len(data))
+                if remaining is not None:
+                    remaining -= len(data)
+
+            if remaining:
+                error = InvalidParameter("KCHVOL0024E", {'name': name})
+            else:
+                stream.finish()
+                completed = True
+        except libvirt.libvirtError as e:
+            error = OperationFailed("KCHVOL0022E",
+                                    {'name': name,
+                                     'err': e.get_error_message()})
+            kimchi_log.error(error.message)
+        finally:
+            # Also reached on errors reading the body and when the client
+            # goes away
+            if completed:
+                progress.finish()
+            else:
+                try:
+                    stream.abort()
+                except libvirt.libvirtError:
+                    pass
+                if error is None:
+                    progress.finish('Upload of %s interrupted' % name)
+                else:
+                    progress.finish(error.message)
+
+        progress.wait()
+        if error is not None:
+            raise error
+        yield self.task.lookup(progress.id)
+
+    def clone(self, pool, name, new_name, new_pool=None, rate=None):
+        """
+        Copy the volume to 'new_name' in 'new_pool' (default: the same pool)
+        in a task. 'rate' limits the copy in MB/s and defaults to the
+        volume_io_rate configuration option.
+        """
+        new_pool = new_pool or pool
+        pool_info = StoragePoolModel(conn=self.conn,
+                                     objstore=self.objstore).lookup(new_pool)
+        if pool_info['type'] in READONLY_POOL_TYPE:
+            raise InvalidParameter("KCHVOL0012E", {'type': pool_info['type']})
+
+        volume = self._get_storagevolume(pool, name)
+        info = volume.info()
+        try:
+            fmt = xmlutils.xpath_get_text(volume.XMLDesc(0),
+                                          "/volume/target/format/@type")[0]
+        except IndexError:
+            fmt = 'raw'
+        xml = """
+        <volume>
+          <name>%(name)s</name>
+          <allocation>0</allocation>
+          <capacity>%(capacity)s</capacity>
+          <target>
+            <format type='%(format)s'/>
+          </target>
+        </volume>
+        """ % {'name': new_name, 'capacity': info[1], 'format': fmt}
+
+        target = StoragePoolModel.get_storagepool(new_pool, self.conn)
+        try:
+            new_volume = target.createXML(xml.encode('utf-8'), 0)
+        except libvirt.libvirtError as e:
+            raise OperationFailed("KCHVOL0027E",
+                                  {'name': name, 'new_name': new_name,
+                                   'err': e.get_error_message()})
+
+        with self.objstore as session:
+            session.store('storagevolume', '%s:%s' % (new_pool, new_name),
+                          {'ref_cnt': 0})
+        get_integrity_context(self.conn).invalidate()
+
+        if rate is None:
+            rate = config.getint('storage', 'volume_io_rate')
+        params = {'name': name, 'new_name': new_name, 'new_pool': new_pool,
+                  'source': volume, 'target': new_volume, 'rate': rate,
+                  'size': self.content_size(pool, name)}
+        return self._start_job(new_pool, new_name, self._clone_task, params)
+
+    def _copy_stream(self, source, target, throttle):
+        conn = self.conn.get()
+        download = conn.newStream(0)
+        upload = conn.newStream(0)
+        # Sparse streams (libvirt >= 3.4) transfer holes as their length
+        # instead of zeros
+        sparse = getattr(libvirt, 'VIR_STORAGE_VOL_DOWNLOAD_SPARSE_STREAM',
+                         None)
+        if sparse is not None:
+            try:
+                source.download(download, 0, 0, sparse)
+                target.upload(upload, 0, 0,
+                              libvirt.VIR_STORAGE_VOL_UPLOAD_SPARSE_STREAM)
+            except libvirt.libvirtError:
+                # Not supported by the storage backend
+                for stream in (download, upload):
+                    try:
+                        stream.abort()
+                    except libvirt.libvirtError:
+                        pass
+                download = conn.newStream(0)
+                upload = conn.newStream(0)
+                sparse = None
+
+        try:
+            if sparse is not None:
+                def send_data(stream, data, opaque):
+                    upload.send(data)
+                    throttle.consume(len(data))
+                    return len(data)
+
+                def send_hole(stream, length, opaque):
+                    upload.sendHole(length, 0)
+                    return 0
+
+                download.sparseRecvAll(send_data, send_hole, None)
+            else:
+                source.download(download, 0, 0, 0)
+                target.upload(upload, 0, 0, 0)
+                while True:
+                    data = download.recv(TRANSFER_CHUNK_SIZE)
+                    if not data:
+                        break
+                    upload.send(data)
+                    throttle.consume(len(data))
+            download.finish()
+            upload.finish()
+        except libvirt.libvirtError:
+            for stream in (download, upload):
+                try:
+                    stream.abort()
+                except libvirt.libvirtError:
+                    pass
+            raise
+
+    @volume_job
+    def _clone_task(self, cb, params):
+        source = params['source']
+        target = params['target']
+        size = params['size']
+
+        def progress(done):
+            if size:
+                cb('%d/%d bytes' % (done, size))
+            else:
+                cb('%d bytes' % done)
+
+        throttle = Throttle(params['rate'], progress)
+        try:
+            if os.path.isfile(source.path()) and \
+                    os.path.isfile(target.path()):
+                copy_sparse_file(source.path(), target.path(), throttle)
+            else:
+                self._copy_stream(source, target, throttle)
+            StoragePoolModel.get_storagepool(params['new_pool'],
+                                             self.conn).refresh(0)
+        except (OSError, IOError, libvirt.libvirtError) as e:
+            kimchi_log.error("Unable to clone storage volume %s: %s",
+                             params['name'], e)
+            try:
+                target.delete(0)
+            except libvirt.libvirtError:
+                pass
+            with self.objstore as session:
+                session.delete('storagevolume', '%s:%s' % (params['new_pool'],
+                                                           params['new_name']))
+            return cb('Unable to clone storage volume %s: %s' %
+                      (params['name'], e), False)
+
+        cb('OK', True)
+
+    def resize(self, pool, name, size):
+        volume = self._get_storagevolume(pool, name)
+        params = {'pool': pool, 'name': name, 'volume': volume,
+                  'size': size << 20}
+        return self._start_job(pool, name, self._resize_task, params)
+
+    @volume_job
+    def _resize_task(self, cb, params):
+        try:
+            params['volume'].resize(params['size'], 0)
+            StoragePoolModel.get_storagepool(params['pool'],
+                                             self.conn).refresh(0)
+        except libvirt.libvirtError as e:
+            err = OperationFailed("KCHVOL0011E",
+                                  {'name': params['name'],
+                                   'err': e.get_error_message()})
+            return cb(err.message, False)
+
+        cb('OK', True)
+
 
 class IsoVolumesModel(object):
     def __init__(self, **kargs):
@@ -218,15 +762,15 @@ class IsoVolumesModel(object):
             try:
                 pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
                 pool.refresh(0)
-                volumes = pool.listVolumes()
+                volumes = pool.listAllVolumes(0)
             except Exception, e:
                 # Skip inactive pools
                 kimchi_log.debug("Shallow scan: skipping pool %s because of "
                                  "error: %s", (pool_name, e.message))
                 continue
 
-            for volume in volumes:
-                res = self.storagevolume.lookup(pool_name, volume)
+            for volume, res in self.storagevolume.get_volumes_info(pool_name,
+                                                                   volumes):
                 if res['format'] == 'iso':
                     res['name'] = '%s' % volume
                     iso_volumes.append(res)
@@ -19,6 +19,7 @@
 
 import copy
 import os
+import threading
 import time
 
 import libvirt
@@ -26,15 +27,111 @@ import libvirt
 from kimchi import xmlutils
 from kimchi.exception import InvalidOperation, InvalidParameter
 from kimchi.kvmusertests import UserTests
-from kimchi.utils import pool_name_from_uri
+from kimchi.model.resourceindex import get_resource_index
+from kimchi.utils import check_url_path, pool_name_from_uri
 from kimchi.utils import probe_file_permission_as_user
 from kimchi.vmtemplate import VMTemplate
 
 
+# Seconds the resources looked up to validate templates are reused
+INTEGRITY_TTL = 5
+
+_contexts = {}
+_contexts_lock = threading.Lock()
+
+
+def get_integrity_context(conn):
+    """
+    Return the IntegrityContext shared by all models using the libvirt
+    connection 'conn'.
+    """
+    with _contexts_lock:
+        try:
+            return _contexts[conn]
+        except KeyError:
+            _contexts[conn] = IntegrityContext(conn)
+            return _contexts[conn]
+
+
+class IntegrityContext(object):
+    """
+    Networks, storage pools, volumes and ISOs templates may refer to.
+
+    Each of them is looked up once for all the templates validated within
+    INTEGRITY_TTL seconds, so listing the templates costs a few libvirt
+    calls and one check per distinct remote ISO instead of several of each
+    per template. The network, storage pool and storage volume models
+    invalidate it when they create or delete one.
+    """
+    def __init__(self, conn, ttl=INTEGRITY_TTL):
+        self.conn = conn
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def _get_snapshot(self):
+        with self._lock:
+            now = time.time()
+            if self._snapshot is None or \
+                    now - self._snapshot['timestamp'] >= self.ttl:
+                self._snapshot = {'timestamp': now, 'networks': None,
+                                  'storagepools': None, 'volumes': {},
+                                  'isos': {}}
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+    def networks(self):
+        snapshot = self._get_snapshot()
+        if snapshot['networks'] is None:
+            conn = self.conn.get()
+            names = conn.listNetworks() + conn.listDefinedNetworks()
+            snapshot['networks'] = sorted(names)
+        return snapshot['networks']
+
+    def storagepools(self):
+        snapshot = self._get_snapshot()
+        if snapshot['storagepools'] is None:
+            conn = self.conn.get()
+            names = conn.listStoragePools() + conn.listDefinedStoragePools()
+            snapshot['storagepools'] = sorted(map(lambda x: x.decode('utf-8'),
+                                                  names))
+        return snapshot['storagepools']
+
+    def has_volume(self, pool_name, name):
+        snapshot = self._get_snapshot()
+        volumes = snapshot['volumes'].get(pool_name)
+        if volumes is None:
+            try:
+                conn = self.conn.get()
+                pool = conn.storagePoolLookupByName(pool_name.encode("utf-8"))
+                if pool.isActive():
+                    volumes = set(map(lambda x: x.decode('utf-8'),
+                                      pool.listVolumes()))
+                else:
+                    volumes = set()
+            except libvirt.libvirtError:
+                volumes = set()
+            snapshot['volumes'][pool_name] = volumes
+        return name in volumes
+
+    def has_iso(self, iso):
+        # Local files are cheap to check and may be removed at any time
+        if os.path.isfile(iso):
+            return True
+        snapshot = self._get_snapshot()
+        if iso not in snapshot['isos']:
+            snapshot['isos'][iso] = check_url_path(iso)
+        return snapshot['isos'][iso]
+
+
 class TemplatesModel(object):
     def __init__(self, **kargs):
         self.objstore = kargs['objstore']
         self.conn = kargs['conn']
+        self.index = get_resource_index(self.conn, self.objstore)
 
     def create(self, params):
         name = params.get('name', '').strip()
@@ -76,6 +173,7 @@ class TemplatesModel(object):
                 raise InvalidOperation("KCHTMPL0001E", {'name': name})
             t = LibvirtVMTemplate(params, scan=True)
             session.store('template', name, t.info)
+        self.index.update_template(name, t.info)
         return name
 
     def get_list(self):
@@ -88,17 +186,19 @@ class TemplateModel(object):
         self.objstore = kargs['objstore']
         self.conn = kargs['conn']
         self.templates = TemplatesModel(**kargs)
+        self.integrity = get_integrity_context(self.conn)
 
     @staticmethod
-    def get_template(name, objstore, conn, overrides=None):
+    def get_template(name, objstore, conn, overrides=None, integrity=None):
         with objstore as session:
             params = session.get('template', name)
         if overrides:
             params.update(overrides)
-        return LibvirtVMTemplate(params, False, conn)
+        return LibvirtVMTemplate(params, False, conn, integrity)
 
     def lookup(self, name):
-        t = self.get_template(name, self.objstore, self.conn)
+        t = self.get_template(name, self.objstore, self.conn,
+                              integrity=self.integrity)
         return t.validate_integrity()
 
     def clone(self, name):
@@ -120,6 +220,7 @@ class TemplateModel(object):
     def delete(self, name):
         with self.objstore as session:
             session.delete('template', name)
+        self.templates.index.remove_template(name)
 
     def update(self, name, params):
         old_t = self.lookup(name)
@@ -154,9 +255,12 @@ class TemplateModel(object):
 
 
 class LibvirtVMTemplate(VMTemplate):
-    def __init__(self, args, scan=False, conn=None):
+    def __init__(self, args, scan=False, conn=None, integrity=None):
         VMTemplate.__init__(self, args, scan)
         self.conn = conn
+        self.integrity = integrity or get_integrity_context(conn)
+        self._pool = None
+        self._pool_xml = None
 
     def _storage_validate(self):
         pool_uri = self.info['storagepool']
@@ -175,13 +279,17 @@ class LibvirtVMTemplate(VMTemplate):
         return pool
 
     def _get_all_networks_name(self):
-        conn = self.conn.get()
-        return sorted(conn.listNetworks() + conn.listDefinedNetworks())
+        return self.integrity.networks()
 
     def _get_all_storagepools_name(self):
-        conn = self.conn.get()
-        names = conn.listStoragePools() + conn.listDefinedStoragePools()
-        return sorted(map(lambda x: x.decode('utf-8'), names))
+        return self.integrity.storagepools()
+
+    def _has_volume(self, name):
+        pool_name = pool_name_from_uri(self.info['storagepool'])
+        return self.integrity.has_volume(pool_name, name)
+
+    def _has_iso(self, iso):
+        return self.integrity.has_iso(iso)
 
     def _network_validate(self):
         names = self.info['networks']
@@ -197,20 +305,42 @@ class LibvirtVMTemplate(VMTemplate):
                 raise InvalidParameter("KCHTMPL0007E", {'network': name,
                                                         'template': self.name})
 
+    def _get_pool(self):
+        # The pool is looked up once per template instance, which may be
+        # used to create several VMs
+        if self._pool is None:
+            self._pool = self._storage_validate()
+            self._pool_xml = self._pool.XMLDesc(0)
+        return self._pool
+
+    def _get_pool_xml(self):
+        self._get_pool()
+        return self._pool_xml
+
     def _get_storage_path(self):
-        pool = self._storage_validate()
-        xml = pool.XMLDesc(0)
+        xml = self._get_pool_xml()
         return xmlutils.xpath_get_text(xml, "/pool/target/path")[0]
 
     def _get_storage_type(self):
-        pool = self._storage_validate()
-        xml = pool.XMLDesc(0)
+        xml = self._get_pool_xml()
         return xmlutils.xpath_get_text(xml, "/pool/@type")[0]
 
+    def _get_volume_info(self, name):
+        pool = self._get_pool()
+        try:
+            vol = pool.storageVolLookupByName(name.encode("utf-8"))
+        except libvirt.libvirtError:
+            raise InvalidParameter("KCHTMPL0018E", {'volume': name,
+                                                    'template': self.name})
+        fmt = xmlutils.xpath_get_text(vol.XMLDesc(0),
+                                      "/volume/target/format/@type")
+        return {'path': vol.path(), 'capacity': vol.info()[1],
+                'format': fmt[0] if fmt else 'raw'}
+
     def fork_vm_storage(self, vm_uuid):
         # Provision storage:
         # TODO: Rebase on the storage API once upstream
-        pool = self._storage_validate()
+        pool = self._get_pool()
         vol_list = self.to_volume_list(vm_uuid)
         for v in vol_list:
             # outgoing text to libvirt, encode('utf-8')
@@ -17,6 +17,7 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
+from kimchi.exception import InvalidOperation, InvalidParameter
 from kimchi.exception import OperationFailed
 
 
@@ -28,3 +29,28 @@ def get_vm_name(vm_name, t_name, name_list):
         if vm_name not in name_list:
             return vm_name
     raise OperationFailed("KCHUTILS0003E")
+
+
+def get_vm_names(pattern, t_name, count, name_list):
+    """
+    Return 'count' names for new VMs. '%d' in 'pattern' is replaced by the
+    numbers 1 to 'count'; without a pattern, names are generated like
+    get_vm_name() does.
+    """
+    if pattern:
+        if '%d' not in pattern:
+            raise InvalidParameter("KCHVM0022E", {'pattern': pattern})
+        names = [pattern.replace('%d', str(i)) for i in xrange(1, count + 1)]
+        for name in names:
+            if name in name_list:
+                raise InvalidOperation("KCHVM0001E", {'name': name})
+        return names
+
+    names = []
+    for i in xrange(1, 1000):
+        vm_name = "%s-vm-%i" % (t_name, i)
+        if vm_name not in name_list:
+            names.append(vm_name)
+            if len(names) == count:
+                return names
+    raise OperationFailed("KCHUTILS0003E")
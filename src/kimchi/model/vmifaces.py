@@ -24,12 +24,14 @@ from lxml import etree, objectify
 from lxml.builder import E
 
 from kimchi.exception import InvalidOperation, InvalidParameter, NotFoundError
+from kimchi.model.resourceindex import get_resource_index
 from kimchi.model.vms import DOM_STATE_MAP, VMModel
 
 
 class VMIfacesModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
+        self.index = get_resource_index(self.conn, kargs['objstore'])
 
     def get_list(self, vm):
         macs = []
@@ -74,7 +76,10 @@ class VMIfacesModel(object):
 
         xml = etree.tostring(E.interface(*children, **attrib))
 
-        dom.attachDeviceFlags(xml, libvirt.VIR_DOMAIN_AFFECT_CURRENT)
+        try:
+            dom.attachDeviceFlags(xml, libvirt.VIR_DOMAIN_AFFECT_CURRENT)
+        finally:
+            self.index.invalidate_vm(vm)
 
         return mac
 
@@ -90,6 +95,7 @@ class VMIfacesModel(object):
 class VMIfaceModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
+        self.index = get_resource_index(self.conn, kargs['objstore'])
 
     def _get_vmiface(self, vm, mac):
         ifaces = VMIfacesModel.get_vmifaces(vm, self.conn)
@@ -127,5 +133,8 @@ class VMIfaceModel(object):
         if iface is None:
             raise NotFoundError("KCHVMIF0001E", {'name': vm, 'iface': mac})
 
-        dom.detachDeviceFlags(etree.tostring(iface),
-                              libvirt.VIR_DOMAIN_AFFECT_CURRENT)
+        try:
+            dom.detachDeviceFlags(etree.tostring(iface),
+                                  libvirt.VIR_DOMAIN_AFFECT_CURRENT)
+        finally:
+            self.index.invalidate_vm(vm)
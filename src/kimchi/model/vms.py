@@ -20,6 +20,7 @@
 import os
 import time
 import uuid
+from multiprocessing.pool import ThreadPool
 from xml.etree import ElementTree
 
 import libvirt
@@ -29,12 +30,17 @@ from kimchi import vnc
 from kimchi import xmlutils
 from kimchi.config import READONLY_POOL_TYPE
 from kimchi.exception import InvalidOperation, InvalidParameter
+from kimchi.exception import KimchiException
 from kimchi.exception import MissingParameter, NotFoundError, OperationFailed
+from kimchi.isoproxy import get_iso_proxy
 from kimchi.model.config import CapabilitiesModel
 from kimchi.model.templates import TemplateModel
-from kimchi.model.utils import get_vm_name
+from kimchi.model.tasks import TaskModel
+from kimchi.model.utils import get_vm_name, get_vm_names
+from kimchi.model.warmpool import get_warm_pool
 from kimchi.screenshot import VMScreenshot
-from kimchi.utils import run_setfacl_set_attr, template_name_from_uri
+from kimchi.utils import add_task, kimchi_log, run_setfacl_set_attr
+from kimchi.utils import template_name_from_uri
 
 
 DOM_STATE_MAP = {0: 'nostate',
@@ -46,9 +52,17 @@ DOM_STATE_MAP = {0: 'nostate',
                  6: 'crashed'}
 
 GUESTS_STATS_INTERVAL = 5
+VM_BATCH_WORKERS = 4
 VM_STATIC_UPDATE_PARAMS = {'name': './name'}
 VM_LIVE_UPDATE_PARAMS = {}
 
+# The port is the one of the first graphics device of the first type found
+GRAPHICS_XPATHS = xmlutils.xpath_compile({
+    'type': '/domain/devices/graphics/@type',
+    'listen': '/domain/devices/graphics/@listen',
+    'port': '/domain/devices/graphics'
+            '[@type=(/domain/devices/graphics/@type)[1]]/@port'})
+
 stats = {}
 
 
@@ -57,6 +71,8 @@ class VMsModel(object):
         self.conn = kargs['conn']
         self.objstore = kargs['objstore']
         self.caps = CapabilitiesModel()
+        self.warm_pool = get_warm_pool(self.conn, self.objstore)
+        self.task = TaskModel(**kargs)
         self.guests_stats_thread = BackgroundTask(GUESTS_STATS_INTERVAL,
                                                   self._update_guests_stats)
         self.guests_stats_thread.start()
@@ -158,16 +174,8 @@ class VMsModel(object):
         pool = conn.storagePoolLookupByName(pool)
         return pool.storageVolLookupByName(vol).path()
 
-    def create(self, params):
-        conn = self.conn.get()
+    def _get_template(self, params):
         t_name = template_name_from_uri(params['template'])
-        vm_uuid = str(uuid.uuid4())
-        vm_list = self.get_list()
-        name = get_vm_name(params.get('name'), t_name, vm_list)
-        # incoming text, from js json, is unicode, do not need decode
-        if name in vm_list:
-            raise InvalidOperation("KCHVM0001E", {'name': name})
-
         vm_overrides = dict()
         pool_uri = params.get('storagepool')
         if pool_uri:
@@ -180,6 +188,74 @@ class VMsModel(object):
             raise InvalidOperation("KCHVM0005E")
 
         t.validate()
+        return t
+
+    def create(self, params):
+        t_name = template_name_from_uri(params['template'])
+        vm_list = self.get_list()
+        name = get_vm_name(params.get('name'), t_name, vm_list)
+        # incoming text, from js json, is unicode, do not need decode
+        if name in vm_list:
+            raise InvalidOperation("KCHVM0001E", {'name': name})
+
+        t = self._get_template(params)
+        return self._create_vm(t, name, params)
+
+    def create_batch(self, params):
+        """
+        Create params['count'] VMs from the same template in a task. The
+        template is loaded and validated once for the whole batch and the
+        VMs are provisioned by up to VM_BATCH_WORKERS threads.
+        """
+        t_name = template_name_from_uri(params['template'])
+        if params.get('volumes'):
+            raise InvalidParameter("KCHVM0023E")
+        names = get_vm_names(params.get('name'), t_name, params['count'],
+                             self.get_list())
+        t = self._get_template(params)
+
+        taskid = add_task('/vms', self._create_batch_task, self.objstore,
+                          {'template': t, 'names': names, 'params': params})
+        return self.task.lookup(taskid)
+
+    def _create_batch_task(self, cb, opaque):
+        t = opaque['template']
+        names = opaque['names']
+        params = opaque['params']
+
+        def create_vm(name):
+            try:
+                self._create_vm(t, name, params)
+                return name, None
+            except KimchiException, e:
+                return name, e.message
+            except libvirt.libvirtError, e:
+                return name, e.get_error_message()
+
+        workers = ThreadPool(min(VM_BATCH_WORKERS, len(names)))
+        created = []
+        failed = []
+        try:
+            for name, err in workers.imap_unordered(create_vm, names):
+                if err is None:
+                    created.append(name)
+                else:
+                    kimchi_log.error("Unable to create VM %s: %s", name, err)
+                    failed.append(name)
+                cb('%d/%d' % (len(created) + len(failed), len(names)))
+        finally:
+            workers.close()
+            workers.join()
+
+        if failed:
+            return cb('Unable to create VMs: %s' % ', '.join(sorted(failed)),
+                      False)
+        cb('OK', True)
+
+    def _create_vm(self, t, name, params):
+        conn = self.conn.get()
+        t_name = t.name
+        vm_uuid = str(uuid.uuid4())
 
         # If storagepool is SCSI, volumes will be LUNs and must be passed by
         # the user from UI or manually.
@@ -194,7 +270,14 @@ class VMsModel(object):
                     path = self._get_volume_path(pool, vol)
                     vol_list.append((vol, path))
         else:
-            vol_list = t.fork_vm_storage(vm_uuid)
+            # Use disks provisioned in advance by the template warm pool if
+            # there are any left
+            warm_uuid = self.warm_pool.claim(t_name, t.info)
+            if warm_uuid is not None:
+                vm_uuid = warm_uuid
+                vol_list = t.to_volume_list(vm_uuid)
+            else:
+                vol_list = t.fork_vm_storage(vm_uuid)
 
         # Store the icon for displaying later
         icon = t.info.get('icon')
@@ -211,7 +294,8 @@ class VMsModel(object):
                           libvirt_stream=libvirt_stream,
                           qemu_stream_dns=self.caps.qemu_stream_dns,
                           graphics=graphics,
-                          volumes=vol_list)
+                          volumes=vol_list,
+                          iso_proxy=get_iso_proxy())
 
         try:
             conn.defineXML(xml.encode('utf-8'))
@@ -397,18 +481,12 @@ class VMModel(object):
 
     def _vm_get_graphics(self, name):
         dom = self.get_vm(name, self.conn)
-        xml = dom.XMLDesc(0)
-        expr = "/domain/devices/graphics/@type"
-        res = xmlutils.xpath_get_text(xml, expr)
-        graphics_type = res[0] if res else None
-        expr = "/domain/devices/graphics/@listen"
-        res = xmlutils.xpath_get_text(xml, expr)
-        graphics_listen = res[0] if res else None
+        res = xmlutils.xpath_get_texts(dom.XMLDesc(0), GRAPHICS_XPATHS)
+        graphics_type = res['type'][0] if res['type'] else None
+        graphics_listen = res['listen'][0] if res['listen'] else None
         graphics_port = None
-        if graphics_type:
-            expr = "/domain/devices/graphics[@type='%s']/@port" % graphics_type
-            res = xmlutils.xpath_get_text(xml, expr)
-            graphics_port = int(res[0]) if res else None
+        if graphics_type and res['port']:
+            graphics_port = int(res['port'][0])
         return graphics_type, graphics_listen, graphics_port
 
     def connect(self, name):
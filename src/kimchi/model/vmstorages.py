@@ -30,6 +30,7 @@ from lxml.builder import E
 
 from kimchi.exception import InvalidOperation, InvalidParameter, NotFoundError
 from kimchi.exception import OperationFailed
+from kimchi.model.resourceindex import get_resource_index
 from kimchi.model.vms import DOM_STATE_MAP, VMModel
 from kimchi.utils import check_url_path
 
@@ -88,6 +89,7 @@ def _check_cdrom_path(path):
 class VMStoragesModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
+        self.index = get_resource_index(self.conn, kargs['objstore'])
 
     def create(self, vm_name, params):
         dom = VMModel.get_vm(vm_name, self.conn)
@@ -119,6 +121,8 @@ class VMStoragesModel(object):
             dom.attachDeviceFlags(dev_xml, libvirt.VIR_DOMAIN_AFFECT_CURRENT)
         except Exception as e:
             raise OperationFailed("KCHCDROM0008E", {'error': e.message})
+        finally:
+            self.index.invalidate_vm(vm_name)
         return params['dev']
 
     def _get_storage_device_name(self, vm_name):
@@ -146,6 +150,7 @@ class VMStoragesModel(object):
 class VMStorageModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
+        self.index = get_resource_index(self.conn, kargs['objstore'])
 
     def _get_device_xml(self, vm_name, dev_name):
         # Get VM xml and then devices xml
@@ -201,6 +206,8 @@ class VMStorageModel(object):
                                   libvirt.VIR_DOMAIN_AFFECT_CURRENT)
         except Exception as e:
             raise OperationFailed("KCHCDROM0010E", {'error': e.message})
+        finally:
+            self.index.invalidate_vm(vm_name)
 
     def update(self, vm_name, dev_name, params):
         params['src_type'] = _check_cdrom_path(params['path'])
@@ -214,4 +221,6 @@ class VMStorageModel(object):
             dom.updateDeviceFlags(xml, libvirt.VIR_DOMAIN_AFFECT_CURRENT)
         except Exception as e:
             raise OperationFailed("KCHCDROM0009E", {'error': e.message})
+        finally:
+            self.index.invalidate_vm(vm_name)
         return dev_name
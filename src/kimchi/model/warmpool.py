@@ -0,0 +1,204 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import json
+import threading
+import uuid
+
+import libvirt
+from cherrypy.process.plugins import BackgroundTask
+
+from kimchi.config import READONLY_POOL_TYPE
+from kimchi.exception import KimchiException, NotFoundError
+from kimchi.model.templates import TemplateModel
+from kimchi.utils import kimchi_log
+
+
+WARM_POOL_INTERVAL = 30
+
+_warm_pools = {}
+_warm_pools_lock = threading.Lock()
+
+
+def get_warm_pool(conn, objstore):
+    """
+    Return the WarmPool shared by all models using the libvirt connection
+    'conn'.
+    """
+    with _warm_pools_lock:
+        try:
+            return _warm_pools[conn]
+        except KeyError:
+            _warm_pools[conn] = WarmPool(conn, objstore)
+            return _warm_pools[conn]
+
+
+def storage_signature(info):
+    """
+    Return a string identifying the storage layout of a template, so disk
+    sets provisioned for an older version of it are never handed out.
+    """
+    return json.dumps({'storagepool': info['storagepool'],
+                       'disks': info['disks']}, sort_keys=True)
+
+
+class WarmPool(object):
+    """
+    Reserve of pre-provisioned disk sets for templates with a 'warm_pool'
+    size.
+
+    A background worker keeps 'warm_pool' disk sets ready for each of those
+    templates. Each set is created by fork_vm_storage() for a random UUID,
+    so VM creation only has to claim a set and use its UUID for the new
+    domain. Sets are kept in the object store ('warmpool' type, one entry
+    per template), which makes the claim atomic.
+    """
+    def __init__(self, conn, objstore, background=True):
+        self.conn = conn
+        self.objstore = objstore
+        self._refill_lock = threading.Lock()
+        # Set by the refills requested while one is running
+        self._refill_pending = threading.Event()
+        self._refiller = None
+        if background:
+            self._refiller = BackgroundTask(WARM_POOL_INTERVAL, self.refill)
+            self._refiller.start()
+
+    def _delete_disks(self, disk_set):
+        conn = self.conn.get()
+        for path in disk_set['volumes']:
+            try:
+                conn.storageVolLookupByPath(path.encode('utf-8')).delete(0)
+            except libvirt.libvirtError, e:
+                kimchi_log.warning("Unable to delete warm pool volume %s: "
+                                   "%s", path, e.get_error_message())
+
+    def _provision(self, name):
+        t = TemplateModel.get_template(name, self.objstore, self.conn)
+        t.validate()
+        if t._get_storage_type() in READONLY_POOL_TYPE:
+            return None
+
+        vm_uuid = str(uuid.uuid4())
+        vol_list = t.fork_vm_storage(vm_uuid)
+        return {'uuid': vm_uuid,
+                'signature': storage_signature(t.info),
+                'volumes': [vol['path'] for vol in vol_list]}
+
+    def refill(self):
+        self._refill_pending.set()
+        while self._refill_pending.is_set():
+            # A refill already running goes again once done, so the sets
+            # claimed in the meantime are replaced too
+            if not self._refill_lock.acquire(False):
+                return
+            try:
+                while self._refill_pending.is_set():
+                    self._refill_pending.clear()
+                    self._refill()
+            except Exception, e:
+                # Keep the background worker alive
+                kimchi_log.error("Unable to refill the warm pools: %s", e)
+            finally:
+                self._refill_lock.release()
+
+    def _refill(self):
+        with self.objstore as session:
+            templates = dict((name, session.get('template', name))
+                             for name in session.get_list('template'))
+            reserves = dict((name, session.get('warmpool', name))
+                            for name in session.get_list('warmpool'))
+
+        # Drop the sets of deleted, changed or shrunk templates
+        ready = {}
+        for name, sets in reserves.iteritems():
+            info = templates.get(name)
+            size = info.get('warm_pool', 0) if info else 0
+            signature = storage_signature(info) if info else None
+            valid = [s for s in sets if s['signature'] == signature]
+            stale = [s for s in sets if s not in valid[:size]]
+            if stale:
+                self._remove_sets(name, stale)
+            ready[name] = len(sets) - len(stale)
+
+        for name, info in templates.iteritems():
+            missing = info.get('warm_pool', 0) - ready.get(name, 0)
+            for i in xrange(missing):
+                try:
+                    disk_set = self._provision(name)
+                except (KimchiException, libvirt.libvirtError), e:
+                    kimchi_log.error("Unable to refill the warm pool of "
+                                     "template %s: %s", name, e)
+                    break
+                if disk_set is None:
+                    break
+                self._add_set(name, disk_set)
+
+    def _add_set(self, name, disk_set):
+        with self.objstore as session:
+            try:
+                sets = session.get('warmpool', name)
+            except NotFoundError:
+                sets = []
+            sets.append(disk_set)
+            session.store('warmpool', name, sets)
+
+    def _remove_sets(self, name, stale):
+        uuids = [s['uuid'] for s in stale]
+        with self.objstore as session:
+            try:
+                sets = session.get('warmpool', name)
+            except NotFoundError:
+                return
+            removed = [s for s in sets if s['uuid'] in uuids]
+            sets = [s for s in sets if s['uuid'] not in uuids]
+            if sets:
+                session.store('warmpool', name, sets)
+            else:
+                session.delete('warmpool', name)
+
+        for disk_set in removed:
+            self._delete_disks(disk_set)
+
+    def claim(self, name, info):
+        """
+        Take a ready disk set of template 'name' whose storage matches
+        'info' out of the reserve. Return the UUID the disks were created
+        for, or None when the reserve is empty.
+        """
+        signature = storage_signature(info)
+        with self.objstore as session:
+            try:
+                sets = session.get('warmpool', name)
+            except NotFoundError:
+                return None
+            for disk_set in sets:
+                if disk_set['signature'] == signature:
+                    sets.remove(disk_set)
+                    session.store('warmpool', name, sets)
+                    break
+            else:
+                return None
+
+        # Refill in background, without waiting for the next interval nor
+        # holding kimchid at exit
+        refill = threading.Thread(target=self.refill)
+        refill.setDaemon(True)
+        refill.start()
+        return disk_set['uuid']
@@ -0,0 +1,132 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import socket
+import threading
+import time
+
+from cherrypy.process.plugins import BackgroundTask
+
+from kimchi.basemodel import Singleton
+from kimchi.utils import kimchi_log
+
+
+# nfsd and rpcbind well-known ports
+NFS_PORTS = [2049, 111]
+PROBE_TIMEOUT = 1
+CHECK_INTERVAL = 10
+MAX_BACKOFF = 300
+
+
+def probe_nfs_server(server, timeout=PROBE_TIMEOUT):
+    """
+    Check whether a NFS server is reachable by opening a TCP connection to
+    nfsd or, failing that, to the portmapper. Nothing gets mounted, so a dead
+    server costs at most 'timeout' seconds per port.
+    """
+    for port in NFS_PORTS:
+        try:
+            sock = socket.create_connection((server, port), timeout)
+        except (socket.error, socket.timeout):
+            continue
+        sock.close()
+        return True
+    return False
+
+
+class NFSMonitor(object):
+    """
+    Keep track of the reachability of every NFS server backing a netfs pool.
+
+    Servers are probed by a background thread. A server which is online is
+    re-checked every CHECK_INTERVAL seconds; an offline one is re-checked
+    with an exponential backoff up to MAX_BACKOFF seconds. Callers read the
+    cached state through is_online() without waiting on the network: a
+    server is reported as unknown (None) until its first probe has run.
+    """
+    __metaclass__ = Singleton
+
+    def __init__(self, probe=probe_nfs_server, background=True):
+        self._probe = probe
+        self._servers = {}
+        self._lock = threading.Lock()
+        # Without the background thread, the servers are only probed by
+        # calls to _check_servers()
+        self._checker = None
+        if background:
+            self._checker = BackgroundTask(1, self._check_servers)
+            self._checker.start()
+
+    def _update(self, server, online):
+        now = time.time()
+        with self._lock:
+            state = self._servers.get(server)
+            if state is None:
+                # Unwatched while being probed
+                return online
+            if online:
+                state['backoff'] = 0
+                delay = CHECK_INTERVAL
+            else:
+                state['backoff'] = min(MAX_BACKOFF,
+                                       max(CHECK_INTERVAL,
+                                           state['backoff'] * 2))
+                delay = state['backoff']
+            if state.get('online') is not None and \
+                    state['online'] != online:
+                kimchi_log.info("NFS server %s is now %s", server,
+                                'online' if online else 'offline')
+            state.update({'online': online, 'timestamp': now,
+                          'next_check': now + delay})
+        return online
+
+    def _check_servers(self):
+        now = time.time()
+        with self._lock:
+            due = [server for server, state in self._servers.items()
+                   if state['next_check'] <= now]
+        for server in due:
+            self._update(server, self._probe(server))
+
+    def watch(self, server):
+        """
+        Start monitoring a server. The first probe is left to the background
+        thread, so the state is unknown until it has run.
+        """
+        with self._lock:
+            self._servers.setdefault(server, {'backoff': 0, 'online': None,
+                                              'timestamp': None,
+                                              'next_check': 0})
+
+    def unwatch(self, server):
+        with self._lock:
+            self._servers.pop(server, None)
+
+    def status(self, server):
+        self.watch(server)
+        with self._lock:
+            state = self._servers[server]
+            return {'online': state['online'],
+                    'timestamp': state['timestamp']}
+
+    def is_online(self, server):
+        """
+        Return True or False, or None while the server was not probed yet.
+        """
+        return self.status(server)['online']
@@ -23,20 +23,269 @@ import hashlib
 import os.path
 import shutil
 import tempfile
+import threading
 import time
 
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
 
-from kimchi.isoinfo import IsoImage, probe_iso
+
+from kimchi.exception import IsoFormatError, NotFoundError
+from kimchi.isoinfo import compile_ignore_list, IsoImage, IsoProbePool
+from kimchi.isoinfo import walk_isos
 from kimchi.utils import kimchi_log
 
 
 SCAN_IGNORE = ['/tmp/kimchi-scan-*']
 
+# Number of images probed by a scan between two saves of the library, so an
+# interrupted scan of a large share does not start over
+LIBRARY_SAVE_INTERVAL = 100
+
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+
+def get_iso_library(root, objstore):
+    """
+    Return the IsoLibrary of the directory 'root', shared by all the scans
+    of that directory.
+    """
+    root = os.path.abspath(root)
+    with _libraries_lock:
+        try:
+            return _libraries[root]
+        except KeyError:
+            _libraries[root] = IsoLibrary(root, objstore)
+            return _libraries[root]
+
+
+def _decode_path(path):
+    if isinstance(path, unicode):
+        return path
+    try:
+        return path.decode('utf-8')
+    except UnicodeDecodeError:
+        # Not representable in the object store, probed on every scan
+        return None
+
+
+class IsoLibrary(object):
+    """
+    Persistent index of the ISO images under a scan root.
+
+    Each file found by a scan is recorded in the object store ('isolibrary'
+    type, one entry per root) with its size and mtime and what its probe
+    returned: distro, version and fingerprint, or a None distro for files
+    which are not bootable images. A rescan only probes the files which are
+    new or whose size or mtime changed.
+
+    When watched (see watch()), the library is kept up to date by inotify
+    events and, once a rescan caught up with the changes made before the
+    watch started, a scan just lists it without walking the directory tree.
+    inotify only reports the changes made through the local host, so
+    watching is not suitable for shares written by other hosts.
+    """
+    def __init__(self, root, objstore):
+        self.root = root
+        self.objstore = objstore
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._notifier = None
+        # Whether changes may have been missed since the last rescan
+        self._stale = True
+        self._unsaved = 0
+        with self.objstore as session:
+            try:
+                self._entries = session.get('isolibrary', root)
+            except NotFoundError:
+                self._entries = {}
+
+    @property
+    def watched(self):
+        return self._notifier is not None
+
+    def _save(self):
+        with self._lock:
+            entries = dict(self._entries)
+            self._unsaved = 0
+        with self.objstore as session:
+            session.store('isolibrary', self.root, entries)
+
+    def _probe(self, path):
+        st = os.stat(path)
+        entry = {'size': st.st_size, 'mtime': st.st_mtime}
+        try:
+            iso_img = IsoImage(path)
+            entry['distro'], entry['version'] = iso_img.probe()
+            entry['fingerprint'] = iso_img.fingerprint
+        except IsoFormatError:
+            entry['distro'] = None
+        return path, entry
+
+    def _update(self, path, entry):
+        key = _decode_path(path)
+        if key is None:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._unsaved += 1
+            save = self._unsaved >= LIBRARY_SAVE_INTERVAL
+        if save:
+            self._save()
+
+    def _remove(self, path):
+        key = _decode_path(path)
+        if key is None:
+            return
+        prefix = key.rstrip(os.sep) + os.sep
+        with self._lock:
+            for name in self._entries.keys():
+                if name == key or name.startswith(prefix):
+                    del self._entries[name]
+
+    @staticmethod
+    def _iso_info(path, entry):
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        return {'path': path, 'distro': entry['distro'],
+                'version': entry['version'],
+                'fingerprint': entry['fingerprint']}
+
+    def _is_ignored(self, path, ignore):
+        parent = os.path.dirname(path)
+        while True:
+            if ignore.match(parent):
+                return True
+            if parent == self.root or parent == os.path.dirname(parent):
+                return False
+            parent = os.path.dirname(parent)
+
+    def _list(self, ignore, updater):
+        with self._lock:
+            entries = self._entries.items()
+        for path, entry in sorted(entries):
+            if entry['distro'] is None:
+                continue
+            if ignore is not None and self._is_ignored(path, ignore):
+                continue
+            updater(self._iso_info(path, entry))
+
+    def _rescan(self, ignore, updater):
+        # Unchanged images are reported from this thread, probed ones from
+        # the probe workers: serialize the calls to 'updater'
+        updater_lock = threading.Lock()
+
+        def sink((path, entry)):
+            self._update(path, entry)
+            if entry['distro'] is not None:
+                with updater_lock:
+                    updater(self._iso_info(path, entry))
+
+        probes = IsoProbePool(self._probe, sink)
+        seen = set()
+        for path in walk_isos(self.root.encode('utf-8'), ignore):
+            key = _decode_path(path)
+            seen.add(key)
+            with self._lock:
+                entry = self._entries.get(key)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if entry is None or entry['size'] != st.st_size or \
+                    entry['mtime'] != st.st_mtime:
+                probes.submit(path)
+            elif entry['distro'] is not None:
+                with updater_lock:
+                    updater(self._iso_info(path, entry))
+        probes.wait()
+
+        # Forget the files which are gone, but not those which were just not
+        # looked for
+        with self._lock:
+            for key in set(self._entries) - seen:
+                if ignore is None or not self._is_ignored(key, ignore):
+                    del self._entries[key]
+        self._save()
+        self._stale = False
+
+    def scan(self, ignore_list, updater):
+        """
+        Call 'updater' with the path, distro, version and fingerprint of
+        every ISO under the root, except those under the 'ignore_list'
+        directories (glob patterns), as probe_iso() does.
+        """
+        ignore = compile_ignore_list(ignore_list)
+        with self._scan_lock:
+            if self.watched and not self._stale:
+                self._list(ignore, updater)
+            else:
+                self._rescan(ignore, updater)
+
+    def _inotify_event(self, event):
+        path = event.pathname
+        try:
+            if event.mask & (pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM):
+                self._remove(path)
+            elif event.dir:
+                # New directory (auto_add makes the watch report them), its
+                # content may be there before its watch
+                for iso in walk_isos(path):
+                    self._update(*self._probe(iso))
+            elif event.mask & (pyinotify.IN_CLOSE_WRITE |
+                               pyinotify.IN_MOVED_TO) and \
+                    path.lower().endswith('.iso'):
+                self._update(*self._probe(path))
+            else:
+                return
+            self._save()
+        except Exception, e:
+            kimchi_log.warning("Unable to update the ISO library of %s for "
+                               "%s: %s", self.root, path, e)
+
+    def watch(self):
+        """
+        Keep the library up to date with inotify events. Return whether the
+        library is watched: this requires pyinotify and enough inotify
+        watches for all the directories under the root.
+        """
+        with self._scan_lock:
+            if self.watched:
+                return True
+            if pyinotify is None:
+                kimchi_log.warning("pyinotify is not available, ISO "
+                                   "libraries can not be watched")
+                return False
+
+            mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | \
+                pyinotify.IN_MOVED_FROM | pyinotify.IN_DELETE
+            manager = pyinotify.WatchManager()
+            notifier = pyinotify.ThreadedNotifier(manager,
+                                                  self._inotify_event)
+            notifier.daemon = True
+            notifier.start()
+            watches = manager.add_watch(self.root.encode('utf-8'), mask,
+                                        rec=True, auto_add=True, quiet=True)
+            if not watches or min(watches.values()) < 0:
+                notifier.stop()
+                kimchi_log.warning("Unable to watch the ISO library of %s, "
+                                   "it will be rescanned", self.root)
+                return False
+
+            self._notifier = notifier
+            return True
+
+
 class Scanner(object):
     SCAN_TTL = 300
 
-    def __init__(self, record_clean_cb):
+    def __init__(self, record_clean_cb, objstore, watch=False):
         self.clean_cb = record_clean_cb
+        self.objstore = objstore
+        self.watch = watch
 
     def delete(self):
         self.clean_stale(-1)
@@ -65,22 +314,29 @@ class Scanner(object):
         return tempfile.mkdtemp(prefix='kimchi-scan-' + name, dir='/tmp')
 
     def start_scan(self, cb, params):
-        def updater(iso_info):
-            iso_name = os.path.basename(iso_info['path'])[:-3]
+        # Content fingerprint of the ISOs linked in the pool, to skip copies
+        # of the same image whatever their names
+        found = {}
 
-            duplicates = "%s/%s*" % (params['pool_path'], iso_name)
-            for f in glob.glob(duplicates):
-                iso_img = IsoImage(f)
-                if (iso_info['distro'], iso_info['version']) == iso_img.probe():
-                    return
+        # Called for each ISO as soon as it is probed, so the links show up
+        # in the transient pool while the scan goes on
+        def updater(iso_info):
+            fingerprint = iso_info['fingerprint']
+            if fingerprint is not None and fingerprint in found:
+                return
 
+            iso_name = os.path.basename(iso_info['path'])[:-3]
             iso_path = iso_name + hashlib.md5(iso_info['path']).hexdigest() + '.iso'
             link_name = os.path.join(params['pool_path'],
                                      os.path.basename(iso_path))
             os.symlink(iso_info['path'], link_name)
+            # Images without fingerprint are never taken for copies
+            found[fingerprint or link_name] = link_name
+            cb('%d ISO files found' % len(found))
 
+        library = get_iso_library(params['scan_path'], self.objstore)
+        if self.watch:
+            library.watch()
         ignore_paths = params.get('ignore_list', [])
-        scan_params = dict(path=params['scan_path'], updater=updater,
-            ignore_list=ignore_paths + SCAN_IGNORE)
-        probe_iso(None, scan_params)
+        library.scan(ignore_paths + SCAN_IGNORE, updater)
         cb('', True)
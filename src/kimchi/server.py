@@ -31,10 +31,15 @@ from kimchi import mockmodel
 from kimchi import vnc
 from kimchi.config import paths, KimchiConfig, PluginConfig
 from kimchi.control import sub_nodes
+from kimchi.isoproxy import start_iso_proxy
 from kimchi.root import KimchiRoot
 from kimchi.utils import get_enabled_plugins, import_class
 
 
+# Largest request body accepted, except by storage volume uploads which
+# stream disk images of any size (see StorageVolumeContent)
+MAX_REQUEST_BODY_SIZE = 100 * 1024 * 1024
+
 LOGGING_LEVEL = {"debug": logging.DEBUG,
                  "info": logging.INFO,
                  "warning": logging.WARNING,
@@ -76,6 +81,12 @@ class Server(object):
                                                   auth.kimchiauth)
         cherrypy.server.socket_host = options.host
         cherrypy.server.socket_port = options.port
+        # The HTTP server rejects large bodies before the request reaches
+        # any handler, so its limit is lifted and enforced by CherryPy when
+        # reading the bodies of all the other handlers
+        cherrypy.server.max_request_body_size = 0
+        cherrypy.config.update({'request.body.maxbytes':
+                                MAX_REQUEST_BODY_SIZE})
 
         # SSL Server
         try:
@@ -123,6 +134,9 @@ class Server(object):
         if isinstance(model_instance, model.Model):
             vnc_ws_proxy = vnc.new_ws_proxy()
             cherrypy.engine.subscribe('exit', vnc_ws_proxy.kill)
+            iso_proxy = start_iso_proxy()
+            if iso_proxy is not None:
+                cherrypy.engine.subscribe('exit', iso_proxy.stop)
 
         for ident, node in sub_nodes.items():
             if node.url_auth:
@@ -165,6 +179,7 @@ class Server(object):
         ssl_server.socket_port = options.ssl_port
         ssl_server._socket_host = options.host
         ssl_server.ssl_module = 'builtin'
+        ssl_server.max_request_body_size = 0
 
         cert = options.ssl_cert
         key = options.ssl_key
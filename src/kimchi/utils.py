@@ -26,7 +26,6 @@ import pwd
 import re
 import subprocess
 import traceback
-import urllib2
 from multiprocessing import Process, Queue
 from threading import Timer
 
@@ -35,6 +34,7 @@ from cherrypy.lib.reprconf import Parser
 from kimchi.asynctask import AsyncTask
 from kimchi.config import paths, PluginPaths
 from kimchi.exception import InvalidParameter, TimeoutExpired
+from kimchi.httppool import URLChecker
 
 
 kimchi_log = cherrypy.log.error_log
@@ -123,14 +123,7 @@ def import_module(module_name):
 
 
 def check_url_path(path):
-    try:
-        code = urllib2.urlopen(path).getcode()
-        if code != 200:
-            return False
-    except (urllib2.URLError, ValueError):
-        return False
-
-    return True
+    return URLChecker().check(path)
 
 
 def run_command(cmd, timeout=None):
@@ -218,7 +211,7 @@ def patch_find_nfs_target(nfs_server):
     except TimeoutExpired:
         kimchi_log.warning("server %s query timeout, may not have any path "
                            "exported", nfs_server)
-        return list()
+        return None
 
     targets = parse_cmd_output(out, output_items=['target'])
     for target in targets:
@@ -17,12 +17,20 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 
+import copy
+import json
 import os
 import string
 import socket
+import threading
 import urlparse
 
 
+from collections import OrderedDict
+from lxml import etree
+from lxml.builder import E, ElementMaker
+
+
 from kimchi import osinfo
 from kimchi.config import READONLY_POOL_TYPE
 from kimchi.exception import InvalidParameter, IsoFormatError
@@ -30,7 +38,16 @@ from kimchi.isoinfo import IsoImage
 from kimchi.utils import check_url_path, pool_name_from_uri
 
 
-QEMU_NAMESPACE = "xmlns:qemu='http://libvirt.org/schemas/domain/qemu/1.0'"
+QEMU_NAMESPACE = 'http://libvirt.org/schemas/domain/qemu/1.0'
+QEMU = ElementMaker(namespace=QEMU_NAMESPACE,
+                    nsmap={'qemu': QEMU_NAMESPACE})
+
+# Number of domain skeletons (see VMTemplate._get_domain_skeleton()) kept
+DOMAIN_CACHE_SIZE = 64
+
+_domain_cache = OrderedDict()
+_domain_cache_lock = threading.Lock()
+
 
 class VMTemplate(object):
     _bus_to_dev = {'ide': 'hd', 'virtio': 'vd', 'scsi': 'sd'}
@@ -81,45 +98,23 @@ class VMTemplate(object):
         except IsoFormatError:
             raise InvalidParameter("KCHISO0001E", {'filename': iso})
 
-    def _get_cdrom_xml(self, libvirt_stream, qemu_stream_dns):
+    def _get_cdrom_elem(self, libvirt_stream, qemu_stream_dns, iso_proxy=None):
         bus = self.info['cdrom_bus']
         dev = "%s%s" % (self._bus_to_dev[bus],
                         string.lowercase[self.info['cdrom_index']])
 
-        local_file = """
-            <disk type='file' device='cdrom'>
-              <driver name='qemu' type='raw'/>
-              <source file='%(src)s' />
-              <target dev='%(dev)s' bus='%(bus)s'/>
-              <readonly/>
-            </disk>
-        """
-
-        network_file = """
-            <disk type='network' device='cdrom'>
-              <driver name='qemu' type='raw'/>
-              <source protocol='%(protocol)s' name='%(url_path)s'>
-                <host name='%(hostname)s' port='%(port)s'/>
-              </source>
-              <target dev='%(dev)s' bus='%(bus)s'/>
-              <readonly/>
-            </disk>
-        """
-
-        qemu_stream_cmdline = """
-            <qemu:commandline>
-              <qemu:arg value='-drive'/>
-              <qemu:arg value='file=%(url)s,if=none,id=drive-%(bus)s0-1-0,readonly=on,format=raw'/>
-              <qemu:arg value='-device'/>
-              <qemu:arg value='%(bus)s-cd,bus=%(bus)s.1,unit=0,drive=drive-%(bus)s0-1-0,id=%(bus)s0-1-0'/>
-            </qemu:commandline>
-        """
-
         if not self.info.get('iso_stream', False):
-            params = {'src': self.info['cdrom'], 'dev': dev, 'bus': bus}
-            return local_file % (params)
+            return E.disk(E.driver(name='qemu', type='raw'),
+                          E.source(file=self.info['cdrom']),
+                          E.target(dev=dev, bus=bus),
+                          E.readonly(),
+                          type='file', device='cdrom')
+
+        url = self.info['cdrom']
+        if iso_proxy is not None:
+            url = iso_proxy.register(url)
 
-        output = urlparse.urlparse(self.info['cdrom'])
+        output = urlparse.urlparse(url)
         port = output.port
         protocol = output.scheme
         hostname = output.hostname
@@ -128,75 +123,73 @@ class VMTemplate(object):
         if port is None:
             port = socket.getservbyname(protocol)
 
-        url = self.info['cdrom']
         if not qemu_stream_dns:
             hostname = socket.gethostbyname(hostname)
             url = protocol + "://" + hostname + ":" + str(port) + url_path
 
         if not libvirt_stream:
-            return qemu_stream_cmdline % {'url': url, 'bus': bus}
-
-        params = {'protocol': protocol, 'url_path': url_path,
-                  'hostname': hostname, 'port': port, 'dev': dev, 'bus': bus}
-
-        return network_file % (params)
-
-    def _get_disks_xml(self, vm_uuid):
-        storage_path = self._get_storage_path()
-        ret = ""
-        for i, disk in enumerate(self.info['disks']):
-            index = disk.get('index', i)
-            volume = "%s-%s.img" % (vm_uuid, index)
-            src = os.path.join(storage_path, volume)
-            dev = "%s%s" % (self._bus_to_dev[self.info['disk_bus']],
-                            string.lowercase[index])
-            fmt = 'raw' if self._get_storage_type() in ['logical'] else 'qcow2'
-            params = {'src': src, 'dev': dev, 'bus': self.info['disk_bus'], 'type': fmt}
-            ret += """
-            <disk type='file' device='disk'>
-              <driver name='qemu' type='%(type)s' cache='none'/>
-              <source file='%(src)s' />
-              <target dev='%(dev)s' bus='%(bus)s' />
-            </disk>
-            """ % params
-        return ret
-
-    def _get_graphics_xml(self, params):
-        graphics_xml = """
-            <graphics type='%(type)s' autoport='yes' listen='%(listen)s'>
-            </graphics>
+            drive = 'drive-%s0-1-0' % bus
+            return QEMU.commandline(
+                QEMU.arg(value='-drive'),
+                QEMU.arg(value='file=%s,if=none,id=%s,readonly=on,'
+                               'format=raw' % (url, drive)),
+                QEMU.arg(value='-device'),
+                QEMU.arg(value='%s-cd,bus=%s.1,unit=0,drive=%s,id=%s0-1-0'
+                               % (bus, bus, drive, bus)))
+
+        return E.disk(E.driver(name='qemu', type='raw'),
+                      E.source(E.host(name=hostname, port=str(port)),
+                               protocol=protocol, name=url_path),
+                      E.target(dev=dev, bus=bus),
+                      E.readonly(),
+                      type='network', device='cdrom')
+
+    def _get_disks_elems(self, storage_type):
         """
-        spicevmc_xml = """
-            <channel type='spicevmc'>
-              <target type='virtio' name='com.redhat.spice.0'/>
-            </channel>
+        Return the disk elements of the template and the volume index of
+        each of them. Their source is set by to_vm_xml(), as the volume
+        names depend on the VM UUID.
         """
+        fmt = 'raw' if storage_type in ['logical'] else 'qcow2'
+        bus = self.info['disk_bus']
+        elems = []
+        indexes = []
+        for i, disk in enumerate(self.info['disks']):
+            index = disk.get('index', i)
+            dev = "%s%s" % (self._bus_to_dev[bus], string.lowercase[index])
+            elems.append(E.disk(E.driver(name='qemu', type=fmt, cache='none'),
+                                E.source(),
+                                E.target(dev=dev, bus=bus),
+                                type='file', device='disk'))
+            indexes.append(index)
+        return elems, indexes
+
+    def _get_graphics_elems(self, params):
         graphics = dict(self.info['graphics'])
         if params:
             graphics.update(params)
-        graphics_xml = graphics_xml % graphics
+        elems = [E.graphics(type=graphics['type'], autoport='yes',
+                            listen=graphics['listen'])]
         if graphics['type'] == 'spice':
-            graphics_xml = graphics_xml + spicevmc_xml
-        return graphics_xml
+            elems.append(E.channel(E.target(type='virtio',
+                                            name='com.redhat.spice.0'),
+                                   type='spicevmc'))
+        return elems
 
-    def _get_scsi_disks_xml(self, luns):
-        ret = ""
+    def _get_scsi_disks_elems(self, luns):
         # Passthrough configuration
-        disk_xml = """
-            <disk type='volume' device='lun'>
-              <driver name='qemu' type='raw' cache='none'/>
-              <source dev='%(src)s'/>
-              <target dev='%(dev)s' bus='scsi'/>
-            </disk>"""
-        if not self.fc_host_support:
-            disk_xml = disk_xml.replace('volume','block')
+        disk_type = 'volume' if self.fc_host_support else 'block'
 
         # Creating disk xml for each lun passed
-        for index,(lun, path) in enumerate(luns):
+        elems = []
+        for index, (lun, path) in enumerate(luns):
             dev = "sd%s" % string.lowercase[index]
-            params = {'src': path, 'dev': dev}
-            ret = ret + disk_xml % params
-        return ret
+            elems.append(E.disk(E.driver(name='qemu', type='raw',
+                                         cache='none'),
+                                E.source(dev=path),
+                                E.target(dev=dev, bus='scsi'),
+                                type=disk_type, device='lun'))
+        return elems
 
     def to_volume_list(self, vm_uuid):
         storage_path = self._get_storage_path()
@@ -205,14 +198,31 @@ class VMTemplate(object):
         for i, d in enumerate(self.info['disks']):
             index = d.get('index', i)
             volume = "%s-%s.img" % (vm_uuid, index)
+            # The size of a linked clone defaults to the base volume size
+            size = d.get('size', 0) if 'volume' in d else d['size']
 
             info = {'name': volume,
-                    'capacity': d['size'],
+                    'capacity': size,
                     'type': 'disk',
                     'format': fmt,
                     'path': '%s/%s' % (storage_path, volume)}
 
             info['allocation'] = 0 if fmt == 'qcow2' else info['capacity']
+            info['backing_store'] = ''
+            if 'volume' in d:
+                # Linked clone: a qcow2 overlay on top of the base volume
+                if fmt != 'qcow2':
+                    raise InvalidParameter("KCHTMPL0019E",
+                                           {'template': self.name})
+                base = self._get_volume_info(d['volume'])
+                base_size = -(-base['capacity'] // (1 << 30))
+                info['capacity'] = max(info['capacity'], base_size)
+                info['backing_store'] = """
+              <backingStore>
+                <path>%(path)s</path>
+                <format type='%(format)s'/>
+              </backingStore>""" % base
+                info['base'] = base['path']
             info['xml'] = """
             <volume>
               <name>%(name)s</name>
@@ -221,106 +231,117 @@ class VMTemplate(object):
               <target>
                 <format type='%(format)s'/>
                 <path>%(path)s</path>
-              </target>
+              </target>%(backing_store)s
             </volume>
             """ % info
+            del info['backing_store']
             ret.append(info)
         return ret
 
-    def _get_networks_xml(self):
-        network = """
-            <interface type='network'>
-              <source network='%(network)s'/>
-              <model type='%(nic_model)s'/>
-            </interface>
-        """
-        networks = ""
-        net_info = {"nic_model": self.info['nic_model']}
-        for nw in self.info['networks']:
-            net_info['network'] = nw
-            networks += network % net_info
-        return networks
-
-    def _get_input_output_xml(self):
-        sound = """
-            <sound model='%(sound_model)s' />
-        """
-        mouse = """
-            <input type='mouse' bus='%(mouse_bus)s'/>
-        """
-        keyboard = """
-            <input type='kbd' bus='%(kbd_bus)s'> </input>
-        """
+    def _get_networks_elems(self):
+        return [E.interface(E.source(network=nw),
+                            E.model(type=self.info['nic_model']),
+                            type='network')
+                for nw in self.info['networks']]
 
-        input_output = ""
+    def _get_input_output_elems(self):
+        elems = []
         if 'mouse_bus' in self.info.keys():
-            input_output += mouse % self.info
+            elems.append(E.input(type='mouse', bus=self.info['mouse_bus']))
         if 'kbd_bus' in self.info.keys():
-            input_output += keyboard % self.info
+            elems.append(E.input(type='kbd', bus=self.info['kbd_bus']))
         if 'sound_model' in self.info.keys():
-            input_output += sound % self.info
-        return input_output
+            elems.append(E.sound(model=self.info['sound_model']))
+        return elems
+
+    def _build_domain(self, graphics, storage_type, qemu_stream):
+        nsmap = {'qemu': QEMU_NAMESPACE} if qemu_stream else None
+        domain = etree.Element('domain', nsmap=nsmap,
+                               type=self.info['domain'])
+
+        disks, disk_indexes = [], []
+        if storage_type not in READONLY_POOL_TYPE:
+            disks, disk_indexes = self._get_disks_elems(storage_type)
+
+        devices = E.devices(*(disks + self._get_networks_elems() +
+                              self._get_graphics_elems(graphics) +
+                              self._get_input_output_elems()))
+        devices.append(E.memballoon(model='virtio'))
+
+        domain.extend([E.name(),
+                       E.uuid(),
+                       E.memory(str(self.info['memory']), unit='MiB'),
+                       E.vcpu(str(self.info['cpus'])),
+                       E.os(E.type('hvm', arch=self.info['arch']),
+                            E.boot(dev='hd'),
+                            E.boot(dev='cdrom')),
+                       E.features(E.acpi(), E.apic(), E.pae()),
+                       E.clock(offset='utc'),
+                       E.on_poweroff('destroy'),
+                       E.on_reboot('restart'),
+                       E.on_crash('restart'),
+                       devices])
+        return domain, disk_indexes
+
+    def _get_domain_skeleton(self, graphics, storage_type, qemu_stream):
+        """
+        Return a copy of the domain element of this version of the
+        template, with everything but the VM specific parts (name, UUID,
+        disk sources and CDROM), and the volume index of its disks.
+
+        Skeletons are kept for the DOMAIN_CACHE_SIZE template versions used
+        last, so creating several VMs from a template builds it only once.
+        """
+        key = json.dumps([self.__class__.__name__, self.info, graphics,
+                          storage_type, qemu_stream], sort_keys=True)
+        with _domain_cache_lock:
+            skeleton = _domain_cache.pop(key, None)
+        if skeleton is None:
+            skeleton = self._build_domain(graphics, storage_type,
+                                          qemu_stream)
+        with _domain_cache_lock:
+            _domain_cache[key] = skeleton
+            while len(_domain_cache) > DOMAIN_CACHE_SIZE:
+                _domain_cache.popitem(last=False)
+
+        domain, disk_indexes = skeleton
+        return copy.deepcopy(domain), disk_indexes
 
     def to_vm_xml(self, vm_name, vm_uuid, **kwargs):
-        params = dict(self.info)
-        params['name'] = vm_name
-        params['uuid'] = vm_uuid
-        params['networks'] = self._get_networks_xml()
-        params['input_output'] = self._get_input_output_xml()
-        params['qemu-namespace'] = ''
-        params['cdroms'] = ''
-        params['qemu-stream-cmdline'] = ''
-        graphics = kwargs.get('graphics')
-        params['graphics'] = self._get_graphics_xml(graphics)
+        qemu_stream_dns = kwargs.get('qemu_stream_dns', False)
+        libvirt_stream = kwargs.get('libvirt_stream', False)
+        qemu_stream = (self.info.get('iso_stream', False) and
+                       not libvirt_stream)
+        storage_type = self._get_storage_type()
+        domain, disk_indexes = self._get_domain_skeleton(
+            kwargs.get('graphics'), storage_type, qemu_stream)
+
+        domain.find('name').text = vm_name
+        domain.find('uuid').text = vm_uuid
 
         # Current implementation just allows to create disk in one single
         # storage pool, so we cannot mix the types (scsi volumes vs img file)
-        if self._get_storage_type() in READONLY_POOL_TYPE:
-            params['disks'] = self._get_scsi_disks_xml(kwargs.get('volumes'))
+        devices = domain.find('devices')
+        if storage_type in READONLY_POOL_TYPE:
+            luns = self._get_scsi_disks_elems(kwargs.get('volumes'))
+            devices[0:0] = luns
+            ndisks = len(luns)
         else:
-            params['disks'] = self._get_disks_xml(vm_uuid)
-
-        qemu_stream_dns = kwargs.get('qemu_stream_dns', False)
-        libvirt_stream = kwargs.get('libvirt_stream', False)
-        cdrom_xml = self._get_cdrom_xml(libvirt_stream, qemu_stream_dns)
-        if not libvirt_stream and params.get('iso_stream', False):
-            params['qemu-namespace'] = QEMU_NAMESPACE
-            params['qemu-stream-cmdline'] = cdrom_xml
+            storage_path = self._get_storage_path()
+            sources = devices.findall("disk[@device='disk']/source")
+            for source, index in zip(sources, disk_indexes):
+                volume = "%s-%s.img" % (vm_uuid, index)
+                source.set('file', os.path.join(storage_path, volume))
+            ndisks = len(sources)
+
+        cdrom = self._get_cdrom_elem(libvirt_stream, qemu_stream_dns,
+                                     kwargs.get('iso_proxy'))
+        if qemu_stream:
+            domain.insert(0, cdrom)
         else:
-            params['cdroms'] = cdrom_xml
-
-        xml = """
-        <domain type='%(domain)s' %(qemu-namespace)s>
-          %(qemu-stream-cmdline)s
-          <name>%(name)s</name>
-          <uuid>%(uuid)s</uuid>
-          <memory unit='MiB'>%(memory)s</memory>
-          <vcpu>%(cpus)s</vcpu>
-          <os>
-            <type arch='%(arch)s'>hvm</type>
-            <boot dev='hd'/>
-            <boot dev='cdrom'/>
-          </os>
-          <features>
-            <acpi/>
-            <apic/>
-            <pae/>
-          </features>
-          <clock offset='utc'/>
-          <on_poweroff>destroy</on_poweroff>
-          <on_reboot>restart</on_reboot>
-          <on_crash>restart</on_crash>
-          <devices>
-            %(disks)s
-            %(cdroms)s
-            %(networks)s
-            %(graphics)s
-            %(input_output)s
-            <memballoon model='virtio' />
-          </devices>
-        </domain>
-        """ % params
-        return xml
+            devices.insert(ndisks, cdrom)
+
+        return etree.tostring(domain, encoding=unicode, pretty_print=True)
 
     def validate(self):
         self._storage_validate()
@@ -345,12 +366,30 @@ class VMTemplate(object):
     def _get_storage_type(self):
         return ''
 
+    def _get_volume_info(self, name):
+        """
+        Return the 'path', 'capacity' (in bytes) and 'format' of the volume
+        'name' of the template storage pool.
+        """
+        raise InvalidParameter("KCHTMPL0018E", {'volume': name,
+                                                'template': self.name})
+
     def _get_all_networks_name(self):
         return []
 
     def _get_all_storagepools_name(self):
         return []
 
+    def _has_volume(self, name):
+        try:
+            self._get_volume_info(name)
+        except InvalidParameter:
+            return False
+        return True
+
+    def _has_iso(self, iso):
+        return os.path.isfile(iso) or check_url_path(iso)
+
     def validate_integrity(self):
         invalid = {}
         # validate networks integrity
@@ -365,10 +404,18 @@ class VMTemplate(object):
         if pool_name not in self._get_all_storagepools_name():
             invalid['storagepools'] = [pool_name]
 
+        # validate base volumes integrity
+        invalid_volumes = []
+        for disk in self.info['disks']:
+            if 'volume' in disk and not self._has_volume(disk['volume']):
+                invalid_volumes.append(disk['volume'])
+        if invalid_volumes:
+            invalid['disks'] = invalid_volumes
+
         # validate iso integrity
         # FIXME when we support multiples cdrom devices
         iso = self.info['cdrom']
-        if not (os.path.isfile(iso) or check_url_path(iso)):
+        if not self._has_iso(iso):
             invalid['cdrom'] = [iso]
 
         self.info['invalid'] = invalid
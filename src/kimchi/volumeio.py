@@ -0,0 +1,166 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import errno
+import os
+import stat
+import time
+
+
+IO_CHUNK_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 1
+
+# Not exported by the os module of Python 2, values are the Linux ones
+SEEK_DATA = getattr(os, 'SEEK_DATA', 3)
+SEEK_HOLE = getattr(os, 'SEEK_HOLE', 4)
+
+QCOW2_MAGIC = 'QFI\xfb'
+
+
+class Throttle(object):
+    """
+    Keep an I/O loop under 'rate' MB/s (no limit if 'rate' is 0 or None)
+    and report its progress through 'progress_cb(done)' at most once every
+    PROGRESS_INTERVAL seconds.
+    """
+    def __init__(self, rate=None, progress_cb=None):
+        self.rate = (rate or 0) * 1024 * 1024
+        self.progress_cb = progress_cb
+        self.done = 0
+        self._start = time.time()
+        self._last_report = 0
+
+    def consume(self, nbytes):
+        self.done += nbytes
+        now = time.time()
+        if self.rate:
+            delay = self.done / float(self.rate) - (now - self._start)
+            if delay > 0:
+                time.sleep(delay)
+                now = time.time()
+
+        if self.progress_cb and now - self._last_report >= PROGRESS_INTERVAL:
+            self._last_report = now
+            self.progress_cb(self.done)
+
+
+def data_extents(fd, size):
+    """
+    Yield (offset, length) of the data regions of the file 'fd', skipping
+    its holes. The whole file is a single region on file systems without
+    SEEK_DATA/SEEK_HOLE support.
+    """
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, SEEK_DATA)
+        except OSError, e:
+            if e.errno == errno.ENXIO:
+                # Only a hole is left up to the end of file
+                return
+            if e.errno == errno.EINVAL and offset == 0:
+                yield 0, size
+                return
+            raise
+        end = min(os.lseek(fd, start, SEEK_HOLE), size)
+        yield start, end - start
+        offset = end
+
+
+def _write_all(fd, data):
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+def copy_sparse_file(src_path, dst_path, throttle):
+    """
+    Copy the file 'src_path' over 'dst_path', keeping the destination
+    sparse: holes of the source are not read and all-zero chunks are not
+    written.
+    """
+    src = os.open(src_path, os.O_RDONLY)
+    try:
+        dst = os.open(dst_path, os.O_WRONLY)
+        try:
+            size = os.fstat(src).st_size
+            os.ftruncate(dst, 0)
+            os.ftruncate(dst, size)
+            for start, length in data_extents(src, size):
+                os.lseek(src, start, os.SEEK_SET)
+                os.lseek(dst, start, os.SEEK_SET)
+                while length > 0:
+                    data = os.read(src, min(IO_CHUNK_SIZE, length))
+                    if not data:
+                        break
+                    if data.strip('\0'):
+                        _write_all(dst, data)
+                    else:
+                        os.lseek(dst, len(data), os.SEEK_CUR)
+                    length -= len(data)
+                    throttle.consume(len(data))
+            os.fsync(dst)
+        finally:
+            os.close(dst)
+    finally:
+        os.close(src)
+
+
+def maybe_qcow2(path):
+    """
+    Return whether the file or block device 'path' starts with a qcow2
+    header, i.e. may have a backing file. Unreadable volumes may be qcow2
+    ones too.
+    """
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(QCOW2_MAGIC)) == QCOW2_MAGIC
+    except (IOError, OSError):
+        return True
+
+
+def zero_file(path, throttle):
+    """
+    Overwrite the file or block device 'path' with zeros. Like libvirt does,
+    sparse files are truncated instead, which is instant. Only meant for
+    raw volumes: the header of formats such as qcow2 would be zeroed too.
+    """
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        st = os.fstat(fd)
+        if stat.S_ISREG(st.st_mode):
+            size = st.st_size
+            if st.st_blocks * 512 < size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                return
+        else:
+            size = os.lseek(fd, 0, os.SEEK_END)
+            os.lseek(fd, 0, os.SEEK_SET)
+
+        zeros = '\0' * IO_CHUNK_SIZE
+        done = 0
+        while done < size:
+            length = min(IO_CHUNK_SIZE, size - done)
+            _write_all(fd, zeros[:length])
+            done += length
+            throttle.consume(length)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -20,6 +20,7 @@
 import libxml2
 
 
+from lxml import etree
 from xml.etree import ElementTree
 
 
@@ -32,6 +33,39 @@ def xpath_get_text(xml, expr):
     return ret
 
 
+def xpath_compile(exprs):
+    """
+    Compile the dict of named XPath expressions 'exprs' once, to evaluate
+    them on many documents with xpath_get_texts().
+    """
+    return dict((name, etree.XPath(expr, smart_strings=False))
+                for name, expr in exprs.iteritems())
+
+
+def _node_text(node):
+    # Same values as xpath_get_text(): None for empty attributes and
+    # elements, UTF-8 encoded strings
+    text = node if isinstance(node, basestring) else node.text
+    if not text:
+        return None
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+
+def xpath_get_texts(xml, xpaths):
+    """
+    Parse 'xml' once and evaluate on it all the expressions of 'xpaths',
+    as returned by xpath_compile(). Return a dict with the result of each
+    expression under its name, in the format of xpath_get_text().
+    """
+    if isinstance(xml, unicode):
+        xml = xml.encode('utf-8')
+    root = etree.fromstring(xml)
+    return dict((name, [_node_text(node) for node in xpath(root)])
+                for name, xpath in xpaths.iteritems())
+
+
 def xml_item_update(xml, xpath, value):
     root = ElementTree.fromstring(xml)
     item = root.find(xpath)
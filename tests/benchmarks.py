@@ -0,0 +1,167 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""
+Throughput measurements of the code paths whose cost grows with the size of
+the host. Their results depend on the machine, so they are not part of the
+test suite. Run them from the tests directory:
+
+    PYTHONPATH=../src:../ python benchmarks.py [name ...]
+"""
+
+import sys
+import time
+
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def measure(name, func, items):
+    """
+    Print the time taken by 'func()' to process 'items' items.
+    """
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print "%-40s %8.3fs %12.1f/s" % (name, elapsed, items / elapsed)
+
+
+@benchmark
+def disks_inventory():
+    from kimchi.disks import _build_inventory, _parse_lsblk_output
+    from kimchi.disks import INVENTORY_KEYS
+    from test_disks import lsblk_output, san_devs
+
+    output = lsblk_output(san_devs(1000))
+
+    def inventory():
+        devs = _parse_lsblk_output(output, INVENTORY_KEYS)
+        _build_inventory(devs, {}, lambda disk: None)
+    measure('inventory of 1000 multipath LUNs', inventory, 1000)
+
+
+@benchmark
+def distro_matcher():
+    import re
+
+    from kimchi.isoinfo import distro_matcher
+    from test_isoinfo import table_match, VOLUME_IDS
+
+    volume_ids = ['%s %d' % (volume_id, i)
+                  for i in xrange(100) for volume_id, e in VOLUME_IDS]
+
+    # Flush the re module cache as other code may do between two probes
+    def match(func):
+        def run():
+            for volume_id in volume_ids:
+                re.purge()
+                func(volume_id)
+        return run
+    measure('match Volume IDs', match(distro_matcher.match),
+            len(volume_ids))
+    measure('walk the table for Volume IDs', match(table_match),
+            len(volume_ids))
+
+
+@benchmark
+def deep_scan():
+    import os
+    import shutil
+    import tempfile
+
+    from iso_gen import construct_fake_iso
+    from kimchi.isoinfo import probe_iso
+
+    top = tempfile.mkdtemp()
+    try:
+        for i in xrange(200):
+            path = os.path.join(top, 'dir%d' % (i % 10), 'image%d.iso' % i)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            construct_fake_iso(path, True, '17', 'fedora')
+
+        found = []
+        params = {'path': top, 'updater': found.append, 'ignore_list': []}
+        measure('deep scan of 200 images', lambda: probe_iso(None, params),
+                200)
+    finally:
+        shutil.rmtree(top)
+
+
+@benchmark
+def domain_xml():
+    import uuid
+
+    from test_vmtemplate import GOLDEN_CASES, GoldenTemplate
+
+    overrides, storage_type, kwargs = GOLDEN_CASES['spice-multi']
+    t = GoldenTemplate(overrides, storage_type)
+    count = 1000
+
+    def generate(new_version):
+        def run():
+            for i in xrange(count):
+                if new_version:
+                    t.info['cpus'] = i + 1
+                t.to_vm_xml('vm-%d' % i, str(uuid.uuid4()), **kwargs)
+        return run
+    measure('domain XML from a cached skeleton', generate(False), count)
+    # Versus building the whole document each time
+    measure('domain XML of new template versions', generate(True), count)
+
+
+@benchmark
+def xpath_texts():
+    from kimchi.model.networks import NETWORK_XPATHS
+    from kimchi.xmlutils import xpath_get_text, xpath_get_texts
+    from test_xmlutils import NETWORK_XML
+
+    count = 1000
+
+    def single_parse():
+        for i in xrange(count):
+            xpath_get_texts(NETWORK_XML, NETWORK_XPATHS)
+
+    # One parse per expression, as get_network_from_xml() used to do
+    exprs = [xpath.path for xpath in NETWORK_XPATHS.itervalues()]
+
+    def parse_per_expression():
+        for i in xrange(count):
+            for expr in exprs:
+                xpath_get_text(NETWORK_XML, expr)
+    measure('network XML, single parse', single_parse, count)
+    measure('network XML, one parse per expression', parse_per_expression,
+            count)
+
+
+def main(names):
+    for name in names or sorted(BENCHMARKS):
+        if name not in BENCHMARKS:
+            sys.exit("Unknown benchmark %s, available ones: %s" %
+                     (name, ', '.join(sorted(BENCHMARKS))))
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
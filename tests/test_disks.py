@@ -0,0 +1,107 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import unittest
+
+
+from kimchi.disks import _build_inventory, _parse_lsblk_output
+from kimchi.disks import INVENTORY_KEYS
+
+
+LSBLK_LINE = ('NAME="%s" KNAME="%s" PKNAME="%s" TYPE="%s" FSTYPE="%s" '
+              'SIZE="%d" MOUNTPOINT="%s"')
+
+# (name, kname, pkname, type, fstype, size, mountpoint)
+LSBLK_DEVS = [
+    ('sda', 'sda', '', 'disk', '', 8 << 30, ''),
+    ('sda1', 'sda1', 'sda', 'part', 'ext4', 1 << 30, '/boot'),
+    ('sda2', 'sda2', 'sda', 'part', 'LVM2_member', 7 << 30, ''),
+    ('vg-root', 'dm-1', 'sda2', 'lvm', 'ext4', 6 << 30, '/'),
+    ('vg-swap', 'dm-2', 'sda2', 'lvm', 'swap', 1 << 30, '[SWAP]'),
+    ('sdb', 'sdb', '', 'disk', '', 1 << 30, ''),
+    ('sdc', 'sdc', '', 'disk', '', 4 << 30, ''),
+    ('sdc1', 'sdc1', 'sdc', 'part', '', 1 << 30, ''),
+    ('sdc2', 'sdc2', 'sdc', 'part', '', 1024, ''),
+    ('sdc5', 'sdc5', 'sdc', 'part', 'LVM2_member', 3 << 30, ''),
+    # Both paths of a multipath device list it as their child
+    ('sdd', 'sdd', '', 'disk', '', 2 << 30, ''),
+    ('mpatha', 'dm-0', 'sdd', 'mpath', '', 2 << 30, ''),
+    ('sde', 'sde', '', 'disk', '', 2 << 30, ''),
+    ('mpatha', 'dm-0', 'sde', 'mpath', '', 2 << 30, '')]
+
+
+def lsblk_output(devs):
+    return '\n'.join(LSBLK_LINE % dev for dev in devs) + '\n'
+
+
+def san_devs(luns):
+    # Synthetic host with 'luns' multipath LUNs, each with two paths and a
+    # partition
+    devs = []
+    for i in xrange(luns):
+        mpath = 'mpath%d' % i
+        dm = 'dm-%d' % i
+        for path in ('sd%da' % i, 'sd%db' % i):
+            devs.append((path, path, '', 'disk', '', 10 << 30, ''))
+            devs.append((mpath, dm, path, 'mpath', '', 10 << 30, ''))
+            devs.append((mpath + 'p1', dm + 'p1', dm, 'part', '', 10 << 30,
+                         ''))
+    return devs
+
+
+class DisksTests(unittest.TestCase):
+    def setUp(self):
+        self.extended_lookups = []
+
+    def _get_extended_partition(self, disk):
+        self.extended_lookups.append(disk)
+        return {'/dev/sdc': '/dev/sdc2'}.get(disk)
+
+    def test_inventory(self):
+        devs = _parse_lsblk_output(lsblk_output(LSBLK_DEVS), INVENTORY_KEYS)
+        vgs = {'/dev/sda2': 'vg', '/dev/sdc5': ''}
+        inventory = _build_inventory(devs, vgs, self._get_extended_partition)
+
+        available = sorted(name for name, dev in inventory.iteritems()
+                           if dev['available'])
+        self.assertEquals(['sdb', 'sdc1', 'sdc5'], available)
+        # Only looked up once per disk, and only for listed partitions
+        self.assertEquals(['/dev/sdc'], self.extended_lookups)
+
+        self.assertEquals('/dev/dm-0', inventory['mpatha']['path'])
+        self.assertEquals('', inventory['vg-swap']['mountpoint'])
+        self.assertEquals({'name': 'sdc5', 'path': '/dev/sdc5',
+                           'type': 'part', 'fstype': 'LVM2_member',
+                           'size': str(3 << 30), 'mountpoint': '',
+                           'available': True}, inventory['sdc5'])
+
+    def test_inventory_san(self):
+        luns = 100
+        devs = _parse_lsblk_output(lsblk_output(san_devs(luns)),
+                                   INVENTORY_KEYS)
+        inventory = _build_inventory(devs, {}, self._get_extended_partition)
+
+        available = [name for name, dev in inventory.iteritems()
+                     if dev['available']]
+        self.assertEquals(luns, len(available))
+        # No command is run per device: the extended partition is the only
+        # lookup, once per multipath device
+        self.assertEquals(luns, len(self.extended_lookups))
+        self.assertEquals(len(set(self.extended_lookups)),
+                          len(self.extended_lookups))
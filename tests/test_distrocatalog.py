@@ -0,0 +1,122 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+from kimchi.basemodel import Singleton
+from kimchi.model import distrocatalog
+from kimchi.model.distrocatalog import DistroCatalog
+
+
+ARCH = os.uname()[4]
+
+
+def distro(name, path):
+    return {'name': name, 'os_distro': 'fedora', 'os_version': name[-2:],
+            'os_arch': ARCH, 'path': path}
+
+
+class DistroCatalogTests(unittest.TestCase):
+    def setUp(self):
+        self.store = tempfile.mkdtemp()
+        self.reachable = set(['http://mirror/f19.iso'])
+        self.checks = []
+        self.revalidations = []
+        self._write([distro('Fedora 19', 'http://mirror/f19.iso'),
+                     distro('Fedora 20', 'http://mirror/f20.iso')])
+
+        def check_url_path(path):
+            self.checks.append(path)
+            return path in self.reachable
+
+        self.orig_check_url_path = distrocatalog.check_url_path
+        self.orig_revalidate_async = DistroCatalog._revalidate_async
+        self.orig_retry_delay = distrocatalog.DISTRO_RETRY_DELAY
+        distrocatalog.check_url_path = check_url_path
+        # Revalidations are run by the tests
+        DistroCatalog._revalidate_async = \
+            lambda catalog: self.revalidations.append(True)
+        Singleton._instances.pop(DistroCatalog, None)
+        self.catalog = DistroCatalog(self.store)
+        self.catalog._checker.cancel()
+
+    def tearDown(self):
+        distrocatalog.check_url_path = self.orig_check_url_path
+        distrocatalog.DISTRO_RETRY_DELAY = self.orig_retry_delay
+        DistroCatalog._revalidate_async = self.orig_revalidate_async
+        Singleton._instances.pop(DistroCatalog, None)
+        shutil.rmtree(self.store)
+
+    def _write(self, distros):
+        path = os.path.join(self.store, 'fedora.json')
+        mtime = os.stat(path).st_mtime if os.path.exists(path) else 0
+        with open(path, 'w') as fd:
+            json.dump(distros, fd)
+        # Make sure the change is seen on coarse mtime file systems
+        os.utime(path, (mtime + 10, mtime + 10))
+
+    def test_last_known_availability(self):
+        # Listed before the first check, without waiting for it
+        self.assertEquals(['Fedora 19', 'Fedora 20'], self.catalog.get_list())
+        self.assertEquals(None, self.catalog.lookup('Fedora 20')['available'])
+        self.assertEquals([], self.checks)
+
+        self.catalog.revalidate()
+        self.assertEquals(['Fedora 19'], self.catalog.get_list())
+        info = self.catalog.lookup('Fedora 20')
+        self.assertFalse(info['available'])
+        self.assertNotEquals(None, info['last_check'])
+        self.assertEquals(2, len(self.checks))
+
+        # Not checked again before their next check is due
+        self.catalog.revalidate()
+        self.assertEquals(2, len(self.checks))
+
+    def test_backoff(self):
+        distrocatalog.DISTRO_RETRY_DELAY = 0
+        self.catalog.revalidate()
+        self.catalog.revalidate()
+        # Only the unreachable image is checked again
+        self.assertEquals(['http://mirror/f19.iso', 'http://mirror/f20.iso',
+                           'http://mirror/f20.iso'], sorted(self.checks))
+        self.assertEquals(2, self.catalog._status['Fedora 20']['failures'])
+
+        self.reachable.add('http://mirror/f20.iso')
+        self.catalog.revalidate()
+        self.assertEquals(['Fedora 19', 'Fedora 20'], self.catalog.get_list())
+        self.assertEquals(0, self.catalog._status['Fedora 20']['failures'])
+
+    def test_store_change(self):
+        self.catalog.revalidate()
+        self._write([distro('Fedora 19', 'http://mirror/f19.iso'),
+                     distro('Fedora 21', 'http://mirror/f21.iso')])
+        self.assertEquals(['Fedora 19', 'Fedora 21'], self.catalog.get_list())
+        self.assertEquals(2, len(self.revalidations))
+        self.assertTrue(self.catalog.lookup('Fedora 19')['available'])
+
+        # Only the new image is checked
+        self.catalog.revalidate()
+        self.assertEquals(['http://mirror/f19.iso', 'http://mirror/f20.iso',
+                           'http://mirror/f21.iso'], sorted(self.checks))
+        self.assertEquals(['Fedora 19'], self.catalog.get_list())
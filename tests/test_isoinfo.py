@@ -0,0 +1,591 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import BaseHTTPServer
+import os
+import re
+import shutil
+import SocketServer
+import tempfile
+import threading
+import time
+import unittest
+
+
+import iso_gen
+from kimchi import isoinfo
+from kimchi import scan
+from kimchi.basemodel import Singleton
+from kimchi.httppool import URLChecker
+from kimchi.objectstore import ObjectStore
+from kimchi.scan import IsoLibrary, Scanner
+
+
+class IsoInfoCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_store = tempfile.mktemp()
+        self.iso_path = tempfile.mktemp(suffix='.iso')
+        iso_gen.construct_fake_iso(self.iso_path, True, '12.04', 'ubuntu')
+        self.probes = []
+        self.orig_iso_image = isoinfo.IsoImage
+
+        probes = self.probes
+
+        class CountingIsoImage(self.orig_iso_image):
+            def __init__(self, path):
+                probes.append(path)
+                super(CountingIsoImage, self).__init__(path)
+
+        isoinfo.IsoImage = CountingIsoImage
+
+    def tearDown(self):
+        isoinfo.IsoImage = self.orig_iso_image
+        for path in (self.tmp_store, self.iso_path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def test_cache_hit(self):
+        cache = isoinfo.IsoInfoCache(ObjectStore(self.tmp_store))
+        info = cache.probe(self.iso_path)
+        self.assertEquals('ubuntu', info['os_distro'])
+        self.assertEquals('12.04', info['os_version'])
+        self.assertTrue(info['bootable'])
+        self.assertEquals(info, cache.probe(self.iso_path))
+        self.assertEquals(1, len(self.probes))
+
+    def test_cache_persists(self):
+        isoinfo.IsoInfoCache(ObjectStore(self.tmp_store)).probe(self.iso_path)
+        cache = isoinfo.IsoInfoCache(ObjectStore(self.tmp_store))
+        self.assertEquals('ubuntu', cache.probe(self.iso_path)['os_distro'])
+        self.assertEquals(1, len(self.probes))
+
+    def test_cache_invalidated_on_change(self):
+        cache = isoinfo.IsoInfoCache(ObjectStore(self.tmp_store))
+        cache.probe(self.iso_path)
+        iso_gen.construct_fake_iso(self.iso_path, True, '17', 'fedora')
+        st = os.stat(self.iso_path)
+        os.utime(self.iso_path, (st.st_atime, st.st_mtime + 10))
+        info = cache.probe(self.iso_path)
+        self.assertEquals('fedora', info['os_distro'])
+        self.assertEquals(2, len(self.probes))
+
+    def test_cache_expiry(self):
+        objstore = ObjectStore(self.tmp_store)
+        isoinfo.IsoInfoCache(objstore).probe(self.iso_path)
+        with objstore as session:
+            identity, = session.get_list('isoinfo')
+            entry = session.get('isoinfo', identity)
+            entry['last_used'] -= isoinfo.ISO_INFO_EXPIRY
+            session.store('isoinfo', identity, entry)
+
+        # Entries are expired when a new image is probed
+        other_iso = tempfile.mktemp(suffix='.iso')
+        iso_gen.construct_fake_iso(other_iso, True, '17', 'fedora')
+        try:
+            isoinfo.IsoInfoCache(objstore).probe(other_iso)
+            with objstore as session:
+                self.assertNotIn(identity, session.get_list('isoinfo'))
+                self.assertEquals(1, len(session.get_list('isoinfo')))
+        finally:
+            os.unlink(other_iso)
+
+    def test_cache_forget(self):
+        objstore = ObjectStore(self.tmp_store)
+        cache = isoinfo.IsoInfoCache(objstore)
+        cache.probe(self.iso_path)
+        cache.forget(self.iso_path)
+        with objstore as session:
+            self.assertEquals([], session.get_list('isoinfo'))
+
+
+class IsoRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _send_iso(self, body):
+        with open(self.server.iso_path) as fd:
+            data = fd.read()
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if self.server.ranges and match:
+            start, end = int(match.group(1)), int(match.group(2))
+            size = len(data) if self.server.known_size else '*'
+            data = data[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             'bytes %d-%d/%s' % (start, end, size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def do_HEAD(self):
+        self.server.requests.append(('HEAD', None))
+        time.sleep(self.server.delay)
+        if not self.server.head:
+            self.send_error(405)
+        elif self.path.endswith('/missing.iso'):
+            self.send_error(404)
+        else:
+            self._send_iso(False)
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.headers.get('Range')))
+        self._send_iso(True)
+
+
+class IsoServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients reset the connections of the images they stop reading
+        pass
+
+
+class IsoServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.iso_path = tempfile.mktemp(suffix='.iso')
+        iso_gen.construct_fake_iso(self.iso_path, True, '12.04', 'ubuntu')
+        self.server = IsoServer(('127.0.0.1', 0), IsoRequestHandler)
+        self.server.iso_path = self.iso_path
+        self.server.connections = 0
+        self.server.requests = []
+        self.server.ranges = True
+        self.server.known_size = True
+        self.server.head = True
+        self.server.delay = 0
+        self.url = 'http://127.0.0.1:%d/ubuntu.iso' % self.server.server_port
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.unlink(self.iso_path)
+
+
+class RemoteIsoTests(IsoServerTestCase):
+    def test_keep_alive_ranges(self):
+        self.server.ranges = True
+        iso = isoinfo.IsoImage(self.url)
+        self.assertEquals(('ubuntu', '12.04'), iso.probe())
+        self.assertTrue(iso.bootable)
+        # The volume descriptors come in one request, then the boot catalog
+        # of the fake image, at sector 0, is read on the same connection
+        self.assertEquals(1, self.server.connections)
+        self.assertEquals([('HEAD', None),
+                           ('GET', 'bytes=32768-172031'),
+                           ('GET', 'bytes=0-63')], self.server.requests)
+
+    def test_shared_url_check(self):
+        for i in xrange(2):
+            isoinfo.IsoImage(self.url)
+        # The reachability check of URLChecker is cached
+        self.assertEquals(1, self.server.requests.count(('HEAD', None)))
+
+    def test_no_ranges(self):
+        self.server.ranges = False
+        iso = isoinfo.IsoImage(self.url)
+        self.assertEquals(('ubuntu', '12.04'), iso.probe())
+        self.assertTrue(iso.bootable)
+
+    def test_remote_size(self):
+        size = os.path.getsize(self.iso_path)
+        local = isoinfo.IsoImage(self.iso_path).fingerprint
+        self.assertTrue(local.startswith('%d:' % size))
+        self.assertEquals(local, isoinfo.IsoImage(self.url).fingerprint)
+
+        # Without HEAD, the size comes from Content-Range, or from
+        # Content-Length without ranges
+        self.server.head = False
+        self.assertEquals(local, isoinfo.IsoImage(self.url).fingerprint)
+        self.server.ranges = False
+        self.assertEquals(local, isoinfo.IsoImage(self.url).fingerprint)
+
+        # No fingerprint without the size, it could match another image
+        self.server.ranges = True
+        self.server.known_size = False
+        iso = isoinfo.IsoImage(self.url)
+        self.assertEquals(None, iso.size)
+        self.assertEquals(None, iso.fingerprint)
+
+
+class URLCheckerTests(IsoServerTestCase):
+    def setUp(self):
+        super(URLCheckerTests, self).setUp()
+        # Not the instance shared with the other tests
+        Singleton._instances.pop(URLChecker, None)
+        self.checker = URLChecker(timeout=1)
+
+    def tearDown(self):
+        Singleton._instances.pop(URLChecker, None)
+        super(URLCheckerTests, self).tearDown()
+
+    def test_cached_results(self):
+        missing = self.url.replace('ubuntu.iso', 'missing.iso')
+        for i in xrange(3):
+            self.assertTrue(self.checker.check(self.url))
+            self.assertFalse(self.checker.check(missing))
+        self.assertEquals([('HEAD', None)] * 2, self.server.requests)
+
+        self.checker.negative_ttl = 0
+        self.assertFalse(self.checker.check(missing))
+        self.assertTrue(self.checker.check(self.url))
+        self.assertEquals([('HEAD', None)] * 3, self.server.requests)
+
+    def test_head_not_allowed(self):
+        self.server.head = False
+        self.assertTrue(self.checker.check(self.url))
+        self.assertEquals([('HEAD', None), ('GET', 'bytes=0-0')],
+                          self.server.requests)
+
+    def test_single_flight(self):
+        self.server.delay = 0.5
+        results = []
+        threads = [threading.Thread(target=lambda:
+                                    results.append(self.checker.check(
+                                        self.url)))
+                   for i in xrange(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals([True] * 5, results)
+        self.assertEquals([('HEAD', None)], self.server.requests)
+
+    def test_timeout(self):
+        self.server.delay = 3
+        start = time.time()
+        self.assertFalse(self.checker.check(self.url))
+        self.assertTrue(time.time() - start < 2)
+
+    def test_not_url(self):
+        self.assertFalse(self.checker.check(self.iso_path))
+        self.assertEquals([], self.server.requests)
+
+
+# Volume IDs of real installation media
+VOLUME_IDS = [
+    ('OpenBSD/amd64    5.4 Install CD', ('openbsd', '5.4')),
+    ('OpenBSD/i386    5.0 Install CD', ('openbsd', '5.0')),
+    ('CentOS_6.5_Final', ('centos', '6.5')),
+    ('WXPFPP_EN', ('windows', 'xp')),
+    ('GRTMPVOL_EN', ('windows', 'xp')),
+    ('W2K_SP4', ('windows', '2000')),
+    ('ARMEVOL_EN', ('windows', '2003')),
+    ('CRMEFPP_EN', ('windows', '2003r2')),
+    ('KRMSXVOL_EN_DVD', ('windows', '2008')),
+    ('GRMSXVOL_EN_DVD', ('windows', '2008r2')),
+    ('FRMEVOL_EN_DVD', ('windows', 'vista')),
+    ('GRMCULFRER_EN_DVD', ('windows', '7')),
+    ('GSP1RMCPRXFRER_EN_DVD', ('windows', '7')),
+    ('HRM_CENA_X64FREV_EN-US_DV5', ('windows', '8')),
+    ('SLES10', ('sles', '10')),
+    ('SUSE_SLES-11-0-0.001', ('sles', '11')),
+    ('SLES-11-SP3-DVD-x86_6406891', ('sles', '11sp3')),
+    ('openSUSE-13.1-DVD-x86_640039', ('opensuse', '13.1')),
+    ('openSUSE 12.3', ('opensuse', '12.3')),
+    ('SU1110.001', ('opensuse', '11.1')),
+    ('openSUSE-DVD-x86_640024', ('opensuse', '11.4')),
+    ('openSUSE-DVD-i586-Build0167', ('opensuse', '12.2')),
+    ('RHEL/4-U8 i386 AS DVD', ('rhel', '4.8')),
+    ('RHEL-7.0 Server.x86_64', ('rhel', '7.0')),
+    ('RHEL_6.5 x86_64 Disc 1', ('rhel', '6.5')),
+    ('Debian 7.4.0 amd64 1', ('debian', '7.4')),
+    ('Ubuntu 14.04 LTS amd64', ('ubuntu', '14.04')),
+    ('Ubuntu-Server 12.04.4 LTS amd64', ('ubuntu', '12.04')),
+    ('ubuntu 13.10 i386', ('ubuntu', '13.10')),
+    ('Fedora 20 x86_64 DVD', ('fedora', '20')),
+    ('Fedora-Live-Desktop-x86_64-20-1', ('fedora', '20')),
+    ('Gentoo Linux amd64 20140227', ('gentoo', '20140227')),
+    ('CDROM', None),
+    ('Kimchi', None),
+    ('', None)]
+
+# Regular expressions run at most to match one of VOLUME_IDS
+MAX_SEARCHES = 3
+
+
+def table_match(volume_id):
+    # The original walk through the table, in order
+    for distro, version, regex in isoinfo.iso_dir:
+        match = re.search(regex, volume_id)
+        if match is not None:
+            if hasattr(version, '__call__'):
+                version = version(match)
+            return (distro, version)
+
+
+class DistroMatcherTests(unittest.TestCase):
+    def test_volume_ids(self):
+        for volume_id, expected in VOLUME_IDS:
+            self.assertEquals(expected,
+                              isoinfo.distro_matcher.match(volume_id))
+
+    def test_table_order(self):
+        # Several entries match these IDs, the first one in the table wins
+        # even if another one matches earlier in the string
+        for volume_id in ['Fedora 20 RHEL-7.0', 'RHEL/4-U8 RHEL-4.9',
+                          'Fedora-Live-20-1 Fedora 19', 'SLES10 SLES-11-SP1',
+                          'Debian 7.0 CentOS_6.5_Final']:
+            self.assertEquals(table_match(volume_id),
+                              isoinfo.distro_matcher.match(volume_id))
+        for volume_id, expected in VOLUME_IDS:
+            self.assertEquals(table_match(volume_id),
+                              isoinfo.distro_matcher.match(volume_id))
+
+    def test_precompiled(self):
+        matcher = isoinfo.DistroMatcher(isoinfo.iso_dir)
+        searches = []
+
+        class CountingRegex(object):
+            def __init__(self, regex):
+                self.regex = regex
+
+            def search(self, volume_id):
+                searches.append(self.regex.pattern)
+                return self.regex.search(volume_id)
+
+        matcher._entries = [(distro, version, CountingRegex(regex), literals)
+                            for distro, version, regex, literals
+                            in matcher._entries]
+        compiles = []
+        orig_compile = re._compile
+
+        def counting_compile(*args):
+            compiles.append(args)
+            return orig_compile(*args)
+
+        re._compile = counting_compile
+        try:
+            for volume_id, expected in VOLUME_IDS:
+                del searches[:]
+                self.assertEquals(expected, matcher.match(volume_id))
+                # The literal strings rule out almost all the entries
+                self.assertTrue(len(searches) <= MAX_SEARCHES,
+                                '%d expressions run for %s' %
+                                (len(searches), volume_id))
+        finally:
+            re._compile = orig_compile
+        # Matching does not depend on the re module cache
+        self.assertEquals([], compiles)
+
+
+class DeepScanTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_store = tempfile.mktemp()
+        self.top = tempfile.mkdtemp()
+        for path, distro, version in [('a/ubuntu.iso', 'ubuntu', '12.04'),
+                                      ('a/b/fedora.ISO', 'fedora', '17'),
+                                      ('c/ignored/sles.iso', 'sles', '10'),
+                                      ('c/ignored/d/centos.iso', 'centos',
+                                       '6.1'),
+                                      ('c/opensuse.iso', 'opensuse',
+                                       '12.2')]:
+            path = os.path.join(self.top, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            iso_gen.construct_fake_iso(path, True, version, distro)
+        with open(os.path.join(self.top, 'a', 'readme.txt'), 'w') as fd:
+            fd.write('not an image')
+        with open(os.path.join(self.top, 'a', 'broken.iso'), 'w') as fd:
+            fd.write('not an image either')
+
+    def tearDown(self):
+        shutil.rmtree(self.top)
+        if os.path.exists(self.tmp_store):
+            os.unlink(self.tmp_store)
+
+    def test_ignore_list(self):
+        ignore = isoinfo.compile_ignore_list(['/tmp/kimchi-scan-*',
+                                              '/var/lib/libvirt/images/',
+                                              '/srv/iso[0-9]'])
+        for path in ['/tmp/kimchi-scan-pool1abcdef',
+                     '/var/lib/libvirt/images', '/srv/iso1']:
+            self.assertTrue(ignore.match(path))
+        for path in ['/tmp/kimchi-scan-pool/sub', '/var/lib/libvirt',
+                     '/var/lib/libvirt/images2', '/srv/isos']:
+            self.assertFalse(ignore.match(path))
+        self.assertEquals(None, isoinfo.compile_ignore_list([]))
+
+    def test_probe_dir(self):
+        found = []
+        params = {'path': self.top, 'updater': found.append,
+                  'ignore_list': [os.path.join(self.top, 'c', 'ign*')]}
+        isoinfo.probe_iso(None, params)
+
+        self.assertEquals([(os.path.join(self.top, 'a/b/fedora.ISO'),
+                            'fedora', '17'),
+                           (os.path.join(self.top, 'a/ubuntu.iso'),
+                            'ubuntu', '12.04'),
+                           (os.path.join(self.top, 'c/opensuse.iso'),
+                            'opensuse', '12.2')],
+                          sorted((iso['path'], iso['distro'], iso['version'])
+                                 for iso in found))
+
+    def test_fingerprint(self):
+        ubuntu = os.path.join(self.top, 'a/ubuntu.iso')
+        copy = os.path.join(self.top, 'a/b/copy-of-ubuntu.iso')
+        shutil.copy(ubuntu, copy)
+        fingerprint = isoinfo.IsoImage(ubuntu).fingerprint
+        self.assertEquals(fingerprint, isoinfo.IsoImage(copy).fingerprint)
+
+        iso_gen.construct_fake_iso(copy, True, '12.10', 'ubuntu')
+        self.assertNotEquals(fingerprint,
+                             isoinfo.IsoImage(copy).fingerprint)
+
+    def test_scan_duplicates(self):
+        shutil.copy(os.path.join(self.top, 'a/ubuntu.iso'),
+                    os.path.join(self.top, 'a/b/other-name.iso'))
+        shutil.copy(os.path.join(self.top, 'a/b/fedora.ISO'),
+                    os.path.join(self.top, 'c/fedora.iso'))
+        pool_path = tempfile.mkdtemp()
+        messages = []
+        try:
+            params = {'scan_path': self.top, 'pool_path': pool_path,
+                      'ignore_list': [os.path.join(self.top, 'c/ignored')]}
+            scanner = Scanner(None, ObjectStore(self.tmp_store))
+            scanner.start_scan(lambda msg, ok=False: messages.append(msg),
+                               params)
+            distros = sorted(isoinfo.IsoImage(os.path.join(pool_path,
+                                                           name)).probe()[0]
+                             for name in os.listdir(pool_path))
+        finally:
+            shutil.rmtree(pool_path)
+
+        # One link per distinct image, whatever the names of the copies
+        self.assertEquals(['fedora', 'opensuse', 'ubuntu'], distros)
+        self.assertEquals(['1 ISO files found', '2 ISO files found',
+                           '3 ISO files found', ''], messages)
+
+    def _library_scan(self, library, ignore_list):
+        found = []
+        library.scan(ignore_list, found.append)
+        return sorted((iso['path'][len(self.top) + 1:], iso['distro'],
+                       iso['version']) for iso in found)
+
+    def test_library_rescan(self):
+        probes = []
+        orig_probe = IsoLibrary._probe
+
+        def counting_probe(library, path):
+            probes.append(path)
+            return orig_probe(library, path)
+
+        ignore_list = [os.path.join(self.top, 'c/ignored')]
+        IsoLibrary._probe = counting_probe
+        try:
+            library = IsoLibrary(self.top, ObjectStore(self.tmp_store))
+            isos = self._library_scan(library, ignore_list)
+            self.assertEquals([('a/b/fedora.ISO', 'fedora', '17'),
+                               ('a/ubuntu.iso', 'ubuntu', '12.04'),
+                               ('c/opensuse.iso', 'opensuse', '12.2')], isos)
+            # The broken image is probed too
+            self.assertEquals(4, len(probes))
+
+            # Nothing to probe after a restart
+            library = IsoLibrary(self.top, ObjectStore(self.tmp_store))
+            self.assertEquals(isos, self._library_scan(library, ignore_list))
+            self.assertEquals(4, len(probes))
+
+            # Only the changed image is probed again
+            ubuntu = os.path.join(self.top, 'a/ubuntu.iso')
+            iso_gen.construct_fake_iso(ubuntu, True, '12.10', 'ubuntu')
+            st = os.stat(ubuntu)
+            os.utime(ubuntu, (st.st_atime, st.st_mtime + 10))
+            os.unlink(os.path.join(self.top, 'c/opensuse.iso'))
+            self.assertEquals([('a/b/fedora.ISO', 'fedora', '17'),
+                               ('a/ubuntu.iso', 'ubuntu', '12.10')],
+                              self._library_scan(library, ignore_list))
+            self.assertEquals(5, len(probes))
+
+            # Directories no longer ignored are probed
+            self.assertEquals(4, len(self._library_scan(library, [])))
+            self.assertEquals(7, len(probes))
+        finally:
+            IsoLibrary._probe = orig_probe
+
+    def test_library_updater_serialized(self):
+        library = IsoLibrary(self.top, ObjectStore(self.tmp_store))
+        self._library_scan(library, [])
+        # Probed images are reported from the probe workers, unchanged ones
+        # from the scanning thread: only the last image found is unchanged
+        for path in list(isoinfo.walk_isos(self.top))[:-1]:
+            st = os.stat(path)
+            os.utime(path, (st.st_atime, st.st_mtime + 10))
+
+        running = []
+        overlaps = []
+
+        def updater(iso_info):
+            running.append(iso_info['path'])
+            if len(running) > 1:
+                overlaps.append(list(running))
+            time.sleep(0.1)
+            running.remove(iso_info['path'])
+
+        library.scan([], updater)
+        self.assertEquals([], overlaps)
+
+    @unittest.skipUnless(scan.pyinotify, 'pyinotify is not available')
+    def test_library_watch(self):
+        library = IsoLibrary(self.top, ObjectStore(self.tmp_store))
+        self.assertTrue(library.watch())
+        self.assertEquals(5, len(self._library_scan(library, [])))
+
+        new_iso = tempfile.mktemp(suffix='.iso')
+        iso_gen.construct_fake_iso(new_iso, True, '7.0', 'debian')
+        shutil.move(new_iso, os.path.join(self.top, 'a/debian.iso'))
+        shutil.rmtree(os.path.join(self.top, 'c'))
+        expected = [('a/b/fedora.ISO', 'fedora', '17'),
+                    ('a/debian.iso', 'debian', '7.0'),
+                    ('a/ubuntu.iso', 'ubuntu', '12.04')]
+        for i in xrange(50):
+            if self._library_scan(library, []) == expected:
+                break
+            time.sleep(0.1)
+        self.assertEquals(expected, self._library_scan(library, []))
+
+    def test_probe_timeout(self):
+        hang = threading.Event()
+        results = []
+
+        def probe(path):
+            if path == 'hang':
+                hang.wait()
+            return path
+
+        probes = isoinfo.IsoProbePool(probe, results.append, workers=1,
+                                      timeout=1)
+        for path in ['hang', 'a', 'b']:
+            probes.submit(path)
+        probes.wait()
+
+        # The stuck probe is given up and the others still run
+        self.assertFalse(hang.is_set())
+        self.assertEquals(['a', 'b'], sorted(results))
+        hang.set()
@@ -0,0 +1,243 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import BaseHTTPServer
+import os
+import re
+import shutil
+import SocketServer
+import tempfile
+import threading
+import time
+import unittest
+import urllib2
+
+
+from kimchi import isoproxy
+from kimchi.basemodel import Singleton
+from kimchi.isoproxy import IsoProxy
+
+
+BLOCK_SIZE = 4096
+
+
+class OriginHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body):
+        data = self.server.data
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if match and if_range not in (None, self.server.etag):
+            # Changed image: If-Range makes the whole of it to be sent
+            match = None
+        if match:
+            start, end = int(match.group(1)), int(match.group(2))
+            self.server.ranges.append((start, end))
+            time.sleep(self.server.delay)
+            data = data[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                             (start, end, len(self.server.data)))
+        else:
+            self.send_response(200)
+        self.send_header('ETag', self.server.etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def do_HEAD(self):
+        self._send(False)
+
+    def do_GET(self):
+        self._send(True)
+
+
+class OriginServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class IsoProxyTests(unittest.TestCase):
+    def setUp(self):
+        self.orig_block_size = isoproxy.ISO_CACHE_BLOCK_SIZE
+        isoproxy.ISO_CACHE_BLOCK_SIZE = BLOCK_SIZE
+        self.cache_dir = tempfile.mkdtemp()
+
+        self.origin = OriginServer(('127.0.0.1', 0), OriginHandler)
+        self.origin.data = os.urandom(10 * BLOCK_SIZE + 100)
+        self.origin.ranges = []
+        self.origin.delay = 0
+        self.origin.etag = '"1"'
+        thread = threading.Thread(target=self.origin.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.url = u'http://127.0.0.1:%d/isos/fedora.iso' % \
+            self.origin.server_port
+
+        self.proxy = self._start_proxy()
+
+    def tearDown(self):
+        self.proxy.stop()
+        Singleton._instances.pop(IsoProxy, None)
+        self.origin.shutdown()
+        self.origin.server_close()
+        shutil.rmtree(self.cache_dir)
+        isoproxy.ISO_CACHE_BLOCK_SIZE = self.orig_block_size
+
+    def _start_proxy(self, cache_size=0):
+        Singleton._instances.pop(IsoProxy, None)
+        proxy = IsoProxy(self.cache_dir, 0, cache_size)
+        proxy.start()
+        return proxy
+
+    def _read(self, url, start=None, end=None):
+        request = urllib2.Request(url)
+        if start is not None:
+            request.add_header('Range', 'bytes=%d-%d' % (start, end))
+        response = urllib2.urlopen(request)
+        try:
+            return response.getcode(), response.read()
+        finally:
+            response.close()
+
+    def test_cached_reads(self):
+        url = self.proxy.register(self.url)
+        self.assertTrue(url.startswith('http://127.0.0.1:%d/' %
+                                       self.proxy.port))
+        self.assertTrue(url.endswith('/fedora.iso'))
+
+        self.assertEquals((206, self.origin.data[5000:9000]),
+                          self._read(url, 5000, 8999))
+        # Only the blocks holding the range are downloaded
+        self.assertEquals([(4096, 12287)], self.origin.ranges)
+
+        self.assertEquals((200, self.origin.data), self._read(url))
+        self.assertEquals((206, self.origin.data[-50:]),
+                          self._read(url, len(self.origin.data) - 50,
+                                     len(self.origin.data) - 1))
+        ranges = list(self.origin.ranges)
+        self.assertEquals(3, len(ranges))
+
+        # Everything comes from the cache now, even after a restart
+        self.proxy.stop()
+        self.proxy = self._start_proxy()
+        url = self.proxy.register(self.url)
+        self.assertEquals((200, self.origin.data), self._read(url))
+        self.assertEquals(ranges, self.origin.ranges)
+
+    def test_concurrent_readers(self):
+        url = self.proxy.register(self.url)
+        self.origin.delay = 0.2
+        results = []
+        readers = [threading.Thread(target=lambda:
+                                    results.append(self._read(url)))
+                   for i in xrange(4)]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+
+        self.assertEquals([(200, self.origin.data)] * 4, results)
+        # Each block was downloaded once
+        blocks = [block for start, end in self.origin.ranges
+                  for block in xrange(start / BLOCK_SIZE,
+                                      end / BLOCK_SIZE + 1)]
+        self.assertEquals(range(11), sorted(blocks))
+
+    def test_not_proxied(self):
+        self.assertEquals('ftp://mirror/fedora.iso',
+                          self.proxy.register('ftp://mirror/fedora.iso'))
+        self.proxy.stop()
+        self.assertEquals(self.url, self.proxy.register(self.url))
+
+    def test_changed_image(self):
+        url = self.proxy.register(self.url)
+        self.assertEquals((206, self.origin.data[:100]),
+                          self._read(url, 0, 99))
+
+        # The image is replaced on its server: its cache is dropped instead
+        # of mixing blocks of both images
+        self.origin.data = os.urandom(len(self.origin.data))
+        self.origin.etag = '"2"'
+        self.assertEquals((206, ''), self._read(url, 5000, 8999))
+        ident = url.split('/')[3]
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir,
+                                                     ident + '.iso')))
+
+        # Registered again by the next read, for the domains using the URL
+        self.assertEquals((200, self.origin.data), self._read(url))
+        self.assertEquals(url, self.proxy.register(self.url))
+
+    def test_cache_eviction(self):
+        self.proxy.stop()
+        self.proxy = self._start_proxy(len(self.origin.data) * 3 / 2)
+        first = self.proxy.register(self.url)
+        self.assertEquals((200, self.origin.data), self._read(first))
+
+        # No room for both images
+        second = self.proxy.register(self.url + '?mirror=2')
+        self.assertEquals((200, self.origin.data), self._read(second))
+        first_iso = os.path.join(self.cache_dir, first.split('/')[3] + '.iso')
+        self.assertFalse(os.path.exists(first_iso))
+
+        # The domains using the first image still read it
+        self.assertEquals((200, self.origin.data), self._read(first))
+        self.assertTrue(os.path.exists(first_iso))
+
+    def test_no_eviction_while_read(self):
+        self.proxy.stop()
+        self.proxy = self._start_proxy(len(self.origin.data) * 3 / 2)
+        first = self.proxy.register(self.url)
+        self.assertEquals((200, self.origin.data), self._read(first))
+
+        ident = first.split('/')[3]
+        self.assertFalse(self.proxy.open(ident) is None)
+        try:
+            second = self.proxy.register(self.url + '?mirror=2')
+            self.assertEquals((200, self.origin.data), self._read(second))
+            self.assertTrue(os.path.exists(os.path.join(self.cache_dir,
+                                                        ident + '.iso')))
+        finally:
+            self.proxy.close(ident)
+
+    def test_redirect(self):
+        url = self.proxy.register(self.url)
+        self.assertEquals((200, self.origin.data), self._read(url))
+
+        # Once disabled, the proxy sends the guests to the origin server
+        self.proxy.stop()
+        Singleton._instances.pop(IsoProxy, None)
+        self.proxy = IsoProxy(self.cache_dir, 0, redirect=True)
+        self.proxy.start()
+        self.assertEquals(self.url, self.proxy.register(self.url))
+        url = url.replace(url.split('/')[2],
+                          '127.0.0.1:%d' % self.proxy.port)
+        del self.origin.ranges[:]
+        self.assertEquals((206, self.origin.data[100:199]),
+                          self._read(url, 100, 198))
+        self.assertEquals([(100, 198)], self.origin.ranges)
+
+        self.assertRaises(urllib2.HTTPError, self._read,
+                          'http://127.0.0.1:%d/%s/fedora.iso' %
+                          (self.proxy.port, '0' * 40))
@@ -36,7 +36,12 @@ from kimchi import netinfo
 from kimchi.exception import InvalidOperation, InvalidParameter
 from kimchi.exception import NotFoundError, OperationFailed
 from kimchi.iscsi import TargetClient
-from kimchi.model import model
+from kimchi.model import model, templates
+from kimchi.model.resourceindex import get_resource_index
+from kimchi.model.storageserverindex import get_storage_server_index
+from kimchi.model.templates import get_integrity_context, IntegrityContext
+from kimchi.model.templates import LibvirtVMTemplate
+from kimchi.model.warmpool import get_warm_pool
 from kimchi.rollbackcontext import RollbackContext
 from kimchi.utils import add_task
 
@@ -51,7 +56,9 @@ class ModelTests(unittest.TestCase):
         iso_gen.construct_fake_iso(self.kimchi_iso, True, '12.04', 'ubuntu')
 
     def tearDown(self):
-        os.unlink(self.tmp_store)
+        # Not created by the tests which use no model
+        if os.path.exists(self.tmp_store):
+            os.unlink(self.tmp_store)
         shutil.rmtree(self.iso_path)
 
     def test_vm_info(self):
@@ -166,6 +173,11 @@ class ModelTests(unittest.TestCase):
             self.assertEquals("test-network", iface['network'])
             self.assertEquals("virtio", iface["model"])
 
+            # The resource index sees the attached interface
+            index = get_resource_index(inst.conn, inst.objstore)
+            self.assertEquals(['kimchi-ifaces'],
+                              index.vms_attached_to_network(net_name))
+
     @unittest.skipUnless(utils.running_as_root(), 'Must be run as root')
     def test_vm_cdrom(self):
         inst = model.Model(objstore_loc=self.tmp_store)
@@ -196,6 +208,8 @@ class ModelTests(unittest.TestCase):
             cdrom_dev = inst.vmstorages_create(vm_name, cdrom_args)
             storage_list = inst.vmstorages_get_list(vm_name)
             self.assertEquals(prev_count + 1, len(storage_list))
+            index = get_resource_index(inst.conn, inst.objstore)
+            self.assertEquals([vm_name], index.vms_using_volume(iso_path))
 
             # Get cdrom info
             cd_info = inst.vmstorage_lookup(vm_name, cdrom_dev)
@@ -216,6 +230,8 @@ class ModelTests(unittest.TestCase):
             inst.vmstorage_update(vm_name, cdrom_dev, {'path': iso_path2})
             cdrom_info = inst.vmstorage_lookup(vm_name, cdrom_dev)
             self.assertEquals(iso_path2, cdrom_info['path'])
+            self.assertEquals([], index.vms_using_volume(iso_path))
+            self.assertEquals([vm_name], index.vms_using_volume(iso_path2))
 
             # update path of existing cd with existent iso of running vm
             inst.vm_start(vm_name)
@@ -232,6 +248,7 @@ class ModelTests(unittest.TestCase):
             inst.vmstorage_delete(vm_name, cdrom_dev)
             storage_list = inst.vmstorages_get_list(vm_name)
             self.assertEquals(prev_count, len(storage_list))
+            self.assertEquals([], index.vms_using_volume(iso_path))
 
     @unittest.skipUnless(utils.running_as_root(), 'Must be run as root')
     def test_vm_storage_provisioning(self):
@@ -253,6 +270,32 @@ class ModelTests(unittest.TestCase):
             self.assertTrue(os.access(disk_path, os.F_OK))
         self.assertFalse(os.access(disk_path, os.F_OK))
 
+    @unittest.skipUnless(utils.running_as_root(), 'Must be run as root')
+    def test_vm_warm_pool(self):
+        inst = model.Model(objstore_loc=self.tmp_store)
+        warm_pool = get_warm_pool(inst.conn, inst.objstore)
+
+        with RollbackContext() as rollback:
+            # Drops the disks left in reserve once the template is deleted
+            rollback.prependDefer(warm_pool.refill)
+            params = {'name': 'test', 'disks': [{'size': 1}],
+                      'cdrom': self.kimchi_iso, 'warm_pool': 1}
+            inst.templates_create(params)
+            rollback.prependDefer(inst.template_delete, 'test')
+
+            warm_pool.refill()
+            with inst.objstore as session:
+                disk_set = session.get('warmpool', 'test')[0]
+            self.assertTrue(os.access(disk_set['volumes'][0], os.F_OK))
+
+            params = {'name': 'test-vm-1', 'template': '/templates/test'}
+            inst.vms_create(params)
+            rollback.prependDefer(inst.vm_delete, 'test-vm-1')
+
+            # The VM got the provisioned disks
+            vm_info = inst.vm_lookup(params['name'])
+            self.assertEquals(disk_set['uuid'], vm_info['uuid'])
+
     @unittest.skipUnless(utils.running_as_root(), 'Must be run as root')
     def test_storagepool(self):
         inst = model.Model('qemu:///system', self.tmp_store)
@@ -317,6 +360,40 @@ class ModelTests(unittest.TestCase):
         self.assertEquals('active', poolinfo['state'])
         self.assertEquals((num - 1), len(pools))
 
+    @unittest.skipUnless(utils.running_as_root(), 'Must be run as root')
+    def test_storageservers(self):
+        inst = model.Model('qemu:///system', self.tmp_store)
+        xml = """
+        <pool type='netfs'>
+          <name>kimchi-unittest-netfs</name>
+          <source>
+            <host name='192.0.2.1'/>
+            <dir path='/export'/>
+          </source>
+          <target>
+            <path>/tmp/kimchi-unittest-netfs</path>
+          </target>
+        </pool>
+        """
+
+        with RollbackContext() as rollback:
+            # Only defined, so the server never gets contacted
+            inst.conn.get().storagePoolDefineXML(xml, 0)
+            rollback.prependDefer(inst.storagepool_delete,
+                                  'kimchi-unittest-netfs')
+            get_storage_server_index(inst.conn).invalidate()
+
+            self.assertIn('192.0.2.1', inst.storageservers_get_list())
+            self.assertIn('192.0.2.1', inst.storageservers_get_list('netfs'))
+            self.assertNotIn('192.0.2.1',
+                             inst.storageservers_get_list('scsi'))
+            self.assertEquals({'host': '192.0.2.1'},
+                              inst.storageserver_lookup('192.0.2.1'))
+
+        self.assertNotIn('192.0.2.1', inst.storageservers_get_list())
+        self.assertRaises(NotFoundError, inst.storageserver_lookup,
+                          '192.0.2.1')
+
     @unittest.skipUnless(utils.running_as_root(), 'Must be run as root')
     def test_storagevolume(self):
         inst = model.Model('qemu:///system', self.tmp_store)
@@ -358,21 +435,41 @@ class ModelTests(unittest.TestCase):
             self.assertIn(name, vols)
             self.assertEquals(num, len(vols))
 
-            inst.storagevolume_wipe(pool, vol)
+            task = inst.storagevolume_wipe(pool, vol)
+            self._wait_task(inst, task['id'])
+            self.assertEquals('finished',
+                              inst.task_lookup(task['id'])['status'])
             volinfo = inst.storagevolume_lookup(pool, vol)
             self.assertEquals(0, volinfo['allocation'])
             self.assertEquals(0, volinfo['ref_cnt'])
 
+            # Wiping a qcow2 volume keeps it a valid qcow2 image
+            qcow2_vol = 'test-volume.qcow2'
+            params = {'name': qcow2_vol, 'capacity': 1024,
+                      'allocation': 0, 'format': 'qcow2'}
+            inst.storagevolumes_create(pool, params)
+            rollback.prependDefer(inst.storagevolume_delete, pool, qcow2_vol)
+            task = inst.storagevolume_wipe(pool, qcow2_vol)
+            self._wait_task(inst, task['id'])
+            self.assertEquals('finished',
+                              inst.task_lookup(task['id'])['status'])
+            volinfo = inst.storagevolume_lookup(pool, qcow2_vol)
+            self.assertEquals('qcow2', volinfo['format'])
+            self.assertEquals(1024 << 20, volinfo['capacity'])
+
             volinfo = inst.storagevolume_lookup(pool, vol)
             # Define the size = capacity + 16M
             capacity = volinfo['capacity'] >> 20
             size = capacity + 16
-            inst.storagevolume_resize(pool, vol, size)
+            task = inst.storagevolume_resize(pool, vol, size)
+            self._wait_task(inst, task['id'])
+            self.assertEquals('finished',
+                              inst.task_lookup(task['id'])['status'])
 
             volinfo = inst.storagevolume_lookup(pool, vol)
             self.assertEquals((1024 + 16) << 20, volinfo['capacity'])
             poolinfo = inst.storagepool_lookup(pool)
-            self.assertEquals(len(vols), poolinfo['nr_volumes'])
+            self.assertEquals(len(vols) + 1, poolinfo['nr_volumes'])
 
     @unittest.skipUnless(utils.running_as_root(), 'Must be run as root')
     def test_template_storage_customise(self):
@@ -492,6 +589,8 @@ class ModelTests(unittest.TestCase):
                       'storagepool': '/storagepools/test-pool'}
             inst.templates_create(params)
             rollback.prependDefer(inst.template_delete, 'test')
+            integrity = get_integrity_context(inst.conn)
+            self.assertIn(net_name, integrity.networks())
 
             # Try to delete network
             # It should fail as it is associated to a template
@@ -500,11 +599,72 @@ class ModelTests(unittest.TestCase):
             params = {'networks': []}
             inst.template_update('test', params)
             inst.network_delete(net_name)
+            # Templates see the deletion right away
+            self.assertNotIn(net_name, integrity.networks())
 
             shutil.rmtree(path)
             info = inst.template_lookup('test')
             self.assertEquals(info['invalid']['cdrom'], [iso])
 
+    def test_template_integrity_context(self):
+        calls = []
+
+        class FakePool(object):
+            def isActive(self):
+                return True
+
+            def listVolumes(self):
+                calls.append('listVolumes')
+                return ['base.img']
+
+        class FakeConn(object):
+            def get(self):
+                return self
+
+            def __getattr__(self, name):
+                def call(*args):
+                    calls.append(name)
+                    return {'listNetworks': ['default'],
+                            'storagePoolLookupByName': FakePool()}.get(name,
+                                                                       [])
+                return call
+
+        def check_url_path(path):
+            calls.append('check_url_path')
+            return False
+
+        orig_check_url_path = templates.check_url_path
+        templates.check_url_path = check_url_path
+        try:
+            integrity = IntegrityContext(FakeConn(), ttl=60)
+            iso = 'http://mirror/kimchi-missing.iso'
+            for i in xrange(10):
+                t = LibvirtVMTemplate({'name': 'test%d' % i, 'cdrom': iso,
+                                       'networks': ['default', 'net%d' % i],
+                                       'disks': [{'volume': 'base.img'}],
+                                       'storagepool':
+                                       '/storagepools/default'},
+                                      integrity=integrity)
+                info = t.validate_integrity()
+                self.assertEquals(['net%d' % i], info['invalid']['networks'])
+                self.assertEquals(['default'],
+                                  info['invalid']['storagepools'])
+                self.assertEquals([iso], info['invalid']['cdrom'])
+                self.assertNotIn('disks', info['invalid'])
+        finally:
+            templates.check_url_path = orig_check_url_path
+
+        # Each resource was looked up once for all the templates
+        self.assertEquals(['check_url_path', 'listDefinedNetworks',
+                           'listDefinedStoragePools', 'listNetworks',
+                           'listStoragePools', 'listVolumes',
+                           'storagePoolLookupByName'], sorted(calls))
+
+        # Until a resource is created or deleted
+        integrity.invalidate()
+        integrity.networks()
+        self.assertEquals(9, len(calls))
+
     @unittest.skipUnless(utils.running_as_root(), 'Must be run as root')
     def test_template_clone(self):
         inst = model.Model('qemu:///system',
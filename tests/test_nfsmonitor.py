@@ -0,0 +1,86 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import unittest
+
+
+from kimchi import nfsmonitor
+from kimchi.basemodel import Singleton
+from kimchi.nfsmonitor import NFSMonitor
+
+
+class NFSMonitorTests(unittest.TestCase):
+    def setUp(self):
+        self.reachable = set(['nfs-up'])
+        self.probes = []
+
+        def probe(server):
+            self.probes.append(server)
+            return server in self.reachable
+
+        Singleton._instances.pop(NFSMonitor, None)
+        self.monitor = NFSMonitor(probe, background=False)
+
+    def tearDown(self):
+        Singleton._instances.pop(NFSMonitor, None)
+
+    def test_cached_state(self):
+        # Unknown until the background thread has probed the servers
+        self.assertEquals(None, self.monitor.is_online('nfs-up'))
+        self.assertEquals(None, self.monitor.is_online('nfs-down'))
+        self.assertEquals([], self.probes)
+        self.monitor._check_servers()
+
+        self.assertTrue(self.monitor.is_online('nfs-up'))
+        self.assertFalse(self.monitor.is_online('nfs-down'))
+        self.monitor._check_servers()
+        self.assertTrue(self.monitor.is_online('nfs-up'))
+        # Each server is only probed once, further reads hit the cache
+        self.assertEquals(['nfs-down', 'nfs-up'], sorted(self.probes))
+        status = self.monitor.status('nfs-down')
+        self.assertFalse(status['online'])
+        self.assertTrue(status['timestamp'] > 0)
+
+    def test_unwatch(self):
+        self.monitor.watch('nfs-up')
+        self.monitor.unwatch('nfs-up')
+        self.monitor._check_servers()
+        self.assertEquals([], self.probes)
+
+        # A probe completing after unwatch() does not add the server back
+        self.monitor._update('nfs-down', False)
+        self.assertFalse('nfs-down' in self.monitor._servers)
+
+    def test_backoff(self):
+        self.monitor.watch('nfs-down')
+        self.monitor._check_servers()
+        backoffs = []
+        for i in xrange(7):
+            self.monitor._servers['nfs-down']['next_check'] = 0
+            self.monitor._check_servers()
+            backoffs.append(self.monitor._servers['nfs-down']['backoff'])
+        self.assertEquals(nfsmonitor.MAX_BACKOFF, backoffs[-1])
+        self.assertEquals(sorted(backoffs), backoffs)
+
+        # Backoff is reset once the server is back online
+        self.reachable.add('nfs-down')
+        self.monitor._servers['nfs-down']['next_check'] = 0
+        self.monitor._check_servers()
+        self.assertTrue(self.monitor.is_online('nfs-down'))
+        self.assertEquals(0, self.monitor._servers['nfs-down']['backoff'])
@@ -0,0 +1,161 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+
+import libvirt
+import os
+import tempfile
+import unittest
+
+
+from kimchi.model.resourceindex import ResourceIndex
+from kimchi.objectstore import ObjectStore
+
+
+DOMAIN_XML = """
+<domain type='kvm'>
+  <name>%(name)s</name>
+  <devices>
+    <disk type='file' device='disk'>
+      <source file='%(disk)s'/>
+    </disk>
+    <interface type='network'>
+      <source network='%(network)s'/>
+    </interface>
+  </devices>
+</domain>
+"""
+
+
+class FakeDomain(object):
+    def __init__(self, name, disk, network):
+        self._name = name
+        self.disk = disk
+        self.network = network
+
+    def name(self):
+        return self._name
+
+    def XMLDesc(self, flags):
+        return DOMAIN_XML % {'name': self._name, 'disk': self.disk,
+                             'network': self.network}
+
+
+class FakeConnection(object):
+    def __init__(self, events=True):
+        self.events = events
+        self.domains = {}
+        self.event_cb = None
+        self.lookups = 0
+
+    def get(self):
+        return self
+
+    def domainEventRegisterAny(self, dom, event_id, cb, opaque):
+        if not self.events:
+            raise libvirt.libvirtError('Events not supported')
+        self.event_cb = cb
+
+    def listAllDomains(self, flags):
+        return self.domains.values()
+
+    def lookupByName(self, name):
+        self.lookups += 1
+        try:
+            return self.domains[name]
+        except KeyError:
+            raise libvirt.libvirtError('Domain not found: %s' % name)
+
+    def define(self, name, disk, network='default'):
+        self.domains[name] = FakeDomain(name, disk, network)
+        if self.event_cb is not None:
+            self.event_cb(self, self.domains[name],
+                          libvirt.VIR_DOMAIN_EVENT_DEFINED, 0, None)
+
+    def undefine(self, name):
+        dom = self.domains.pop(name)
+        if self.event_cb is not None:
+            self.event_cb(self, dom, libvirt.VIR_DOMAIN_EVENT_UNDEFINED, 0,
+                          None)
+
+
+class ResourceIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_store = tempfile.mktemp()
+        self.objstore = ObjectStore(self.tmp_store)
+        with self.objstore as session:
+            session.store('template', 'test-tmpl',
+                          {'storagepool': '/storagepools/default',
+                           'networks': ['default']})
+        self.conn = FakeConnection()
+        self.conn.define('vm-1', '/images/vm-1.img')
+
+    def tearDown(self):
+        os.unlink(self.tmp_store)
+
+    def test_build(self):
+        index = ResourceIndex(self.conn, self.objstore)
+        self.assertEquals(['vm-1'], index.vms_using_volume('/images/vm-1.img'))
+        self.assertEquals(['vm-1'], index.vms_attached_to_network('default'))
+        self.assertEquals([], index.vms_attached_to_network('other'))
+        self.assertEquals(['test-tmpl'], index.templates_using_pool('default'))
+        self.assertEquals(['test-tmpl'],
+                          index.templates_using_network('default'))
+
+    def test_domain_events(self):
+        index = ResourceIndex(self.conn, self.objstore)
+        self.assertEquals(['vm-1'], index.vms_attached_to_network('default'))
+
+        # Events are only applied on the next query, no libvirt call is
+        # made from the event loop
+        self.conn.define('vm-2', '/images/vm-2.img')
+        self.assertEquals(0, self.conn.lookups)
+        self.assertEquals(['vm-1', 'vm-2'],
+                          index.vms_attached_to_network('default'))
+        self.assertEquals(['vm-2'], index.vms_using_volume('/images/vm-2.img'))
+
+        self.conn.undefine('vm-1')
+        self.assertEquals([], index.vms_using_volume('/images/vm-1.img'))
+        self.assertEquals(['vm-2'], index.vms_attached_to_network('default'))
+
+    def test_invalidate_vm(self):
+        index = ResourceIndex(self.conn, self.objstore)
+        self.assertEquals(['vm-1'], index.vms_using_volume('/images/vm-1.img'))
+
+        # Device changes raise no lifecycle event
+        self.conn.domains['vm-1'].disk = '/images/new.img'
+        self.assertEquals(['vm-1'], index.vms_using_volume('/images/vm-1.img'))
+        index.invalidate_vm('vm-1')
+        self.assertEquals([], index.vms_using_volume('/images/vm-1.img'))
+        self.assertEquals(['vm-1'], index.vms_using_volume('/images/new.img'))
+
+        # A VM undefined since it was invalidated is removed
+        del self.conn.domains['vm-1']
+        index.invalidate_vm('vm-1')
+        self.assertEquals([], index.vms_attached_to_network('default'))
+
+    def test_no_events(self):
+        self.conn.events = False
+        index = ResourceIndex(self.conn, self.objstore)
+        self.assertEquals(['vm-1'], index.vms_attached_to_network('default'))
+
+        # Rebuilt on each query
+        self.conn.domains['vm-1'].network = 'other'
+        self.assertEquals([], index.vms_attached_to_network('default'))
+        self.assertEquals(['vm-1'], index.vms_attached_to_network('other'))
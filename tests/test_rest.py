@@ -704,6 +704,29 @@ class RestTests(unittest.TestCase):
         count = len(json.loads(self.request('/vms').read()))
         self.assertEquals(5, count)
 
+    def test_create_vms_batch(self):
+        req = json.dumps({'name': 'test', 'cdrom': '/nonexistent.iso'})
+        resp = self.request('/templates', req, 'POST')
+        self.assertEquals(201, resp.status)
+
+        # The name pattern must contain %d
+        req = json.dumps({'template': '/templates/test', 'name': 'lab',
+                          'count': 3})
+        resp = self.request('/vms', req, 'POST')
+        self.assertEquals(400, resp.status)
+
+        req = json.dumps({'template': '/templates/test', 'name': 'lab-%d',
+                          'count': 3})
+        resp = self.request('/vms', req, 'POST')
+        self.assertEquals(202, resp.status)
+        task = json.loads(resp.read())
+        self._wait_task(task['id'])
+        task = json.loads(self.request('/tasks/%s' % task['id']).read())
+        self.assertEquals('finished', task['status'])
+
+        vms = [vm['name'] for vm in json.loads(self.request('/vms').read())]
+        self.assertEquals(['lab-1', 'lab-2', 'lab-3'], vms)
+
     def test_create_vm_without_template(self):
         req = json.dumps({'name': 'vm-without-template'})
         resp = self.request('/vms', req, 'POST')
@@ -845,6 +868,15 @@ class RestTests(unittest.TestCase):
         storagevolumes = json.loads(resp.read())
         self.assertEquals(5, len(storagevolumes))
 
+        resp = self.request('/storagepools/pool-1/storagevolumes'
+                            '?_sort=-name&_offset=1&_limit=2')
+        storagevolumes = json.loads(resp.read())
+        self.assertEquals(['volume-3', 'volume-2'],
+                          [vol['name'] for vol in storagevolumes])
+
+        resp = self.request('/storagepools/pool-1/storagevolumes?_limit=a')
+        self.assertEquals(400, resp.status)
+
         resp = self.request('/storagepools/pool-1/storagevolumes/volume-1')
         storagevolume = json.loads(resp.read())
         self.assertEquals('volume-1', storagevolume['name'])
@@ -883,6 +915,8 @@ class RestTests(unittest.TestCase):
         req = json.dumps({'size': 768})
         uri = '/storagepools/pool-2/storagevolumes/test-volume/resize'
         resp = self.request(uri, req, 'POST')
+        self.assertEquals(202, resp.status)
+        self._wait_task(json.loads(resp.read())['id'])
         uri = '/storagepools/pool-2/storagevolumes/test-volume'
         storagevolume = json.loads(self.request(uri).read())
         self.assertEquals(768, storagevolume['capacity'])
@@ -890,10 +924,69 @@ class RestTests(unittest.TestCase):
         # Wipe the storage volume
         uri = '/storagepools/pool-2/storagevolumes/test-volume/wipe'
         resp = self.request(uri, '{}', 'POST')
+        self.assertEquals(202, resp.status)
+        self._wait_task(json.loads(resp.read())['id'])
         uri = '/storagepools/pool-2/storagevolumes/test-volume'
         storagevolume = json.loads(self.request(uri).read())
         self.assertEquals(0, storagevolume['allocation'])
 
+        # Upload the volume content, resume the upload and download it
+        uri = '/storagepools/pool-2/storagevolumes/test-volume/content'
+        headers = {'Content-Type': 'application/octet-stream',
+                   'Accept': 'application/json'}
+        resp = self.request(uri, 'kimchi', 'PUT', headers)
+        # The body has a Content-Length: the task is in its final state
+        self.assertEquals(200, resp.status)
+        self.assertEquals('finished', json.loads(resp.read())['status'])
+        headers['Content-Range'] = 'bytes 6-13/14'
+        resp = self.request(uri, ' content', 'PUT', headers)
+        self.assertEquals(200, resp.status)
+        self.assertEquals('finished', json.loads(resp.read())['status'])
+
+        resp = self.request(uri, None, 'GET', {})
+        self.assertEquals(200, resp.status)
+        self.assertEquals('kimchi content', resp.read())
+        resp = self.request(uri, None, 'GET', {'Range': 'bytes=7-'})
+        self.assertEquals(206, resp.status)
+        self.assertEquals('bytes 7-13/14', resp.getheader('Content-Range'))
+        self.assertEquals('content', resp.read())
+        resp = self.request(uri, None, 'GET', {'Range': 'bytes=20-'})
+        self.assertEquals(416, resp.status)
+
+        # Chunked uploads have no Content-Length
+        class ChunkedBody(object):
+            def __init__(self, chunks):
+                self.data = ''.join('%x\r\n%s\r\n' % (len(chunk), chunk)
+                                    for chunk in chunks) + '0\r\n\r\n'
+
+            def read(self, size):
+                data, self.data = self.data[:size], self.data[size:]
+                return data
+
+        del headers['Content-Range']
+        headers['Transfer-Encoding'] = 'chunked'
+        resp = self.request(uri, ChunkedBody(['KIM', 'CHI']), 'PUT', headers)
+        self.assertEquals(202, resp.status)
+        task = json.loads(resp.read())
+        self.assertEquals('/storagepools/pool-2/storagevolumes/test-volume',
+                          task['target_uri'])
+        self._wait_task(task['id'])
+        resp = self.request(uri, None, 'GET', {})
+        self.assertEquals('KIMCHI content', resp.read())
+
+        # Clone the storage volume
+        uri = '/storagepools/pool-2/storagevolumes/test-volume/clone'
+        resp = self.request(uri, json.dumps({'name': 'test-clone'}), 'POST')
+        self.assertEquals(202, resp.status)
+        task = json.loads(resp.read())
+        self._wait_task(task['id'])
+        uri = '/storagepools/pool-2/storagevolumes/test-clone'
+        storagevolume = json.loads(self.request(uri).read())
+        self.assertEquals('test-clone', storagevolume['name'])
+        self.assertEquals(0, storagevolume['ref_cnt'])
+        resp = self.request(uri, '{}', 'DELETE')
+        self.assertEquals(204, resp.status)
+
         # Delete the storage volume
         resp = self.request('/storagepools/pool-2/storagevolumes/test-volume',
                             '{}', 'DELETE')
@@ -18,9 +18,13 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
 import libxml2
+import threading
 import unittest
 
 
+from kimchi.control import storagepools
+from kimchi.control.storagepools import StoragePools
+from kimchi.exception import NotFoundError
 from kimchi.model.libvirtstoragepool import StoragePoolDef
 from kimchi.rollbackcontext import RollbackContext
 
@@ -173,3 +177,101 @@ class storagepoolTests(unittest.TestCase):
                                      options=libxml2.XML_PARSE_NOBLANKS)
                 rollback.prependDefer(t2.freeDoc)
                 self.assertEquals(t1.serialize(), t2.serialize())
+
+
+class FakePoolsModel(object):
+    """
+    Model whose storage pool lookups block while their pool is in 'hung'.
+    """
+    def __init__(self, pools):
+        self.pools = pools
+        self.hung = {}
+        self.lookups = []
+
+    def storagepools_get_list(self):
+        return sorted(self.pools)
+
+    def storagepool_lookup(self, name):
+        self.lookups.append(name)
+        if name in self.hung:
+            self.hung[name].wait()
+        if name not in self.pools:
+            raise NotFoundError("KCHPOOL0002E", {'name': name})
+        return dict(self.pools[name])
+
+    def isopool_lookup(self, name):
+        return {'state': 'active', 'type': 'kimchi-iso'}
+
+
+class StoragePoolsListingTests(unittest.TestCase):
+    def setUp(self):
+        info = {'state': 'active', 'path': '/var/lib/images',
+                'source': {}, 'type': 'dir', 'autostart': True,
+                'capacity': 1024, 'allocated': 512, 'available': 512,
+                'nr_volumes': 2, 'persistent': True}
+        self.model = FakePoolsModel({'pool-a': info, 'pool-b': info})
+        self.collection = StoragePools(self.model)
+        self.orig_deadline = storagepools.POOL_LOOKUP_DEADLINE
+        storagepools.POOL_LOOKUP_DEADLINE = 0.1
+
+    def tearDown(self):
+        storagepools.POOL_LOOKUP_DEADLINE = self.orig_deadline
+        # Free the shared workers
+        for event in self.model.hung.values():
+            event.set()
+
+    def _list(self):
+        resources = self.collection._get_resources({})
+        return dict((res.ident, res.data) for res in resources)
+
+    def _hang(self, name):
+        self.model.hung[name] = threading.Event()
+
+    def test_deadline(self):
+        self._hang('pool-b')
+        pools = self._list()
+        self.assertEquals(['kimchi_isos', 'pool-a', 'pool-b'], sorted(pools))
+        self.assertEquals('active', pools['pool-a']['state'])
+        self.assertTrue(pools['pool-a']['lookup_latency'] >= 0)
+        self.assertFalse('stale' in pools['pool-a'])
+
+        # Never answered: reported with empty values
+        self.assertEquals('unknown', pools['pool-b']['state'])
+        self.assertTrue(pools['pool-b']['stale'])
+        self.assertEquals(0, pools['pool-b']['capacity'])
+        self.assertFalse('lookup_latency' in pools['pool-b'])
+
+    def test_last_info(self):
+        self._list()
+        self._hang('pool-b')
+        pools = self._list()
+        self.assertEquals('unknown', pools['pool-b']['state'])
+        self.assertTrue(pools['pool-b']['stale'])
+        # The last known values are kept
+        self.assertEquals(1024, pools['pool-b']['capacity'])
+        self.assertEquals('/var/lib/images', pools['pool-b']['path'])
+        self.assertFalse('lookup_latency' in pools['pool-b'])
+
+    def test_hung_pool_skipped(self):
+        self._hang('pool-b')
+        self._list()
+        pools = self._list()
+        self.assertTrue(pools['pool-b']['stale'])
+        # No other lookup is queued behind the hung one
+        self.assertEquals(1, self.model.lookups.count('pool-b'))
+        self.assertEquals(2, self.model.lookups.count('pool-a'))
+
+        # Looked up again once the first lookup is over
+        self.model.hung.pop('pool-b').set()
+        result = self.collection.running_lookups['pool-b']
+        result.wait()
+        pools = self._list()
+        self.assertEquals('active', pools['pool-b']['state'])
+        self.assertEquals(2, self.model.lookups.count('pool-b'))
+
+    def test_pool_not_found(self):
+        # Removed between listing and lookup
+        self.model.storagepools_get_list = lambda: ['pool-a', 'pool-c']
+        pools = self._list()
+        self.assertEquals(['kimchi_isos', 'pool-a'], sorted(pools))
+        self.assertEquals({}, self.collection.running_lookups)
@@ -0,0 +1,99 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import threading
+import time
+import unittest
+
+
+from kimchi.model.storagetargets import TargetsCache
+
+
+class TargetsCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.probes = []
+
+    def _probe(self, delay=0):
+        def probe():
+            self.probes.append(time.time())
+            time.sleep(delay)
+            return [{'target': '/export/%d' % len(self.probes)}]
+        return probe
+
+    def test_ttl(self):
+        cache = TargetsCache(ttl=60)
+        key = ('nfs-server', 'netfs')
+        first = cache.get(key, self._probe())
+        self.assertEquals(first, cache.get(key, self._probe()))
+        self.assertEquals(1, len(self.probes))
+
+        # refresh probes the server again and updates the cache
+        second = cache.get(key, self._probe(), refresh=True)
+        self.assertNotEquals(first, second)
+        self.assertEquals(second, cache.get(key, self._probe()))
+        self.assertEquals(2, len(self.probes))
+
+        cache.ttl = 0
+        cache.get(key, self._probe())
+        self.assertEquals(3, len(self.probes))
+
+    def test_single_flight(self):
+        cache = TargetsCache()
+        results = []
+
+        def discover():
+            results.append(cache.get(('nfs-server', 'netfs'),
+                                     self._probe(delay=0.5)))
+
+        threads = [threading.Thread(target=discover) for i in xrange(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(1, len(self.probes))
+        self.assertEquals([results[0]] * 5, results)
+
+    def test_failed_probe(self):
+        cache = TargetsCache(ttl=60, negative_ttl=60)
+        key = ('nfs-server', 'netfs')
+
+        def fail():
+            self.probes.append(time.time())
+            raise OSError('showmount failed')
+
+        def unreachable():
+            self.probes.append(time.time())
+            return None
+
+        # Errors are not cached
+        self.assertRaises(OSError, cache.get, key, fail)
+        self.assertRaises(OSError, cache.get, key, fail)
+        self.assertEquals(2, len(self.probes))
+
+        # Unreachable servers are, for the negative TTL only
+        self.assertEquals([], cache.get(key, unreachable))
+        self.assertEquals([], cache.get(key, self._probe()))
+        self.assertEquals(3, len(self.probes))
+        cache.negative_ttl = 0
+        self.assertEquals([{'target': '/export/4'}],
+                          cache.get(key, self._probe()))
+        self.assertEquals([{'target': '/export/4'}],
+                          cache.get(key, self._probe()))
+        self.assertEquals(4, len(self.probes))
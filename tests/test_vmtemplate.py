@@ -17,14 +17,99 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 
+import os
 import unittest
 import uuid
 
 
+from lxml import etree
+
+
+from kimchi import vmtemplate
 from kimchi.vmtemplate import VMTemplate
 from kimchi.xmlutils import xpath_get_text
 
 
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'golden')
+GOLDEN_UUID = '8a4a2c4e-3e5f-4c1c-9d7b-0a1e2f3c4d5e'
+
+# Every field used to generate the domain XML is given, so the output does
+# not depend on the osinfo defaults of the host architecture
+GOLDEN_INFO = {'name': 'golden', 'domain': 'kvm', 'arch': 'x86_64',
+               'memory': 1024, 'cpus': 1, 'cdrom': '/var/lib/isos/f20.iso',
+               'cdrom_bus': 'ide', 'cdrom_index': 2,
+               'disks': [{'index': 0, 'size': 10}], 'disk_bus': 'virtio',
+               'networks': ['default'], 'nic_model': 'virtio',
+               'graphics': {'type': 'vnc', 'listen': '0.0.0.0'},
+               'mouse_bus': 'ps2', 'sound_model': 'ich6'}
+
+STREAM_ISO = 'http://192.168.122.1:8080/isos/f20.iso'
+
+# Name: (template info overrides, storage pool type, to_vm_xml() arguments)
+GOLDEN_CASES = {
+    'local-cdrom': ({}, 'dir', {}),
+    'spice-multi': ({'disks': [{'index': 0, 'size': 10},
+                               {'index': 1, 'size': 20}],
+                     'networks': ['default', 'isolated'],
+                     'mouse_bus': 'usb', 'kbd_bus': 'usb'}, 'dir',
+                    {'graphics': {'type': 'spice', 'listen': '127.0.0.1'}}),
+    'logical': ({'disk_bus': 'ide', 'nic_model': 'e1000',
+                 'cpus': 4, 'memory': 4096}, 'logical', {}),
+    'scsi-luns': ({}, 'iscsi',
+                  {'volumes': [('lun0', '/dev/disk/by-path/lun-0'),
+                               ('lun1', '/dev/disk/by-path/lun-1')]}),
+    'fc-luns': ({'fc_host_support': True}, 'scsi',
+                {'volumes': [('lun0', '/dev/disk/by-id/wwn-0')]}),
+    'libvirt-stream': ({'iso_stream': True, 'cdrom': STREAM_ISO}, 'dir',
+                       {'libvirt_stream': True, 'qemu_stream_dns': True}),
+    'qemu-stream': ({'iso_stream': True, 'cdrom': STREAM_ISO}, 'dir',
+                    {'libvirt_stream': False, 'qemu_stream_dns': False}),
+    'power': ({'arch': 'ppc64', 'memory': 1280, 'cdrom_bus': 'scsi',
+               'disk_bus': 'scsi', 'nic_model': 'spapr-vlan',
+               'mouse_bus': 'usb', 'kbd_bus': 'usb', 'sound_model': None},
+              'dir', {}),
+}
+
+
+class GoldenTemplate(VMTemplate):
+    def __init__(self, overrides, storage_type):
+        info = dict(GOLDEN_INFO, **overrides)
+        self.info = dict((k, v) for k, v in info.iteritems()
+                         if v is not None)
+        self.name = self.info['name']
+        self.fc_host_support = self.info.get('fc_host_support')
+        self.storage_type = storage_type
+
+    def _get_storage_path(self):
+        return '/var/lib/libvirt/images'
+
+    def _get_storage_type(self):
+        return self.storage_type
+
+
+def golden_xml(case):
+    overrides, storage_type, kwargs = GOLDEN_CASES[case]
+    t = GoldenTemplate(overrides, storage_type)
+    return t.to_vm_xml('golden-vm', GOLDEN_UUID, **kwargs)
+
+
+def canonical_xml(xml):
+    """
+    Return 'xml' in canonical form, without the whitespace used to indent
+    it, so equivalent documents compare equal.
+    """
+    if isinstance(xml, unicode):
+        xml = xml.encode('utf-8')
+    root = etree.fromstring(xml)
+    for elem in root.iter():
+        if elem.text is not None and not elem.text.strip():
+            elem.text = None
+        if elem.tail is not None and not elem.tail.strip():
+            elem.tail = None
+    return etree.tostring(root, method='c14n')
+
+
 class VMTemplateTests(unittest.TestCase):
     def test_minimal_construct(self):
         fields = (('name', 'test'), ('os_distro', 'unknown'),
@@ -79,6 +164,25 @@ class VMTemplateTests(unittest.TestCase):
         expr = "/domain/devices/graphics/@listen"
         self.assertEquals(graphics['listen'], xpath_get_text(xml, expr)[0])
 
+    def test_iso_proxy(self):
+        class FakeIsoProxy(object):
+            def register(self, url):
+                return 'http://127.0.0.1:64668/0123/fedora.iso'
+
+        vm_uuid = str(uuid.uuid4()).replace('-', '')
+        t = VMTemplate({'name': 'test-template', 'iso_stream': True,
+                        'cdrom': 'https://mirror.example.com/fedora.iso'})
+        xml = t.to_vm_xml('test-vm', vm_uuid, libvirt_stream=True,
+                          iso_proxy=FakeIsoProxy())
+        expr = "/domain/devices/disk[@device='cdrom']/source/"
+        self.assertEquals('http', xpath_get_text(xml, expr + "@protocol")[0])
+        self.assertEquals('/0123/fedora.iso',
+                          xpath_get_text(xml, expr + "@name")[0])
+        self.assertEquals('127.0.0.1',
+                          xpath_get_text(xml, expr + "host/@name")[0])
+        self.assertEquals('64668',
+                          xpath_get_text(xml, expr + "host/@port")[0])
+
     def test_arg_merging(self):
         """
         Make sure that default parameters from osinfo do not override user-
@@ -94,3 +198,83 @@ class VMTemplateTests(unittest.TestCase):
         self.assertEquals(['foo'], t.info.get('networks'))
         self.assertEquals('/cd.iso', t.info.get('cdrom'))
         self.assertEquals(graphics, t.info.get('graphics'))
+
+    def test_linked_clone_volumes(self):
+        class BaseVolumeTemplate(VMTemplate):
+            def _get_storage_path(self):
+                return '/var/lib/libvirt/images'
+
+            def _get_volume_info(self, name):
+                return {'path': '/var/lib/libvirt/images/%s' % name,
+                        'capacity': 12 << 30, 'format': 'qcow2'}
+
+        args = {'name': 'test', 'disks': [{'size': 10, 'volume': 'base.img'},
+                                          {'size': 20}]}
+        t = BaseVolumeTemplate(args)
+        overlay, disk = t.to_volume_list('vm-uuid')
+        self.assertEquals('/var/lib/libvirt/images/base.img', overlay['base'])
+        self.assertEquals(12, overlay['capacity'])
+        self.assertEquals(['/var/lib/libvirt/images/base.img'],
+                          xpath_get_text(overlay['xml'],
+                                         "/volume/backingStore/path"))
+        self.assertEquals(['qcow2'],
+                          xpath_get_text(overlay['xml'],
+                                         "/volume/backingStore/format/@type"))
+        self.assertNotIn('base', disk)
+        self.assertEquals([], xpath_get_text(disk['xml'],
+                                             "/volume/backingStore"))
+
+
+class DomainXMLTests(unittest.TestCase):
+    def test_golden_files(self):
+        for case in sorted(GOLDEN_CASES):
+            with open(os.path.join(GOLDEN_DIR, case + '.xml')) as f:
+                expected = canonical_xml(f.read())
+            # The second document is generated from the cached skeleton
+            for i in xrange(2):
+                self.assertEquals(expected, canonical_xml(golden_xml(case)),
+                                  'Domain XML differs from %s.xml' % case)
+
+    def test_vm_parts(self):
+        overrides, storage_type, kwargs = GOLDEN_CASES['spice-multi']
+        t = GoldenTemplate(overrides, storage_type)
+        for name in ['vm-1', 'vm-2', 'R&D <test>']:
+            vm_uuid = str(uuid.uuid4())
+            xml = t.to_vm_xml(name, vm_uuid, **kwargs)
+            self.assertEquals([name], xpath_get_text(xml, "/domain/name"))
+            self.assertEquals([vm_uuid], xpath_get_text(xml, "/domain/uuid"))
+            expr = "/domain/devices/disk[@device='disk']/source/@file"
+            self.assertEquals(['/var/lib/libvirt/images/%s-%s.img' %
+                               (vm_uuid, i) for i in (0, 1)],
+                              xpath_get_text(xml, expr))
+
+        # A new version of the template gets a new skeleton
+        t.info['memory'] = 2048
+        xml = t.to_vm_xml('vm-3', GOLDEN_UUID, **kwargs)
+        self.assertEquals(['2048'], xpath_get_text(xml, "/domain/memory"))
+
+    def test_skeleton_cache(self):
+        builds = []
+
+        class CountingTemplate(GoldenTemplate):
+            def _build_domain(self, *args):
+                builds.append(self.info['memory'])
+                return super(CountingTemplate, self)._build_domain(*args)
+
+        overrides, storage_type, kwargs = GOLDEN_CASES['spice-multi']
+        t = CountingTemplate(overrides, storage_type)
+        t.info['memory'] = 4096
+        for i in xrange(20):
+            t.to_vm_xml('vm-%d' % i, str(uuid.uuid4()), **kwargs)
+        self.assertEquals([4096], builds)
+
+        # The skeletons of the template versions used last are kept
+        for memory in xrange(4097, 4097 + vmtemplate.DOMAIN_CACHE_SIZE):
+            t.info['memory'] = memory
+            t.to_vm_xml('vm', GOLDEN_UUID, **kwargs)
+        self.assertEquals(vmtemplate.DOMAIN_CACHE_SIZE + 1, len(builds))
+        t.to_vm_xml('vm', GOLDEN_UUID, **kwargs)
+        self.assertEquals(vmtemplate.DOMAIN_CACHE_SIZE + 1, len(builds))
+        t.info['memory'] = 4096
+        t.to_vm_xml('vm', GOLDEN_UUID, **kwargs)
+        self.assertEquals(vmtemplate.DOMAIN_CACHE_SIZE + 2, len(builds))
@@ -0,0 +1,101 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import os
+import tempfile
+import time
+import unittest
+
+
+from kimchi import volumeio
+
+
+MB = 1024 * 1024
+
+
+class VolumeIOTests(unittest.TestCase):
+    def setUp(self):
+        self.src = tempfile.mktemp()
+        self.dst = tempfile.mktemp()
+        # 8MB file with data at 1MB and 6MB only
+        with open(self.src, 'w') as f:
+            f.truncate(8 * MB)
+            f.seek(MB)
+            f.write('a' * MB)
+            f.seek(6 * MB)
+            f.write('b' * 1000)
+        with open(self.dst, 'w') as f:
+            f.write('stale data')
+
+    def tearDown(self):
+        for path in (self.src, self.dst):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def test_data_extents(self):
+        fd = os.open(self.src, os.O_RDONLY)
+        try:
+            extents = list(volumeio.data_extents(fd, 8 * MB))
+        finally:
+            os.close(fd)
+        data = sum(length for start, length in extents)
+        # File systems report data at block granularity, or the whole file
+        # without SEEK_DATA support
+        self.assertTrue(MB + 1000 <= data <= 8 * MB)
+
+    def test_copy_sparse_file(self):
+        throttle = volumeio.Throttle()
+        volumeio.copy_sparse_file(self.src, self.dst, throttle)
+        self.assertEquals(open(self.src).read(), open(self.dst).read())
+        self.assertTrue(throttle.done <= 8 * MB)
+        self.assertTrue(os.stat(self.dst).st_blocks <=
+                        os.stat(self.src).st_blocks)
+
+    def test_throttle(self):
+        reports = []
+        throttle = volumeio.Throttle(10, reports.append)
+        start = time.time()
+        for i in xrange(5):
+            throttle.consume(MB)
+        # 5MB at 10MB/s
+        self.assertTrue(time.time() - start >= 0.45)
+        self.assertEquals([MB], reports)
+
+    def test_maybe_qcow2(self):
+        self.assertFalse(volumeio.maybe_qcow2(self.src))
+        with open(self.dst, 'w') as f:
+            f.write(volumeio.QCOW2_MAGIC + '\0\0\0\3')
+        self.assertTrue(volumeio.maybe_qcow2(self.dst))
+        os.unlink(self.dst)
+        self.assertTrue(volumeio.maybe_qcow2(self.dst))
+
+    def test_zero_file(self):
+        with open(self.dst, 'w') as f:
+            f.write('a' * (2 * MB + 10))
+        throttle = volumeio.Throttle()
+        volumeio.zero_file(self.dst, throttle)
+        self.assertEquals('\0' * (2 * MB + 10), open(self.dst).read())
+        self.assertEquals(2 * MB + 10, throttle.done)
+
+        # Sparse files are only truncated
+        throttle = volumeio.Throttle()
+        volumeio.zero_file(self.src, throttle)
+        self.assertEquals(8 * MB, os.path.getsize(self.src))
+        self.assertEquals(0, os.stat(self.src).st_blocks)
+        self.assertEquals(0, throttle.done)
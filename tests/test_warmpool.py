@@ -0,0 +1,131 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+
+
+from kimchi.model.warmpool import storage_signature, WarmPool
+from kimchi.objectstore import ObjectStore
+
+
+class FakeWarmPool(WarmPool):
+    """
+    Warm pool provisioning disk sets without any volume.
+    """
+    def __init__(self, objstore):
+        super(FakeWarmPool, self).__init__(None, objstore, background=False)
+        self.provisioned = 0
+        self.deleted = []
+
+    def _provision(self, name):
+        with self.objstore as session:
+            info = session.get('template', name)
+        self.provisioned += 1
+        return {'uuid': str(uuid.uuid4()),
+                'signature': storage_signature(info),
+                'volumes': []}
+
+    def _delete_disks(self, disk_set):
+        self.deleted.append(disk_set)
+
+
+class WarmPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_store = tempfile.mktemp()
+        self.objstore = ObjectStore(self.tmp_store)
+        self.info = {'storagepool': '/storagepools/default',
+                     'disks': [{'index': 0, 'size': 1}],
+                     'warm_pool': 2}
+        with self.objstore as session:
+            session.store('template', 'test', self.info)
+        self.pool = FakeWarmPool(self.objstore)
+
+    def tearDown(self):
+        os.unlink(self.tmp_store)
+
+    def _reserve(self):
+        with self.objstore as session:
+            return session.get('warmpool', 'test')
+
+    def _wait(self, condition, timeout=5):
+        for i in xrange(timeout * 10):
+            if condition():
+                return
+            time.sleep(0.1)
+
+    def test_claim(self):
+        self.pool.refill()
+        sets = self._reserve()
+        self.assertEquals(2, len(sets))
+
+        self.assertEquals(sets[0]['uuid'], self.pool.claim('test', self.info))
+        # Replaced without waiting for the next interval
+        self._wait(lambda: len(self._reserve()) == 2)
+        self.assertEquals(3, self.pool.provisioned)
+        self.assertFalse(sets[0] in self._reserve())
+
+        # Only sets matching the template storage are handed out
+        info = dict(self.info, disks=[{'index': 0, 'size': 2}])
+        self.assertEquals(None, self.pool.claim('test', info))
+
+    def test_changed_template(self):
+        self.pool.refill()
+        old_sets = self._reserve()
+        info = dict(self.info, disks=[{'index': 0, 'size': 2}])
+        with self.objstore as session:
+            session.store('template', 'test', info)
+        self.pool.refill()
+        sets = self._reserve()
+        self.assertEquals(2, len(sets))
+        self.assertEquals([storage_signature(info)] * 2,
+                          [s['signature'] for s in sets])
+        # The sets provisioned for the previous version are deleted
+        self.assertEquals(old_sets, self.pool.deleted)
+
+    def test_claim_during_refill(self):
+        started = threading.Event()
+        resume = threading.Event()
+        refill = self.pool._refill
+        calls = []
+
+        def blocking_refill():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                started.set()
+                resume.wait()
+            refill()
+
+        self.pool._refill = blocking_refill
+        thread = threading.Thread(target=self.pool.refill)
+        thread.start()
+        started.wait()
+
+        # Requested while the first refill runs: it goes again once done
+        self.pool.refill()
+        self.assertEquals(1, len(calls))
+        resume.set()
+        thread.join()
+        self.assertEquals(2, len(calls))
+        self.assertEquals(2, len(self._reserve()))
@@ -0,0 +1,112 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2014
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import unittest
+
+
+from kimchi import xmlutils
+from kimchi.model.networks import NetworkModel
+from kimchi.model.vms import GRAPHICS_XPATHS
+from kimchi.xmlutils import xpath_compile, xpath_get_text, xpath_get_texts
+
+
+NETWORK_XML = """
+<network>
+  <name>kimchi-net</name>
+  <forward mode='nat'>
+    <interface dev='eth0'/>
+    <interface dev='eth1'/>
+  </forward>
+  <bridge name='virbr1' stp='on' delay='0'/>
+  <ip address='192.168.122.1' netmask='255.255.255.0'>
+    <dhcp>
+      <range start='192.168.122.129' end='192.168.122.254'/>
+    </dhcp>
+  </ip>
+</network>
+"""
+
+DOMAIN_XML = """
+<domain type='kvm'>
+  <devices>
+    <graphics type='spice' autoport='yes' listen='127.0.0.1'/>
+    <graphics type='vnc' port='5901' autoport='yes' listen='0.0.0.0'/>
+    <graphics type='spice' port='5900' autoport='yes' listen='0.0.0.0'/>
+  </devices>
+</domain>
+"""
+
+
+class XPathTests(unittest.TestCase):
+    def test_get_texts(self):
+        xpaths = xpath_compile({'name': '/network/name',
+                                'ifaces': '/network/forward/interface/@dev',
+                                'pf': '/network/forward/pf/@dev'})
+        res = xpath_get_texts(NETWORK_XML, xpaths)
+        self.assertEquals({'name': ['kimchi-net'], 'ifaces': ['eth0', 'eth1'],
+                           'pf': []}, res)
+        self.assertEquals(res, xpath_get_texts(unicode(NETWORK_XML), xpaths))
+
+    def test_get_texts_values(self):
+        xml = (u"<domain><name>caf\xe9</name><title/>"
+               u"<description lang=''>cr\xe8me</description></domain>")
+        exprs = {'name': '/domain/name', 'title': '/domain/title',
+                 'desc': '/domain/description', 'missing': '/domain/uuid',
+                 'lang': '/domain/description/@lang'}
+        res = xpath_get_texts(xml, xpath_compile(exprs))
+        # As xpath_get_text() does: UTF-8 strings, None when empty
+        self.assertEquals({'name': ['caf\xc3\xa9'], 'title': [None],
+                           'desc': ['cr\xc3\xa8me'], 'missing': [],
+                           'lang': [None]}, res)
+        self.assertTrue(isinstance(res['name'][0], str))
+        for name, expr in exprs.iteritems():
+            self.assertEquals(xpath_get_text(xml.encode('utf-8'), expr),
+                              res[name])
+
+    def test_network(self):
+        network = NetworkModel.get_network_from_xml(NETWORK_XML)
+        self.assertEquals('192.168.122.1/255.255.255.0', network['subnet'])
+        self.assertEquals({'start': '192.168.122.129',
+                           'end': '192.168.122.254'}, network['dhcp'])
+        self.assertEquals('virbr1', network['bridge'])
+        self.assertEquals({'mode': 'nat', 'interface': ['eth0', 'eth1'],
+                           'pf': []}, network['forward'])
+
+    def test_graphics(self):
+        # The port is the one of the first device of the first type
+        res = xpath_get_texts(DOMAIN_XML, GRAPHICS_XPATHS)
+        self.assertEquals(['spice', 'vnc', 'spice'], res['type'])
+        self.assertEquals('127.0.0.1', res['listen'][0])
+        self.assertEquals(['5900'], res['port'])
+
+    def test_single_parse(self):
+        parses = []
+        orig_fromstring = xmlutils.etree.fromstring
+
+        def counting_fromstring(*args, **kwargs):
+            parses.append(args[0])
+            return orig_fromstring(*args, **kwargs)
+
+        xmlutils.etree.fromstring = counting_fromstring
+        try:
+            NetworkModel.get_network_from_xml(NETWORK_XML)
+        finally:
+            xmlutils.etree.fromstring = orig_fromstring
+        # All the expressions are evaluated on a single parse
+        self.assertEquals([NETWORK_XML], parses)